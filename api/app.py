@@ -2,6 +2,7 @@
 This module defines the main FastAPI application for Money Manager.
 """
 
+import asyncio
 from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional
@@ -12,16 +13,43 @@ from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from api.routers import accounts, analytics, categories, expenses, users
-from config import API_BIND_HOST, API_BIND_PORT
+from api.routers import (
+    accounts,
+    analytics,
+    categories,
+    currency,
+    expenses,
+    imports,
+    users,
+)
+from api.utils import charts, csv_import, db, indexes
+from api.utils.auth import token_cache
+from api.utils.context import resolve_context
+from api.utils.currency import rate_service
+from config import (
+    API_BIND_HOST,
+    API_BIND_PORT,
+    CHART_JS_INTEGRITY,
+    CHART_JS_URL,
+    MONGO_ENSURE_INDEXES,
+)
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     """Lifespan function that handles app startup and shutdown"""
+    # One pooled MongoDB client shared by every router
+    db.connect()
+    # Parse the exchange rate history before the first request needs it
+    await asyncio.to_thread(rate_service.load)
+    if MONGO_ENSURE_INDEXES:
+        await indexes.ensure_indexes(db.get_database())
+    # Pick up background imports left behind by a previous worker
+    await csv_import.resume_import_jobs()
     yield
+    charts.renderer.shutdown()
     # Handles the shutdown event to close the MongoDB client
-    await users.shutdown_db_client()
+    db.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -31,13 +59,19 @@ app.mount("/backgrounds", StaticFiles(directory="docs/backgrounds"), name="backg
 
 # templates
 templates = Jinja2Templates(directory="api/templates")
+templates.env.globals["chart_js"] = {
+    "src": CHART_JS_URL,
+    "integrity": CHART_JS_INTEGRITY,
+}
 
 # routers for different functionalities
 app.include_router(users.router)
 app.include_router(accounts.router)
 app.include_router(categories.router)
 app.include_router(expenses.router)
+app.include_router(imports.router)
 app.include_router(analytics.router)
+app.include_router(currency.router)
 
 
 # default web app route
@@ -83,7 +117,8 @@ async def landing_page(request: Request, token: Optional[str] = Header(None)):
         return RedirectResponse(url="/login", status_code=302)
 
     try:
-        username = await users.get_username(token)
+        context = await resolve_context(request, token)
+        username = await context.username()
         return templates.TemplateResponse(
             "accounts.html", {"request": request, "username": username}
         )
@@ -99,7 +134,8 @@ async def category(request: Request, token: Optional[str] = Header(None)):
         return RedirectResponse(url="/login", status_code=302)
 
     try:
-        username = await users.get_username(token)
+        context = await resolve_context(request, token)
+        username = await context.username()
         return templates.TemplateResponse(
             "categories.html", {"request": request, "username": username}
         )
@@ -115,7 +151,8 @@ async def expense(request: Request, token: Optional[str] = Header(None)):
         return RedirectResponse(url="/login", status_code=302)
 
     try:
-        username = await users.get_username(token)
+        context = await resolve_context(request, token)
+        username = await context.username()
         return templates.TemplateResponse(
             "expenses.html", {"request": request, "username": username}
         )
@@ -131,7 +168,8 @@ async def barchart(request: Request, token: Optional[str] = Header(None)):
         return RedirectResponse(url="/login", status_code=302)
 
     try:
-        username = await users.get_username(token)
+        context = await resolve_context(request, token)
+        username = await context.username()
         return templates.TemplateResponse(
             "barchart.html", {"request": request, "username": username}
         )
@@ -147,7 +185,8 @@ async def piechart(request: Request, token: Optional[str] = Header(None)):
         return RedirectResponse(url="/login", status_code=302)
 
     try:
-        username = await users.get_username(token)
+        context = await resolve_context(request, token)
+        username = await context.username()
         return templates.TemplateResponse(
             "piechart.html", {"request": request, "username": username}
         )
@@ -155,6 +194,16 @@ async def piechart(request: Request, token: Optional[str] = Header(None)):
         return RedirectResponse(url="/landing", status_code=302)
 
 
+@app.get("/metrics")
+async def metrics():
+    """Report the chart renderer queue and the chart and token caches of this worker"""
+    return {
+        "chart_renderer": charts.renderer.stats(),
+        "chart_cache": analytics.chart_cache.stats(),
+        "token_cache": token_cache.stats(),
+    }
+
+
 @app.get("/docs/logo/MoneyManagerLOGO.png")
 async def get_image():
     """loads the site logo"""
@@ -5,20 +5,18 @@ This module provides account-related API routes for the Money Manager applicatio
 from typing import Optional
 
 from bson import ObjectId
-from fastapi import APIRouter, Header, HTTPException
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 
-from config import MONGO_URI
-
-from .users import verify_token
+from api.utils.context import RequestContext, get_request_context
+from api.utils.csv_import import PENDING_DEBITS
+from api.utils.db import accounts_collection, expenses_collection
+from api.utils.profiles import invalidate_user_profile
 
 router = APIRouter(prefix="/accounts", tags=["Accounts"])
 
-# MongoDB setup
-client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI)
-db = client.mmdb
-accounts_collection = db.accounts
+# Bookkeeping fields of an account that are not part of its details
+ACCOUNT_PROJECTION = {PENDING_DEBITS: 0}
 
 
 class AccountCreate(BaseModel):
@@ -38,18 +36,20 @@ class AccountUpdate(BaseModel):
 
 
 @router.post("/")
-async def create_account(account: AccountCreate, token: str = Header(None)):
+async def create_account(
+    account: AccountCreate, context: RequestContext = Depends(get_request_context)
+):
     """
     Create a new account for the authenticated user.
 
     Args:
         account (AccountCreate): The account details.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: A message confirming the account creation.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     existing_account = await accounts_collection.find_one(
         {"user_id": user_id, "name": account.name}
     )
@@ -65,6 +65,7 @@ async def create_account(account: AccountCreate, token: str = Header(None)):
     }
 
     result = await accounts_collection.insert_one(account_data)
+    await invalidate_user_profile(user_id)
     if result.inserted_id:
         return {
             "message": "Account created successfully",
@@ -75,18 +76,20 @@ async def create_account(account: AccountCreate, token: str = Header(None)):
 
 
 @router.get("/")
-async def get_accounts(token: str = Header(None)):
+async def get_accounts(context: RequestContext = Depends(get_request_context)):
     """
     Get all accounts for the authenticated user.
 
     Args:
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: A list of all accounts for the user.
     """
-    user_id = await verify_token(token)
-    accounts = await accounts_collection.find({"user_id": user_id}).to_list(100)
+    user_id = context.user_id
+    accounts = await accounts_collection.find(
+        {"user_id": user_id}, ACCOUNT_PROJECTION
+    ).to_list(100)
     if not accounts:
         raise HTTPException(status_code=404, detail="No accounts found for the user")
 
@@ -98,20 +101,22 @@ async def get_accounts(token: str = Header(None)):
 
 
 @router.get("/{account_id}")
-async def get_account(account_id: str, token: str = Header(None)):
+async def get_account(
+    account_id: str, context: RequestContext = Depends(get_request_context)
+):
     """
     Get details of a specific account for the authenticated user.
 
     Args:
         account_id (str): The account ID.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: The account details.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     account = await accounts_collection.find_one(
-        {"_id": ObjectId(account_id), "user_id": user_id}
+        {"_id": ObjectId(account_id), "user_id": user_id}, ACCOUNT_PROJECTION
     )
 
     if not account:
@@ -125,7 +130,9 @@ async def get_account(account_id: str, token: str = Header(None)):
 
 @router.put("/{account_id}")
 async def update_account(
-    account_id: str, account_update: AccountUpdate, token: str = Header(None)
+    account_id: str,
+    account_update: AccountUpdate,
+    context: RequestContext = Depends(get_request_context),
 ):
     """
     Edit an existing account for the authenticated user.
@@ -133,12 +140,12 @@ async def update_account(
     Args:
         account_id (str): The account ID.
         account_update (AccountUpdate): The updated account details.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: A message confirming the account update.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     account = await accounts_collection.find_one(
         {"_id": ObjectId(account_id), "user_id": user_id}
     )
@@ -147,6 +154,16 @@ async def update_account(
         raise HTTPException(status_code=404, detail="Account not found")
     if account_update.currency:
         account_update.currency = account_update.currency.upper()
+    # Expenses store their amount in the account's currency, which a new
+    # currency would make wrong
+    new_currency = account_update.currency not in (None, account["currency"])
+    if new_currency and await expenses_collection.find_one(
+        {"user_id": user_id, "account_name": account["name"]}, {"_id": 1}
+    ):
+        raise HTTPException(
+            status_code=409,
+            detail="Cannot change the currency of an account with expenses",
+        )
 
     # Update account details (balance, currency, and name)
     update_data = {
@@ -158,6 +175,7 @@ async def update_account(
     result = await accounts_collection.update_one(
         {"_id": ObjectId(account_id)}, {"$set": update_data}
     )
+    await invalidate_user_profile(user_id)
 
     if result.modified_count == 1:
         return {"message": "Account updated successfully"}
@@ -166,18 +184,20 @@ async def update_account(
 
 
 @router.delete("/{account_id}")
-async def delete_account(account_id: str, token: str = Header(None)):
+async def delete_account(
+    account_id: str, context: RequestContext = Depends(get_request_context)
+):
     """
     Delete an existing account for the authenticated user.
 
     Args:
         account_id (str): The account ID.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: A message confirming the account deletion.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     account = await accounts_collection.find_one(
         {"_id": ObjectId(account_id), "user_id": user_id}
     )
@@ -186,6 +206,7 @@ async def delete_account(account_id: str, token: str = Header(None)):
         raise HTTPException(status_code=404, detail="Account not found")
 
     result = await accounts_collection.delete_one({"_id": ObjectId(account_id)})
+    await invalidate_user_profile(user_id)
 
     if result.deleted_count == 1:
         return {"message": "Account deleted successfully"}
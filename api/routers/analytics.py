@@ -1,91 +1,296 @@
 """
 This module provides analytics endpoints for retrieving and visualizing
 expense data. It includes routes to generate visualizations for expenses
-from a specified number of days.
+from a specified number of days, and JSON time series that the web UI
+draws client-side.
 """
 
 import base64
-import io
-from datetime import datetime, timedelta
+import hashlib
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from enum import Enum
+from typing import Any, Optional
 
-import matplotlib.pyplot as plt
-import pandas as pd
-from fastapi import APIRouter, Header, HTTPException
-from fastapi.responses import HTMLResponse
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import HTMLResponse, JSONResponse
 
-from api.utils.auth import verify_token
-from config import MONGO_URI
-
-# MongoDB setup
-client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI)
-db = client.mmdb
-expenses_collection = db.expenses
+from api.routers.expenses import convert_currency_batch
+from api.utils.cache import ByteLRUCache, TTLCache
+from api.utils.charts import render_bar_chart, render_pie_chart, renderer
+from api.utils.context import RequestContext, get_request_context
+from api.utils.db import expenses_collection, rollups_collection
+from api.utils.rollups import rollup_match, rollups_ready
+from api.utils.versions import get_data_version
+from config import (
+    BUDGET_CACHE_MAXSIZE,
+    BUDGET_CACHE_TTL_SECONDS,
+    CHART_CACHE_MAX_BYTES,
+)
 
 router = APIRouter(prefix="/analytics", tags=["Analytics"])
 
+# Group keys for the expense aggregation pipelines
+DAY_KEY = {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}
+WEEK_KEY = {"$dateToString": {"format": "%G-W%V", "date": "$date"}}
+MONTH_KEY = {"$dateToString": {"format": "%Y-%m", "date": "$date"}}
+CATEGORY_KEY = "$category"
+ACCOUNT_KEY = "$account_name"
+# Amount of an expense in its account's currency, for expenses that predate the
+# stored field its own amount
+ACCOUNT_AMOUNT = {"$ifNull": ["$amount_in_account_currency", "$amount"]}
+
+# The same group keys over the rollups collection, and whether they can be
+# answered from month rollups
+ROLLUP_KEYS: list[tuple[Any, Any, bool]] = [
+    (DAY_KEY, "$period", False),
+    (
+        WEEK_KEY,
+        {
+            "$dateToString": {
+                "format": "%G-W%V",
+                "date": {"$dateFromString": {"dateString": "$period"}},
+            }
+        },
+        False,
+    ),
+    (MONTH_KEY, {"$substrCP": ["$period", 0, 7]}, True),
+    (CATEGORY_KEY, "$category", True),
+    (ACCOUNT_KEY, "$account_name", True),
+]
+
+
+class SeriesGrouping(str, Enum):
+    """Buckets supported by the JSON series endpoint."""
+
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+    CATEGORY = "category"
+    ACCOUNT = "account"
+
+
+SERIES_KEYS = {
+    SeriesGrouping.DAY: DAY_KEY,
+    SeriesGrouping.WEEK: WEEK_KEY,
+    SeriesGrouping.MONTH: MONTH_KEY,
+    SeriesGrouping.CATEGORY: CATEGORY_KEY,
+    SeriesGrouping.ACCOUNT: ACCOUNT_KEY,
+}
+
+# Rendered PNGs keyed by (user_id, chart_kind, x_days, data_version, day)
+chart_cache = ByteLRUCache(max_bytes=CHART_CACHE_MAX_BYTES)
+# Spending per category keyed by (user_id, month, currency, data_version)
+budget_cache = TTLCache(maxsize=BUDGET_CACHE_MAXSIZE, ttl=BUDGET_CACHE_TTL_SECONDS)
+
+
+async def chart_cache_key(user_id: str, chart_kind: str, x_days: int, *params) -> tuple:
+    """
+    Build the cache key of a chart or series.
+
+    The current day is part of the key because the x_days window moves with
+    time even when the user's expenses do not change.
+    """
+    data_version = await get_data_version(user_id)
+    today = datetime.now(timezone.utc).date()
+    return (user_id, chart_kind, x_days, *params, data_version, today)
+
+
+def chart_etag(key: tuple) -> str:
+    """Derive a stable ETag from a chart cache key."""
+    return '"' + hashlib.sha256(repr(key).encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+def window_start(x_days: int) -> date:
+    """Return the first of the last x_days calendar days (UTC), today included."""
+    return datetime.now(timezone.utc).date() - timedelta(days=x_days - 1)
+
+
+async def aggregate_expenses(
+    user_id: str, x_days: int, group_key, currency: Optional[str] = None
+) -> tuple[list[str], list[float]]:
+    """
+    Sum a user's expenses from the last x_days calendar days inside MongoDB.
+
+    Args:
+        user_id (str): Owner of the expenses.
+        x_days (int): The number of days to look back for expense data.
+        group_key: Aggregation expression to group the expenses by.
+        currency (str): Optional currency to normalise the totals to; without
+            it the stored account-currency amounts are summed.
+
+    Returns:
+        tuple: Bucket labels and their total amounts, sorted by label.
+    """
+    return await sum_expenses(
+        user_id, group_key, window_start(x_days), currency=currency
+    )
+
+
+async def expense_source(
+    user_id: str,
+    group_key,
+    first_day: date,
+    end_day: Optional[date],
+    currency: Optional[str],
+) -> tuple[Any, dict, dict[str, Any]]:
+    """
+    Pick where sum_expenses reads a window of a user's expenses from.
+
+    Once a user's rollups are complete the totals are read from their day
+    and month rollups instead of the expenses themselves.
+
+    Returns:
+        tuple: The collection, its $match stage and the expressions of the
+        group key, the account-currency amount, the amount in its own
+        currency and the day of each document.
+    """
+    rollup_key = next(
+        (
+            (key, months)
+            for expense_key, key, months in ROLLUP_KEYS
+            if expense_key == group_key
+        ),
+        None,
+    )
+    if rollup_key is not None and await rollups_ready(user_id):
+        key, months = rollup_key
+        match = rollup_match(user_id, first_day, months and not currency, end_day)
+        # Rollup totals are already in their account's currency
+        return (
+            rollups_collection,
+            {"$match": match},
+            {"group": key, "amount": "$total", "source": "$total", "day": "$period"},
+        )
+
+    window = {"$gte": datetime.combine(first_day, time())}
+    if end_day is not None:
+        window["$lt"] = datetime.combine(end_day, time())
+    return (
+        expenses_collection,
+        {"$match": {"user_id": user_id, "date": window}},
+        {
+            "group": group_key,
+            "amount": ACCOUNT_AMOUNT,
+            "source": "$amount",
+            "day": DAY_KEY,
+        },
+    )
+
+
+async def sum_expenses(
+    user_id: str,
+    group_key,
+    first_day: date,
+    end_day: Optional[date] = None,
+    currency: Optional[str] = None,
+) -> tuple[list[str], list[float]]:
+    """
+    Sum a user's expenses from a window of days inside MongoDB.
+
+    Once a user's rollups are complete the totals are read from their day
+    and month rollups instead of the expenses themselves (see expense_source).
+
+    Args:
+        user_id (str): Owner of the expenses.
+        group_key: Aggregation expression to group the expenses by.
+        first_day (date): First day of the window (UTC).
+        end_day (Optional[date]): Day after the window; open-ended if None.
+        currency (str): Optional currency to normalise the totals to; without
+            it the stored account-currency amounts are summed.
+
+    Returns:
+        tuple: Bucket labels and their total amounts, sorted by label.
+    """
+    collection, match, fields = await expense_source(
+        user_id, group_key, first_day, end_day, currency
+    )
+    if currency is None:
+        pipeline = [
+            match,
+            {"$group": {"_id": fields["group"], "total": {"$sum": fields["amount"]}}},
+            {"$sort": {"_id": 1}},
+        ]
+        buckets = await collection.aggregate(pipeline).to_list(None)
+        return [str(b["_id"]) for b in buckets], [b["total"] for b in buckets]
+
+    # Keep one total per (bucket, currency, day) so each is converted once, at
+    # the rate of its day
+    pipeline = [
+        match,
+        {
+            "$group": {
+                "_id": {
+                    "bucket": fields["group"],
+                    "currency": "$currency",
+                    "day": fields["day"],
+                },
+                "total": {"$sum": fields["source"]},
+            }
+        },
+    ]
+    buckets = await collection.aggregate(pipeline).to_list(None)
+    converted = convert_currency_batch(
+        [b["total"] for b in buckets],
+        [b["_id"]["currency"] for b in buckets],
+        currency,
+        [b["_id"]["day"] for b in buckets],
+    )
+    totals: dict[str, float] = defaultdict(float)
+    for b, amount in zip(buckets, converted):
+        totals[str(b["_id"]["bucket"])] += float(amount)
+    labels = sorted(totals)
+    return labels, [totals[label] for label in labels]
+
 
 @router.get("/expense/bar", response_class=HTMLResponse)
-async def expense_bar(x_days: int, token: str = Header(None)):
+async def expense_bar(
+    x_days: int,
+    context: RequestContext = Depends(get_request_context),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Endpoint to generate a bar chart of daily expenses for the previous x_days.
     Args:
         x_days (int): The number of days to look back for expense data.
-        token (str): Authorization token for user verification.
+        context (RequestContext): The authenticated user.
+        if_none_match (str): ETag of a previously fetched chart.
     Returns:
-        HTMLResponse: An HTML page displaying the bar chart.
+        HTMLResponse: An HTML page displaying the bar chart, or an empty
+        304 response if the chart has not changed.
     """
     # Verify token and retrieve user_id
-    user_id = await verify_token(token)
+    user_id = context.user_id
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    # Define the date range filter for MongoDB query
-    date_filter = {
-        "date": {"$gte": datetime.now() - timedelta(days=x_days)},
-        "user_id": user_id,
-    }
-
-    # Fetch expenses data from MongoDB
-    expenses = await expenses_collection.find(date_filter).to_list(length=1000)
+    key = await chart_cache_key(user_id, "bar", x_days)
+    etag = chart_etag(key)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
-    if not expenses:
-        raise HTTPException(
-            status_code=404, detail="No expenses found for the specified period"
-        )
+    png = chart_cache.get(key)
+    if png is None:
+        # Total the expenses per day inside MongoDB
+        days, daily_totals = await aggregate_expenses(user_id, x_days, DAY_KEY)
 
-    # Convert to DataFrame and process data
-    df = pd.DataFrame(expenses)
-    df["date"] = pd.to_datetime(df["date"])
-    daily_expenses = df.groupby(df["date"].dt.date)["amount"].sum()
-
-    # Plotting the bar graph
-    plt.figure(figsize=(10, 6))
-    ax = daily_expenses.plot(kind="bar", color="skyblue")
-    plt.title(f"Total Expenses per Day (Last {x_days} Days)")
-    plt.xlabel("Date")
-    plt.ylabel("Total Expense Amount")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-
-    # Adding labels on top of each bar
-    for i, value in enumerate(daily_expenses):
-        ax.text(
-            i,
-            value + 0.5,
-            f"{value:.2f}",
-            ha="center",
-            va="bottom",
-            fontsize=10,
-            color="black",
-        )
+        if not days:
+            raise HTTPException(
+                status_code=404, detail="No expenses found for the specified period"
+            )
 
-    # Convert the plot to a base64-encoded image
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    plt.close()
-    buf.seek(0)
-    image_data = base64.b64encode(buf.getvalue()).decode("utf-8")
+        # Render the bar graph in the chart worker pool
+        png = await renderer.render(render_bar_chart, days, daily_totals, x_days)
+        chart_cache.set(key, png)
+    image_data = base64.b64encode(png).decode("utf-8")
 
     # Return the HTML response with the embedded image
     return HTMLResponse(
@@ -97,64 +302,55 @@ async def expense_bar(x_days: int, token: str = Header(None)):
                 <img src="data:image/png;base64,{image_data}" alt="Expense Bar Chart">
             </body>
         </html>
-        """
+        """,
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
     )
 
 
 @router.get("/expense/pie", response_class=HTMLResponse)
-async def expense_pie(x_days: int, token: str = Header(None)):
+async def expense_pie(
+    x_days: int,
+    context: RequestContext = Depends(get_request_context),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Endpoint to generate a pie chart of expenses categorized by type for the previous x_days.
     Args:
         x_days (int): The number of days to look back for expense data.
-        token (str): Authorization token for user verification.
+        context (RequestContext): The authenticated user.
+        if_none_match (str): ETag of a previously fetched chart.
     Returns:
-        HTMLResponse: An HTML page displaying the pie chart.
+        HTMLResponse: An HTML page displaying the pie chart, or an empty
+        304 response if the chart has not changed.
     """
     # Verify token and retrieve user_id
-    user_id = await verify_token(token)
+    user_id = context.user_id
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    # Define the date range filter for MongoDB query
-    date_filter = {
-        "date": {"$gte": datetime.now() - timedelta(days=x_days)},
-        "user_id": user_id,
-    }
-
-    # Fetch expenses data from MongoDB
-    expenses = await expenses_collection.find(date_filter).to_list(length=1000)
+    key = await chart_cache_key(user_id, "pie", x_days)
+    etag = chart_etag(key)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
-    if not expenses:
-        raise HTTPException(
-            status_code=404, detail="No expenses found for the specified period"
+    png = chart_cache.get(key)
+    if png is None:
+        # Group by category and sum the amounts inside MongoDB
+        categories, category_totals = await aggregate_expenses(
+            user_id, x_days, CATEGORY_KEY
         )
 
-    # Convert to DataFrame and process data
-    df = pd.DataFrame(expenses)
-    df["date"] = pd.to_datetime(df["date"])
-
-    # Group by category and sum the amounts
-    category_expenses = df.groupby("category")["amount"].sum()
-
-    # Plotting the pie chart
-    plt.figure(figsize=(8, 8))
-    plt.pie(
-        category_expenses,
-        labels=category_expenses.index.astype(str).tolist(),
-        autopct="%1.1f%%",
-        startangle=140,
-        colors=["#FF9999", "#FF4D4D", "#FF0000"],
-    )
-    plt.title(f"Expense Distribution by Category (Last {x_days} Days)")
-    plt.axis("equal")  # Equal aspect ratio ensures that pie chart is circular.
+        if not categories:
+            raise HTTPException(
+                status_code=404, detail="No expenses found for the specified period"
+            )
 
-    # Convert the plot to a base64-encoded image
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    plt.close()
-    buf.seek(0)
-    image_data = base64.b64encode(buf.getvalue()).decode("utf-8")
+        # Render the pie chart in the chart worker pool
+        png = await renderer.render(
+            render_pie_chart, categories, category_totals, x_days
+        )
+        chart_cache.set(key, png)
+    image_data = base64.b64encode(png).decode("utf-8")
 
     # Return the HTML response with the embedded image
     return HTMLResponse(
@@ -166,5 +362,127 @@ async def expense_pie(x_days: int, token: str = Header(None)):
                 <img src="data:image/png;base64,{image_data}" alt="Expense Pie Chart">
             </body>
         </html>
-        """
+        """,
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
     )
+
+
+@router.get("/series/{group_by}")
+async def expense_series(
+    group_by: SeriesGrouping,
+    x_days: int,
+    currency: Optional[str] = None,
+    context: RequestContext = Depends(get_request_context),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Endpoint to get aggregated expense totals for the previous x_days as JSON.
+    Args:
+        group_by (SeriesGrouping): Bucket by day, week, month, category or account.
+        x_days (int): The number of days to look back for expense data.
+        currency (str): Optional currency to convert all totals to.
+        context (RequestContext): The authenticated user.
+        if_none_match (str): ETag of a previously fetched series.
+    Returns:
+        dict: Bucket labels and their totals, or an empty 304 response if the
+        series has not changed.
+    """
+    user_id = context.user_id
+    if currency:
+        currency = currency.upper()
+
+    key = await chart_cache_key(user_id, "series", x_days, group_by.value, currency)
+    etag = chart_etag(key)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    labels, totals = await aggregate_expenses(
+        user_id, x_days, SERIES_KEYS[group_by], currency
+    )
+    if not labels:
+        raise HTTPException(
+            status_code=404, detail="No expenses found for the specified period"
+        )
+
+    return JSONResponse(
+        {
+            "group_by": group_by.value,
+            "x_days": x_days,
+            "currency": currency,
+            "labels": labels,
+            "totals": [round(total, 2) for total in totals],
+        },
+        headers=headers,
+    )
+
+
+def budget_line(budget: Optional[float], spent: float) -> dict:
+    """Compare spending with a monthly budget (None when there is no budget)."""
+    return {
+        "budget": budget,
+        "spent": round(spent, 2),
+        "remaining": None if budget is None else round(budget - spent, 2),
+        "percent": round(spent / budget * 100, 1) if budget else None,
+    }
+
+
+@router.get("/budget")
+async def budget_vs_actual(
+    month: Optional[str] = None,
+    currency: Optional[str] = None,
+    context: RequestContext = Depends(get_request_context),
+):
+    """
+    Endpoint to compare a month's spending with each category's monthly budget.
+    Args:
+        month (str): The month as YYYY-MM; the current month by default.
+        currency (str): Optional currency to convert the spending to; by
+            default amounts are summed in their accounts' currencies.
+        context (RequestContext): The authenticated user.
+    Returns:
+        dict: Budget, spent, remaining and percent spent per category, and
+        for all categories together. Categories without a budget that had
+        spending are listed with a null budget.
+    """
+    user_id = context.user_id
+    if month is None:
+        month = datetime.now(timezone.utc).strftime("%Y-%m")
+    try:
+        first_day = datetime.strptime(month, "%Y-%m").date()
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400, detail="Invalid month. Expected YYYY-MM"
+        ) from e
+    if currency:
+        currency = currency.upper()
+
+    key = (user_id, month, currency, await get_data_version(user_id))
+    spent = budget_cache.get(key)
+    if spent is None:
+        end_day = (first_day + timedelta(days=31)).replace(day=1)
+        categories, totals = await sum_expenses(
+            user_id, CATEGORY_KEY, first_day, end_day, currency
+        )
+        spent = dict(zip(categories, totals))
+        budget_cache.set(key, spent)
+
+    budgets = {
+        name: category.get("monthly_budget")
+        for name, category in (await context.categories()).items()
+    }
+    lines = [
+        {"category": name, **budget_line(budget, spent.get(name, 0.0))}
+        for name, budget in budgets.items()
+    ] + [
+        {"category": name, **budget_line(None, total)}
+        for name, total in spent.items()
+        if name not in budgets
+    ]
+    total_budget = sum(budget for budget in budgets.values() if budget)
+    return {
+        "month": month,
+        "currency": currency,
+        "categories": lines,
+        "total": budget_line(total_budget, sum(spent.values())),
+    }
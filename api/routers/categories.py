@@ -2,21 +2,35 @@
 This module provides endpoints for managing categories of a particular user.
 """
 
+import asyncio
+import json
+from typing import AsyncIterator
+
 from bson import ObjectId
-from fastapi import APIRouter, Header, HTTPException
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from config import MONGO_URI
-
-from .users import verify_token
+from api.utils.context import RequestContext, get_request_context
+from api.utils.db import expenses_collection, users_collection
+from api.utils.profiles import (
+    CATEGORIES_PROJECTION,
+    category_path,
+    decode_categories,
+    escape_category,
+    find_user,
+    invalidate_user_profile,
+)
+from api.utils.rollups import rename_category_rollups
+from api.utils.versions import bump_data_version
 
 router = APIRouter(prefix="/categories", tags=["Categories"])
 
-# MongoDB setup
-client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI)
-db = client.mmdb
-users_collection = db.users
+# How often a rename reports the progress of its expense update
+RENAME_PROGRESS_INTERVAL_SECONDS = 0.5
+
+# Running rename cascades, kept referenced until they finish
+rename_tasks: set[asyncio.Task] = set()
 
 
 class CategoryCreate(BaseModel):
@@ -32,42 +46,53 @@ class CategoryUpdate(BaseModel):
     monthly_budget: float
 
 
+class CategoryRename(BaseModel):
+    """Schema for renaming a category."""
+
+    new_name: str
+
+
 @router.post("/")
-async def create_category(category: CategoryCreate, token: str = Header(None)):
+async def create_category(
+    category: CategoryCreate, context: RequestContext = Depends(get_request_context)
+):
     """
     Create a new category for the authenticated user.
 
+    The entry is added with one update that only matches while the category
+    does not exist, so concurrent creations cannot overwrite each other.
+
     Args:
         category (CategoryCreate): Category details.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: A message confirming category creation.
     """
-    user_id = await verify_token(token)
-
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_id = context.user_id
+    path = category_path(category.name)
 
-    if "categories" not in user:
-        user["categories"] = {}
-
-    if category.name in user["categories"]:
-        raise HTTPException(status_code=400, detail="Category already exists")
-
-    user["categories"][category.name] = {"monthly_budget": category.monthly_budget}
-
-    await users_collection.update_one(
-        {"_id": ObjectId(user_id)}, {"$set": {"categories": user["categories"]}}
+    result = await users_collection.update_one(
+        {"_id": ObjectId(user_id), path: {"$exists": False}},
+        {"$set": {path: {"monthly_budget": category.monthly_budget}}},
     )
+    if result.matched_count == 0:
+        # Slow path: find out why the update did not match
+        if not await users_collection.count_documents(
+            {"_id": ObjectId(user_id)}, limit=1
+        ):
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=400, detail="Category already exists")
+    await invalidate_user_profile(user_id)
 
     return {"message": "Category created successfully"}
 
 
 @router.put("/{category_name}")
 async def update_category(
-    category_name: str, category_update: CategoryUpdate, token: str = Header(None)
+    category_name: str,
+    category_update: CategoryUpdate,
+    context: RequestContext = Depends(get_request_context),
 ):
     """
     Update an existing category's monthly budget.
@@ -75,92 +100,205 @@ async def update_category(
     Args:
         category_name (str): The name of the category to update.
         category_update (CategoryUpdate): New category details.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: A message confirming category update.
     """
-    user_id = await verify_token(token)
-
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user or "categories" not in user or category_name not in user["categories"]:
-        raise HTTPException(status_code=404, detail="Category not found")
+    user_id = context.user_id
+    path = category_path(category_name)
+    exists = {"_id": ObjectId(user_id), path: {"$exists": True}}
 
     if category_update.monthly_budget < 0:
+        if not await users_collection.count_documents(exists, limit=1):
+            raise HTTPException(status_code=404, detail="Category not found")
         raise HTTPException(status_code=400, detail="Monthly budget must be positive")
 
-    user["categories"][category_name]["monthly_budget"] = category_update.monthly_budget
-
-    await users_collection.update_one(
-        {"_id": ObjectId(user_id)}, {"$set": {"categories": user["categories"]}}
+    result = await users_collection.update_one(
+        exists, {"$set": {f"{path}.monthly_budget": category_update.monthly_budget}}
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Category not found")
+    await invalidate_user_profile(user_id)
 
     return {"message": "Category updated successfully"}
 
 
+async def cascade_rename(user_id: str, old_name: str, new_name: str) -> int:
+    """
+    Re-tag a user's expenses and rollups from one category to another.
+
+    Returns:
+        int: Number of expenses re-tagged.
+    """
+    try:
+        result = await expenses_collection.update_many(
+            {"user_id": user_id, "category": old_name},
+            {"$set": {"category": new_name}},
+        )
+        await rename_category_rollups(user_id, old_name, new_name)
+        return result.modified_count
+    finally:
+        await bump_data_version(user_id)
+
+
+def _progress_line(event: dict) -> bytes:
+    return (json.dumps(event) + "\n").encode()
+
+
+async def rename_progress(
+    user_id: str, old_name: str, total: int, task: asyncio.Task
+) -> AsyncIterator[bytes]:
+    """
+    Report the progress of a rename cascade as NDJSON until it finishes.
+
+    Progress is the number of expenses no longer tagged with the old name.
+    The cascade runs in its own task, so it completes even if the client
+    stops reading.
+    """
+    while not task.done():
+        await asyncio.wait({task}, timeout=RENAME_PROGRESS_INTERVAL_SECONDS)
+        if not task.done():
+            remaining = await expenses_collection.count_documents(
+                {"user_id": user_id, "category": old_name}
+            )
+            yield _progress_line(
+                {"status": "running", "renamed": total - remaining, "total": total}
+            )
+    if task.exception() is not None:
+        yield _progress_line({"status": "failed", "error": str(task.exception())})
+        return
+    yield _progress_line(
+        {"status": "completed", "renamed": task.result(), "total": total}
+    )
+
+
+@router.patch("/{category_name}/rename")
+async def rename_category(
+    category_name: str,
+    category_rename: CategoryRename,
+    context: RequestContext = Depends(get_request_context),
+):
+    """
+    Rename a category and re-tag every expense filed under it.
+
+    The budget entry is moved with one conditional $rename. The expenses are
+    then re-tagged with a single update_many on (user_id, category), the
+    rollups are moved to the new name and cached analytics are invalidated.
+
+    Args:
+        category_name (str): The current name of the category.
+        category_rename (CategoryRename): The new name.
+        context (RequestContext): The authenticated user.
+
+    Returns:
+        StreamingResponse: NDJSON progress events, the last of which has a
+        status of "completed" (with the number of expenses renamed) or
+        "failed".
+    """
+    user_id = context.user_id
+    new_name = category_rename.new_name
+    if new_name == category_name:
+        raise HTTPException(
+            status_code=400, detail="New name must differ from the current name"
+        )
+    old_path, new_path = category_path(category_name), category_path(new_name)
+
+    result = await users_collection.update_one(
+        {
+            "_id": ObjectId(user_id),
+            old_path: {"$exists": True},
+            new_path: {"$exists": False},
+        },
+        {"$rename": {old_path: new_path}},
+    )
+    if result.matched_count == 0:
+        if not await users_collection.count_documents(
+            {"_id": ObjectId(user_id), old_path: {"$exists": True}}, limit=1
+        ):
+            raise HTTPException(status_code=404, detail="Category not found")
+        raise HTTPException(status_code=400, detail="Category already exists")
+    await invalidate_user_profile(user_id)
+
+    total = await expenses_collection.count_documents(
+        {"user_id": user_id, "category": category_name}
+    )
+    task = asyncio.create_task(cascade_rename(user_id, category_name, new_name))
+    rename_tasks.add(task)
+    task.add_done_callback(rename_tasks.discard)
+    return StreamingResponse(
+        rename_progress(user_id, category_name, total, task),
+        media_type="application/x-ndjson",
+    )
+
+
 @router.get("/")
-async def get_all_categories(token: str = Header(None)):
+async def get_all_categories(context: RequestContext = Depends(get_request_context)):
     """
     Get all categories for the authenticated user.
 
     Args:
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: List of all categories.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
 
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    user = await find_user(user_id, CATEGORIES_PROJECTION)
     if not user or "categories" not in user:
         return {"categories": []}
 
-    return {"categories": user["categories"]}
+    return {"categories": decode_categories(user["categories"])}
 
 
 @router.get("/{category_name}")
-async def get_category(category_name: str, token: str = Header(None)):
+async def get_category(
+    category_name: str, context: RequestContext = Depends(get_request_context)
+):
     """
     Get details of a specific category for the authenticated user.
 
     Args:
         category_name (str): The name of the category to fetch.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: The category details.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
 
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user or "categories" not in user or category_name not in user["categories"]:
+    key = escape_category(category_name)
+    # Only the requested entry of the categories map
+    user = await find_user(user_id, {category_path(category_name): 1})
+    if not user or "categories" not in user or key not in user["categories"]:
         raise HTTPException(status_code=404, detail="Category not found")
 
-    return {"category": user["categories"][category_name]}
+    return {"category": user["categories"][key]}
 
 
 @router.delete("/{category_name}")
-async def delete_category(category_name: str, token: str = Header(None)):
+async def delete_category(
+    category_name: str, context: RequestContext = Depends(get_request_context)
+):
     """
     Delete an existing category for the authenticated user.
 
     Args:
         category_name (str): The name of the category to delete.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: A message confirming category deletion.
     """
-    user_id = await verify_token(token)
-
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user or "categories" not in user or category_name not in user["categories"]:
-        raise HTTPException(status_code=404, detail="Category not found")
-
-    del user["categories"][category_name]
+    user_id = context.user_id
+    path = category_path(category_name)
 
-    await users_collection.update_one(
-        {"_id": ObjectId(user_id)}, {"$set": {"categories": user["categories"]}}
+    result = await users_collection.update_one(
+        {"_id": ObjectId(user_id), path: {"$exists": True}}, {"$unset": {path: ""}}
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Category not found")
+    await invalidate_user_profile(user_id)
 
     return {"message": "Category deleted successfully"}
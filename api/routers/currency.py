@@ -0,0 +1,62 @@
+"""
+This module provides currency conversion endpoints for the Money Manager application.
+"""
+
+import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+from api.routers.expenses import convert_currency_batch
+from api.utils.context import get_request_context
+from config import CURRENCY_BATCH_MAX_ITEMS
+
+router = APIRouter(prefix="/currency", tags=["Currency"])
+
+
+class BatchConversion(BaseModel):
+    """Schema for converting a list of amounts into one currency."""
+
+    amounts: list[float]
+    currencies: list[str]
+    to_currency: str
+    dates: Optional[list[Optional[datetime.date]]] = None
+
+
+@router.post("/convert/batch", dependencies=[Depends(get_request_context)])
+async def convert_batch(conversion: BatchConversion):
+    """
+    Convert many amounts, each in its own currency, into a single currency.
+
+    Args:
+        conversion (BatchConversion): Amounts, their currencies, the target
+            currency and optionally the date of each amount.
+
+    Returns:
+        dict: The converted amounts, in request order.
+    """
+    count = len(conversion.amounts)
+    if count > CURRENCY_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {CURRENCY_BATCH_MAX_ITEMS} amounts can be converted at once",
+        )
+    if len(conversion.currencies) != count or (
+        conversion.dates is not None and len(conversion.dates) != count
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="amounts, currencies and dates must have the same length",
+        )
+
+    converted = convert_currency_batch(
+        conversion.amounts,
+        [currency.upper() for currency in conversion.currencies],
+        conversion.to_currency.upper(),
+        conversion.dates,
+    )
+    return {
+        "to_currency": conversion.to_currency.upper(),
+        "amounts": converted.tolist(),
+    }
@@ -2,32 +2,48 @@
 This module provides endpoints for managing user expenses in the Money Manager application.
 """
 
+import base64
 import datetime
-import io
-from typing import Optional
+import json
+from collections import defaultdict
+from typing import Annotated, Optional
 
-import chardet
-import pandas as pd
 from bson import ObjectId
-from currency_converter import CurrencyConverter  # type: ignore
-from fastapi import APIRouter, File, Header, HTTPException, UploadFile
-from fastapi.responses import StreamingResponse
-from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel
-
-from api.utils.auth import verify_token
-from config import MONGO_URI
-
-currency_converter = CurrencyConverter()
+from bson.errors import BSONError, InvalidId
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from pydantic import BaseModel, Field
+from pymongo import DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+from api.utils import export
+from api.utils.bulk_expenses import debit_bulk_accounts, insert_bulk_expenses
+from api.utils.context import RequestContext, get_request_context
+from api.utils.currency import rate_service
+from api.utils.db import (
+    accounts_collection,
+    expenses_collection,
+    get_database,
+    transaction,
+)
+from api.utils.profiles import invalidate_user_profile
+from api.utils.rollups import (
+    delete_rollups,
+    move_rollups,
+    rebuild_user_rollups,
+    update_rollups,
+)
+from api.utils.versions import bump_data_version
+from config import BULK_EXPENSES_MAX_ITEMS
+
+currency_converter = rate_service
 
 router = APIRouter(prefix="/expenses", tags=["Expenses"])
 
-# MongoDB setup
-client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI)
-db = client.mmdb
-users_collection = db.users
-expenses_collection = db.expenses
-accounts_collection = db.accounts
+# Field holding an expense's amount in the currency of its account
+STORED_AMOUNT = "$amount_in_account_currency"
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 
 def format_id(document):
@@ -36,12 +52,53 @@ def format_id(document):
     return document
 
 
-def convert_currency(amount, from_cur, to_cur):
-    """Convert currency using the CurrencyConverter library."""
+def convert_currency(amount, from_cur, to_cur, date=None):
+    """Convert currency at the latest rate, or at the rate of the given date."""
     if from_cur == to_cur:
         return amount
     try:
-        return currency_converter.convert(amount, from_cur, to_cur)
+        if date is None:
+            return currency_converter.convert(amount, from_cur, to_cur)
+        return currency_converter.convert(amount, from_cur, to_cur, date)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400, detail=f"Currency conversion failed: {str(e)}"
+        ) from e
+
+
+def exchange_rate(from_cur, to_cur, date=None) -> float:
+    """Return the value of one unit of from_cur in to_cur on the given date."""
+    if from_cur == to_cur:
+        return 1.0
+    try:
+        return currency_converter.rate(from_cur, to_cur, date)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400, detail=f"Currency conversion failed: {str(e)}"
+        ) from e
+
+
+def account_amount(expense: dict, account_currency: str) -> float:
+    """
+    Return an expense's amount in its account's currency.
+
+    Uses the amount stored when the expense was written, falling back to a
+    conversion at the rate of the expense date for expenses that predate it.
+    """
+    stored = expense.get("amount_in_account_currency")
+    if stored is not None:
+        return stored
+    return convert_currency(
+        expense["amount"], expense["currency"], account_currency, expense.get("date")
+    )
+
+
+def convert_currency_batch(amounts, from_currencies, to_currencies, dates=None):
+    """Convert many amounts at once; see RateService.convert_batch."""
+    try:
+        return currency_converter.convert_batch(
+            amounts, from_currencies, to_currencies, dates
+        )
     except Exception as e:
         raise HTTPException(
             status_code=400, detail=f"Currency conversion failed: {str(e)}"
@@ -70,66 +127,66 @@ class ExpenseUpdate(BaseModel):
     date: Optional[datetime.datetime] = None
 
 
+def expense_error(profile: dict, expense: ExpenseCreate) -> Optional[str]:
+    """
+    Check an expense against a user profile.
+
+    Args:
+        profile (dict): The user profile (see api.utils.profiles).
+        expense (ExpenseCreate): Expense details, with an upper-cased currency.
+
+    Returns:
+        str: Why the expense is invalid, or None if it is valid.
+    """
+    if expense.account_name not in profile["accounts"]:
+        return "Invalid account type"
+    if expense.currency not in profile["currencies"]:
+        return (
+            f"Currency type is not added to user account. "
+            f"Available currencies are {profile['currencies']}"
+        )
+    if expense.category not in profile["categories"]:
+        return (
+            f"Category is not present in the user account. "
+            f"Available categories are {list(profile['categories'])}"
+        )
+    return None
+
+
 @router.post("/")
-async def add_expense(expense: ExpenseCreate, token: str = Header(None)):
+async def add_expense(
+    expense: ExpenseCreate, context: RequestContext = Depends(get_request_context)
+):
     """
     Add a new expense for the user.
 
+    The amount is converted into the account's currency at the rate of the
+    expense date and stored with the expense as amount_in_account_currency,
+    along with the exchange_rate used.
+    The account is debited with a single conditional $inc that only matches
+    while the balance covers the expense, so concurrent posts cannot
+    overdraw the account or lose updates.
+
     Args:
         expense (ExpenseCreate): Expense details.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Message with expense details and updated balance.
     """
-    user_id = await verify_token(token)
-    account = await accounts_collection.find_one(
-        {"user_id": user_id, "name": expense.account_name}
-    )
-    if not account:
-        raise HTTPException(status_code=400, detail="Invalid account type")
-
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
+    user_id = context.user_id
     expense.currency = expense.currency.upper()
-    if expense.currency not in user["currencies"]:
-        raise HTTPException(
-            status_code=400,
-            detail=(
-                f"Currency type is not added to user account. "
-                f"Available currencies are {user['currencies']}"
-            ),
-        )
-    converted_amount = convert_currency(
-        expense.amount, expense.currency, account["currency"]
-    )
 
-    if account["balance"] < converted_amount:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Insufficient balance in {expense.account_name} account",
-        )
-
-    if expense.category not in user["categories"]:
-        raise HTTPException(
-            status_code=400,
-            detail=(
-                f"Category is not present in the user account. "
-                f"Available categories are {list(user['categories'])}"
-            ),
-        )
-
-    # Deduct amount from user's account balance
-    new_balance = account["balance"] - converted_amount
-    await accounts_collection.update_one(
-        {"_id": account["_id"]}, {"$set": {"balance": new_balance}}
-    )
+    profile = await context.profile()
+    if expense_error(profile, expense):
+        # The cached profile may predate a new account, currency or category
+        profile = await context.profile(refresh=True)
+        error = expense_error(profile, expense)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
 
     # Convert date to datetime object or use current datetime if none is provided
     expense_date = expense.date or datetime.datetime.now(datetime.timezone.utc)
-    # Record the expense
     expense_data = expense.dict()
     expense_data.update(
         {
@@ -137,48 +194,377 @@ async def add_expense(expense: ExpenseCreate, token: str = Header(None)):
             "date": expense_date,
         }
     )
-    result = await expenses_collection.insert_one(expense_data)
+
+    async with transaction() as session:
+        # Retried once if the cached account currency turns out to be stale
+        for _ in range(2):
+            account_currency = profile["accounts"][expense.account_name]
+            rate = exchange_rate(expense.currency, account_currency, expense_date)
+            converted_amount = expense.amount * rate
+            account = await accounts_collection.find_one_and_update(
+                {
+                    "user_id": user_id,
+                    "name": expense.account_name,
+                    "currency": account_currency,
+                    "balance": {"$gte": converted_amount},
+                },
+                {"$inc": {"balance": -converted_amount}},
+                projection={"balance": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            if account:
+                break
+
+            # Slow path: find out why the debit did not match
+            await invalidate_user_profile(user_id)
+            current = await accounts_collection.find_one(
+                {"user_id": user_id, "name": expense.account_name},
+                {"currency": 1},
+                session=session,
+            )
+            if not current:
+                raise HTTPException(status_code=400, detail="Invalid account type")
+            if current["currency"] == account_currency:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient balance in {expense.account_name} account",
+                )
+            profile = await context.profile(refresh=True)
+        else:
+            raise HTTPException(
+                status_code=409, detail="Account changed concurrently, please retry"
+            )
+
+        expense_data["amount_in_account_currency"] = converted_amount
+        expense_data["exchange_rate"] = rate
+        try:
+            result = await expenses_collection.insert_one(expense_data, session=session)
+        except (PyMongoError, BSONError):
+            if session is None:
+                # No transaction to roll back, so undo the debit by hand
+                await accounts_collection.update_one(
+                    {"_id": account["_id"]}, {"$inc": {"balance": converted_amount}}
+                )
+            raise
+        # Outside the compensation above: once the expense is stored its debit
+        # must stay, even if the rollups fail
+        await update_rollups(
+            user_id,
+            [expense_data],
+            {expense.account_name: account_currency},
+            session=session,
+        )
 
     if result.inserted_id:
+        await bump_data_version(user_id)
         expense_data["date"] = expense_date  # Ensure consistent formatting for response
         return {
             "message": "Expense added successfully",
             "expense": format_id(expense_data),
-            "balance": new_balance,
+            "balance": account["balance"],
         }
     raise HTTPException(status_code=500, detail="Failed to add expense")
 
 
+def plan_bulk_expenses(
+    expenses: list[ExpenseCreate],
+    user_id: str,
+    snapshot: dict,
+    accounts: dict[str, dict],
+) -> tuple[list[dict], dict[str, list[tuple[int, dict, float]]]]:
+    """
+    Validate a batch of expenses against one snapshot of the user's accounts.
+
+    Items are checked in order against the balance the items before them
+    leave, as if they were added one by one.
+
+    Args:
+        expenses (list[ExpenseCreate]): Expense details.
+        user_id (str): Owner of the expenses.
+        snapshot (dict): The user's profile, with the currency of each
+            account the batch touches.
+        accounts (dict[str, dict]): Those accounts (currency and balance) by
+            name.
+
+    Returns:
+        tuple: A result per item, rejected with a reason until the item is
+        inserted, and the accepted items by account as (index, expense
+        document, amount in the account's currency).
+    """
+    results: list[dict] = []
+    debits: dict[str, float] = defaultdict(float)
+    pending: dict[str, list[tuple[int, dict, float]]] = defaultdict(list)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for index, expense in enumerate(expenses):
+        results.append({"index": index, "status": "rejected"})
+        error = expense_error(snapshot, expense)
+        if error is not None:
+            results[index]["detail"] = error
+            continue
+        account = accounts[expense.account_name]
+        try:
+            rate = exchange_rate(
+                expense.currency, account["currency"], expense.date or now
+            )
+        except HTTPException as e:
+            results[index]["detail"] = e.detail
+            continue
+        converted_amount = expense.amount * rate
+        if account["balance"] - debits[expense.account_name] < converted_amount:
+            results[index][
+                "detail"
+            ] = f"Insufficient balance in {expense.account_name} account"
+            continue
+
+        debits[expense.account_name] += converted_amount
+        pending[expense.account_name].append(
+            (
+                index,
+                expense.dict()
+                | {
+                    "user_id": user_id,
+                    "date": expense.date or now,
+                    "amount_in_account_currency": converted_amount,
+                    "exchange_rate": rate,
+                },
+                converted_amount,
+            )
+        )
+    return results, pending
+
+
+@router.post("/bulk")
+async def add_expenses_bulk(
+    expenses: list[ExpenseCreate],
+    context: RequestContext = Depends(get_request_context),
+):
+    """
+    Add many expenses for the user in one request.
+
+    All items are validated against a single snapshot of the user's profile
+    and accounts. Each account is then debited with one conditional $inc for
+    the sum of its accepted items, and the expenses are written with one
+    unordered insert_many. Items that fail are reported individually and do
+    not affect the others.
+
+    Args:
+        expenses (list[ExpenseCreate]): Expense details.
+        context (RequestContext): The authenticated user.
+
+    Returns:
+        dict: Per-item results and the updated balance of each account.
+    """
+    user_id = context.user_id
+    if len(expenses) > BULK_EXPENSES_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {BULK_EXPENSES_MAX_ITEMS} expenses can be added at once",
+        )
+    for expense in expenses:
+        expense.currency = expense.currency.upper()
+
+    profile = await context.profile()
+    if any(expense_error(profile, expense) for expense in expenses):
+        profile = await context.profile(refresh=True)
+
+    # One snapshot of every account the batch touches
+    accounts = {
+        account["name"]: account
+        async for account in accounts_collection.find(
+            {
+                "user_id": user_id,
+                "name": {"$in": list({expense.account_name for expense in expenses})},
+            },
+            {"name": 1, "currency": 1, "balance": 1},
+        )
+    }
+    snapshot = {
+        **profile,
+        "accounts": {name: account["currency"] for name, account in accounts.items()},
+    }
+
+    results, pending = plan_bulk_expenses(expenses, user_id, snapshot, accounts)
+    balances = await debit_bulk_accounts(accounts, pending, results)
+    inserted = await insert_bulk_expenses(user_id, accounts, pending, results, balances)
+    if inserted:
+        await bump_data_version(user_id)
+    return {
+        "message": f"{inserted} expenses added successfully",
+        "inserted": inserted,
+        "rejected": len(expenses) - inserted,
+        "results": results,
+        "balances": balances,
+    }
+
+
+def encode_cursor(expense: dict) -> str:
+    """Encode the (date, _id) position of an expense as an opaque cursor."""
+    position = {"date": expense["date"].isoformat(), "id": str(expense["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, ObjectId]:
+    """Decode a cursor produced by encode_cursor."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (
+            datetime.datetime.fromisoformat(position["date"]),
+            ObjectId(position["id"]),
+        )
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+def date_range(
+    start_date: Optional[datetime.datetime], end_date: Optional[datetime.datetime]
+) -> dict:
+    """Build a date filter for [start_date, end_date), either end optional."""
+    condition = {}
+    if start_date is not None:
+        condition["$gte"] = start_date
+    if end_date is not None:
+        condition["$lt"] = end_date
+    return condition
+
+
+class ExpenseFilters(BaseModel):
+    """Query parameters that narrow down a listing of expenses."""
+
+    start_date: Optional[datetime.datetime] = None
+    end_date: Optional[datetime.datetime] = None
+    category: Optional[str] = None
+    account_name: Optional[str] = None
+    currency: Optional[str] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+
+    def query(self, user_id: str) -> dict:
+        """Build the MongoDB filter of the user's expenses that match."""
+        query: dict = {"user_id": user_id}
+        if self.category is not None:
+            query["category"] = self.category
+        if self.account_name is not None:
+            query["account_name"] = self.account_name
+        if self.currency is not None:
+            query["currency"] = self.currency.upper()
+        if self.start_date is not None or self.end_date is not None:
+            query["date"] = date_range(self.start_date, self.end_date)
+        if self.min_amount is not None or self.max_amount is not None:
+            query["amount"] = {}
+            if self.min_amount is not None:
+                query["amount"]["$gte"] = self.min_amount
+            if self.max_amount is not None:
+                query["amount"]["$lte"] = self.max_amount
+        return query
+
+
+class ExpensePage(ExpenseFilters):
+    """Query parameters of one page of a listing of expenses."""
+
+    limit: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+
+
 @router.get("/")
-async def get_expenses(token: str = Header(None)):
+async def get_expenses(
+    page: Annotated[ExpensePage, Query()],
+    context: RequestContext = Depends(get_request_context),
+):
     """
-    Get all expenses for a user.
+    Get a page of a user's expenses, newest first.
+
+    Pages are keyed on (date, _id): pass the returned next_cursor to fetch the
+    following page. next_cursor is None on the last page.
 
     Args:
-        token (str): Authentication token.
+        page (ExpensePage): Date range, category, account, currency and
+            amount bounds the expenses must match, the maximum number of
+            expenses to return and the cursor returned by the previous page.
+        context (RequestContext): The authenticated user.
 
     Returns:
-        dict: List of expenses.
+        dict: List of expenses and the cursor of the next page.
     """
-    user_id = await verify_token(token)
-    expenses = await expenses_collection.find({"user_id": user_id}).to_list(1000)
-    formatted_expenses = [format_id(expense) for expense in expenses]
-    return {"expenses": formatted_expenses}
+    query = page.query(context.user_id)
+    if page.cursor is not None:
+        cursor_date, cursor_id = decode_cursor(page.cursor)
+        query["$or"] = [
+            {"date": {"$lt": cursor_date}},
+            {"date": cursor_date, "_id": {"$lt": cursor_id}},
+        ]
+
+    # Fetch one extra document to learn whether another page exists
+    limit = page.limit
+    expenses = (
+        await expenses_collection.find(query)
+        .sort([("date", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+        .to_list(None)
+    )
+    next_cursor = encode_cursor(expenses[limit - 1]) if len(expenses) > limit else None
+    formatted_expenses = [format_id(expense) for expense in expenses[:limit]]
+    return {"expenses": formatted_expenses, "next_cursor": next_cursor}
+
+
+class ExportOptions(BaseModel):
+    """Query parameters of an export of expenses."""
+
+    export_format: str = Field("csv", alias="format")
+    start_date: Optional[datetime.datetime] = None
+    end_date: Optional[datetime.datetime] = None
+    columns: Optional[str] = None
+
+
+@router.get("/export")
+async def export_expenses(
+    options: Annotated[ExportOptions, Query()],
+    context: RequestContext = Depends(get_request_context),
+    accept_encoding: Optional[str] = Header(None),
+):
+    """
+    Stream the user's expenses as CSV, NDJSON or Parquet, oldest first.
+
+    CSV and NDJSON responses are compressed with zstd or gzip when the client
+    accepts it; Parquet files are zstd-compressed internally.
+
+    Args:
+        options (ExportOptions): The format (csv, ndjson or parquet), the
+            date range of the expenses and the comma-separated fields to
+            export, all but the optional amount_in_account_currency and
+            exchange_rate by default.
+        context (RequestContext): The authenticated user.
+        accept_encoding (str): Content encodings accepted by the client.
+
+    Returns:
+        StreamingResponse: The exported expenses.
+    """
+    query: dict = {"user_id": context.user_id}
+    if options.start_date is not None or options.end_date is not None:
+        query["date"] = date_range(options.start_date, options.end_date)
+    try:
+        return export.export_response(
+            query, options.export_format, options.columns, accept_encoding
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
 
 
 @router.get("/{expense_id}")
-async def get_expense(expense_id: str, token: str = Header(None)):
+async def get_expense(
+    expense_id: str, context: RequestContext = Depends(get_request_context)
+):
     """
     Get a specific expense by ID.
 
     Args:
         expense_id (str): ID of the expense.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Details of the specified expense.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     expense = await expenses_collection.find_one(
         {"user_id": user_id, "_id": ObjectId(expense_id)}
     )
@@ -188,66 +574,144 @@ async def get_expense(expense_id: str, token: str = Header(None)):
 
 
 @router.delete("/all")
-async def delete_all_expenses(token: str = Header(None)):
+async def delete_all_expenses(context: RequestContext = Depends(get_request_context)):
     """
     Delete all expenses for the authenticated user and update account balances.
 
+    Stored account-currency amounts are totalled per account on the server.
+    Expenses written before those were stored are totalled per (account,
+    currency, day) and converted to their account's currency at that day's
+    rate in one batch. Every account is then refunded in one bulk_write and
+    only the expenses up to the newest one totalled are deleted. With
+    MONGO_USE_TRANSACTIONS enabled the refunds and the deletion commit
+    together.
+
     Args:
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Message indicating the number of expenses deleted.
     """
-    user_id = await verify_token(token)
-
-    # Retrieve all expenses for the user before deletion
-    expenses = await expenses_collection.find({"user_id": user_id}).to_list(None)
-    if not expenses:
-        raise HTTPException(status_code=404, detail="No expenses found to delete")
-
-    # Organize expenses by account name to sum them for each account
-    account_adjustments: dict[str, float] = {}
-    for expense in expenses:
-        account_name = expense.get("account_name")
-        amount = expense.get("amount", 0)
+    user_id = context.user_id
+
+    async with transaction() as session:
+        groups = await expenses_collection.aggregate(
+            [
+                {"$match": {"user_id": user_id}},
+                {
+                    "$group": {
+                        # Stored account-currency amounts are summed per
+                        # account; only older expenses need the currency and
+                        # day to be converted
+                        "_id": {
+                            "account_name": "$account_name",
+                            "currency": {
+                                "$cond": [
+                                    {"$eq": [{"$type": STORED_AMOUNT}, "missing"]},
+                                    "$currency",
+                                    None,
+                                ]
+                            },
+                            "day": {
+                                "$cond": [
+                                    {"$eq": [{"$type": STORED_AMOUNT}, "missing"]},
+                                    {
+                                        "$dateToString": {
+                                            "format": "%Y-%m-%d",
+                                            "date": "$date",
+                                        }
+                                    },
+                                    None,
+                                ]
+                            },
+                        },
+                        "total": {"$sum": {"$ifNull": [STORED_AMOUNT, "$amount"]}},
+                        "count": {"$sum": 1},
+                        "last_id": {"$max": "$_id"},
+                    }
+                },
+            ],
+            session=session,
+        ).to_list(None)
+        if not groups:
+            raise HTTPException(status_code=404, detail="No expenses found to delete")
+        # Without a transaction, expenses added after the aggregation were not
+        # refunded; they are newer than every expense it saw, so keep them
+        last_id = max(group["last_id"] for group in groups)
+        totalled = sum(group["count"] for group in groups)
+
+        names = list({group["_id"]["account_name"] for group in groups})
+        accounts = {
+            account["name"]: account
+            async for account in accounts_collection.find(
+                {"user_id": user_id, "name": {"$in": names}},
+                {"name": 1, "currency": 1},
+                session=session,
+            )
+        }
 
-        # Find the account ID by name
-        account = await accounts_collection.find_one(
-            {"name": account_name, "user_id": user_id}
+        # Expenses of accounts that no longer exist are deleted without refund
+        groups = [group for group in groups if group["_id"]["account_name"] in accounts]
+        account_currencies = [
+            accounts[group["_id"]["account_name"]]["currency"] for group in groups
+        ]
+        converted = convert_currency_batch(
+            [group["total"] for group in groups],
+            [
+                group["_id"]["currency"] or currency
+                for group, currency in zip(groups, account_currencies)
+            ],
+            account_currencies,
+            [group["_id"].get("day") for group in groups],
         )
-        if account:
-            account_id = account["_id"]
-            if account_id in account_adjustments:
-                account_adjustments[account_id] += amount
-            else:
-                account_adjustments[account_id] = amount
-
-    # Update each account's balance
-    for account_id, total_expense_amount in account_adjustments.items():
-        await accounts_collection.update_one(
-            {"_id": account_id, "user_id": user_id},
-            {"$inc": {"balance": total_expense_amount}},
+        refunds: dict[ObjectId, float] = defaultdict(float)
+        for group, amount in zip(groups, converted):
+            refunds[accounts[group["_id"]["account_name"]]["_id"]] += float(amount)
+
+        if refunds:
+            await accounts_collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": account_id, "user_id": user_id},
+                        {"$inc": {"balance": amount}},
+                    )
+                    for account_id, amount in refunds.items()
+                ],
+                ordered=False,
+                session=session,
+            )
+        result = await expenses_collection.delete_many(
+            {"user_id": user_id, "_id": {"$lte": last_id}}, session=session
         )
-
-    # Delete all expenses
-    result = await expenses_collection.delete_many({"user_id": user_id})
+        if result.deleted_count == totalled:
+            await delete_rollups(user_id, session=session)
+        else:
+            # Some expenses were kept or went missing: recount what is left
+            await rebuild_user_rollups(get_database(), user_id)
+    await bump_data_version(user_id)
 
     return {"message": f"{result.deleted_count} expenses deleted successfully"}
 
 
 @router.delete("/{expense_id}")
-async def delete_expense(expense_id: str, token: str = Header(None)):
+async def delete_expense(
+    expense_id: str, context: RequestContext = Depends(get_request_context)
+):
     """
     Delete an expense by ID.
 
+    The expense is deleted first and its amount is then refunded with a $inc,
+    so concurrent deletes and balance changes cannot be lost or refunded
+    twice.
+
     Args:
         expense_id (str): ID of the expense to delete.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Message with updated balance.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     expense = await expenses_collection.find_one({"_id": ObjectId(expense_id)})
 
     if not expense or expense["user_id"] != user_id:
@@ -255,33 +719,85 @@ async def delete_expense(expense_id: str, token: str = Header(None)):
 
     account_name = expense["account_name"]
     account = await accounts_collection.find_one(
-        {"user_id": user_id, "name": account_name}
+        {"user_id": user_id, "name": account_name}, {"currency": 1}
     )
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
-    amount = convert_currency(
-        expense["amount"], expense["currency"], account["currency"]
-    )
+    # Delete the expense
+    result = await expenses_collection.delete_one({"_id": ObjectId(expense_id)})
+    if result.deleted_count != 1:
+        raise HTTPException(status_code=500, detail="Failed to delete expense")
 
     # Refund the amount to user's account
-    new_balance = account["balance"] + amount
-    await accounts_collection.update_one(
-        {"_id": account["_id"]}, {"$set": {"balance": new_balance}}
+    refunded = await accounts_collection.find_one_and_update(
+        {"_id": account["_id"]},
+        {"$inc": {"balance": account_amount(expense, account["currency"])}},
+        projection={"balance": 1},
+        return_document=ReturnDocument.AFTER,
     )
+    await update_rollups(
+        user_id, [expense], {account_name: account["currency"]}, sign=-1
+    )
+    await bump_data_version(user_id)
+    return {
+        "message": "Expense deleted successfully",
+        # None if the account was deleted meanwhile
+        "balance": refunded["balance"] if refunded else None,
+    }
 
-    # Delete the expense
-    result = await expenses_collection.delete_one({"_id": ObjectId(expense_id)})
 
-    if result.deleted_count == 1:
-        return {"message": "Expense deleted successfully", "balance": new_balance}
-    raise HTTPException(status_code=500, detail="Failed to delete expense")
+async def charge_expense_change(
+    expense: dict, account: dict, update_fields: dict
+) -> float:
+    """
+    Debit or refund an account for a change to the amount of one of its expenses.
+
+    The new amount is converted at the rate of the expense's (possibly updated)
+    date and recorded in update_fields. The difference from the stored
+    account-currency amount is applied with one $inc that only matches while
+    the balance covers it.
+
+    Args:
+        expense (dict): The stored expense.
+        account (dict): The account the expense was paid from.
+        update_fields (dict): The fields being updated.
+
+    Returns:
+        float: The account's balance afterwards.
+    """
+    if not update_fields.keys() & {"amount", "currency", "date"}:
+        return account["balance"]
+
+    rate = exchange_rate(
+        update_fields.get("currency", expense["currency"]),
+        account["currency"],
+        update_fields.get("date", expense.get("date")),
+    )
+    new_amount_converted = update_fields.get("amount", expense["amount"]) * rate
+    update_fields["amount_in_account_currency"] = new_amount_converted
+    update_fields["exchange_rate"] = rate
+
+    difference = new_amount_converted - account_amount(expense, account["currency"])
+    updated = await accounts_collection.find_one_and_update(
+        {"_id": account["_id"], "balance": {"$gte": difference}},
+        {"$inc": {"balance": -difference}},
+        projection={"balance": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        raise HTTPException(
+            status_code=400, detail="Insufficient balance to update the expense"
+        )
+    return updated["balance"]
 
 
 @router.put("/{expense_id}")
 # pylint: disable=too-many-locals
 async def update_expense(
-    expense_id: str, expense_update: ExpenseUpdate, token: str = Header(None)
+    expense_id: str,
+    expense_update: ExpenseUpdate,
+    context: RequestContext = Depends(get_request_context),
 ):
     """
     Update an expense by ID.
@@ -289,15 +805,21 @@ async def update_expense(
     Args:
         expense_id (str): ID of the expense to update.
         expense_update (ExpenseUpdate): Expense update details.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Message with updated expense and balance.
     """
-    user_id = await verify_token(token)
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_id = context.user_id
+    profile = await context.profile()
+    if (
+        expense_update.currency
+        and expense_update.currency.upper() not in profile["currencies"]
+    ) or (
+        expense_update.category and expense_update.category not in profile["categories"]
+    ):
+        # The cached profile may predate a new currency or category
+        profile = await context.profile(refresh=True)
 
     expense = await expenses_collection.find_one({"_id": ObjectId(expense_id)})
     if not expense or expense["user_id"] != user_id:
@@ -308,51 +830,25 @@ async def update_expense(
     def validate_currency():
         if expense_update.currency:
             expense_update.currency = expense_update.currency.upper()
-            if expense_update.currency not in user["currencies"]:
+            if expense_update.currency not in profile["currencies"]:
                 raise HTTPException(
                     status_code=400,
                     detail=(
                         f"Currency type is not added to user account. "
-                        f"Available currencies are {user['currencies']}"
+                        f"Available currencies are {profile['currencies']}"
                     ),
                 )
             update_fields["currency"] = expense_update.currency
 
-    async def validate_amount():
-        nonlocal new_balance
-        if expense_update.amount is not None:
-            update_fields["amount"] = expense_update.amount
-
-            # Adjust the user's balance
-            # Convert old and new amounts to the account currency to determine balance adjustment
-            original_amount_converted = convert_currency(
-                expense["amount"], expense["currency"], account["currency"]
-            )
-            new_amount_converted = convert_currency(
-                expense_update.amount,
-                expense_update.currency or expense["currency"],
-                account["currency"],
-            )
-
-            difference = new_amount_converted - original_amount_converted
-            new_balance = account["balance"] - difference
-
-            if new_balance < 0:
-                raise HTTPException(
-                    status_code=400, detail="Insufficient balance to update the expense"
-                )
-            await accounts_collection.update_one(
-                {"_id": account["_id"]}, {"$set": {"balance": new_balance}}
-            )
-
     def validate_category():
         if expense_update.category:
-            if expense_update.category not in user["categories"]:
+            categories = profile["categories"]
+            if expense_update.category not in categories:
                 raise HTTPException(
                     status_code=400,
                     detail=(
                         f"Category is not present in the user account. "
-                        f"Available categories are {list(user['categories'])}"
+                        f"Available categories are {list(categories)}"
                     ),
                 )
             update_fields["category"] = expense_update.category
@@ -374,11 +870,13 @@ async def update_expense(
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
-    new_balance = account["balance"]
-    await validate_amount()
     validate_category()
     validate_description()
     validate_date()
+    if expense_update.amount is not None:
+        update_fields["amount"] = expense_update.amount
+    # Last, so the balance only changes once every other field is valid
+    new_balance = await charge_expense_change(expense, account, update_fields)
 
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
@@ -387,6 +885,14 @@ async def update_expense(
         {"_id": ObjectId(expense_id)}, {"$set": update_fields}
     )
     if result.modified_count == 1:
+        if update_fields.keys() & {"amount", "currency", "category", "date"}:
+            await move_rollups(
+                user_id,
+                expense,
+                expense | update_fields,
+                {account_name: account["currency"]},
+            )
+        await bump_data_version(user_id)
         updated_expense = await expenses_collection.find_one(
             {"_id": ObjectId(expense_id)}
         )
@@ -399,154 +905,19 @@ async def update_expense(
 
 
 @router.get("/export/excel")
-async def export_expenses_to_excel(token: str = Header(None)):
-    """Export expense data to an Excel file"""
-    user_id = await verify_token(token)
-    expenses = await expenses_collection.find({"user_id": user_id}).to_list(None)
-
-    if not expenses:
-        raise HTTPException(status_code=404, detail="No expenses found.")
-
-    # Convert MongoDB documents to DataFrame
-    for expense in expenses:
-        expense["_id"] = str(
-            expense["_id"]
-        )  # Convert ObjectId to string for compatibility
-
-    df = pd.DataFrame(expenses)
-
-    # Drop '_id' and 'user_id' columns
-    df.drop(columns=["_id", "user_id"], inplace=True, errors="ignore")
-
-    # Move 'description' column to the first position
-    if "description" in df.columns:
-        description_column = df.pop(
-            "description"
-        )  # Remove and get 'description' column
-        df.insert(
-            0, "description", description_column
-        )  # Insert it at the first position
-
-    # Create an in-memory file
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Expenses")
-        # workbook = writer.book
-        sheet = writer.sheets["Expenses"]
-
-        # Auto-adjust column width
-        for column_cells in sheet.columns:
-            max_length = 0
-            column_letter = column_cells[0].column_letter  # Get column letter
-            for cell in column_cells:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except:  # pylint: disable=W0702  # nosec B110
-                    pass
-            adjusted_width = max_length + 2
-            sheet.column_dimensions[column_letter].width = adjusted_width
-
-    output.seek(0)
-
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=expenses.xlsx"},
-    )
-
-
-@router.post("/import/csv")
-async def import_expenses_from_csv(
-    token: str = Header(None), file: UploadFile = File(...)
+async def export_expenses_to_excel(
+    context: RequestContext = Depends(get_request_context),
 ):
     """
-    Import expenses from a CSV file.
+    Export expense data to an Excel file.
 
     Args:
-        token (str): Authentication token.
-        file (UploadFile): The uploaded CSV file.
+        context (RequestContext): The authenticated user.
 
     Returns:
-        dict: Message indicating success or failure.
+        StreamingResponse: The expenses as an xlsx workbook.
     """
-    user_id = await verify_token(token)
-
-    if file.content_type != "text/csv":
-        raise HTTPException(
-            status_code=400, detail="Invalid file format. Please upload a CSV file."
-        )
-
-    try:
-        content = await file.read()
-        result = chardet.detect(content)
-        encoding = result["encoding"]
-
-        # Read the CSV file
-        df = pd.read_csv(io.BytesIO(content), encoding=encoding)
-
-        # Validate required columns
-        required_columns = {
-            "description",
-            "amount",
-            "currency",
-            "category",
-            "account_name",
-            "date",
-        }
-        if not required_columns.issubset(df.columns):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Missing required columns. Expected: {', '.join(required_columns)}",
-            )
-
-        # Drop rows where all fields are NaN
-        df = df.dropna(how="all")
-
-        # Ensure 'date' column is properly formatted
-        df["date"] = pd.to_datetime(
-            df["date"], errors="coerce"
-        )  # Convert invalid dates to NaT
-
-        # Drop rows with missing required fields
-        required_fields = [
-            "description",
-            "amount",
-            "currency",
-            "category",
-            "account_name",
-            "date",
-        ]
-        df = df.dropna(subset=required_fields)
-
-        # Process each row and add expenses to the database
-        for _, row in df.iterrows():
-            expense = {
-                "description": row["description"],
-                "amount": row["amount"],
-                "currency": row["currency"].upper(),
-                "category": row["category"],
-                "account_name": row["account_name"],
-                "date": row["date"],  # Already converted to datetime
-                "user_id": user_id,
-            }
-
-            # Check if the account exists for the user
-            account = await accounts_collection.find_one(
-                {"user_id": user_id, "name": expense["account_name"]}
-            )
-            if not account:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid account name: {expense['account_name']}",
-                )
-
-            # Insert expense into the database
-            await expenses_collection.insert_one(expense)
-
-        return {"message": "Expenses imported successfully."}
-
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to process CSV: {str(e)}"
-        ) from e
+    response = await export.xlsx_response({"user_id": context.user_id})
+    if response is None:
+        raise HTTPException(status_code=404, detail="No expenses found.")
+    return response
@@ -0,0 +1,116 @@
+"""
+This module provides the API routes that import expenses from CSV files.
+
+A file is either imported within the request or queued as a background job
+whose progress can be polled, and which resumes after a restart.
+"""
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+
+from api.utils import csv_import, import_jobs
+from api.utils.context import RequestContext, get_request_context
+
+router = APIRouter(prefix="/expenses/import", tags=["Expenses"])
+
+
+@router.post("/csv")
+async def import_expenses_from_csv(
+    context: RequestContext = Depends(get_request_context), file: UploadFile = File(...)
+):
+    """
+    Import expenses from a CSV file.
+
+    Args:
+        context (RequestContext): The authenticated user.
+        file (UploadFile): The uploaded CSV file.
+
+    Returns:
+        dict: Import counts and the rows that were rejected.
+    """
+    user_id = context.user_id
+
+    if file.content_type != "text/csv":
+        raise HTTPException(
+            status_code=400, detail="Invalid file format. Please upload a CSV file."
+        )
+
+    try:
+        report = await csv_import.import_csv_expenses(user_id, file.file)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to process CSV: {str(e)}"
+        ) from e
+    return {"message": "Expenses imported successfully.", **report}
+
+
+@router.post("/jobs", status_code=202)
+async def create_import_job(
+    context: RequestContext = Depends(get_request_context), file: UploadFile = File(...)
+):
+    """
+    Queue a CSV file for import in the background.
+
+    Args:
+        context (RequestContext): The authenticated user.
+        file (UploadFile): The uploaded CSV file.
+
+    Returns:
+        dict: ID of the job to poll for progress.
+    """
+    user_id = context.user_id
+
+    if file.content_type != "text/csv":
+        raise HTTPException(
+            status_code=400, detail="Invalid file format. Please upload a CSV file."
+        )
+
+    job_id = await import_jobs.create_job(user_id, file.filename or "", file.file)
+    csv_import.start_import_job(job_id)
+    return {"message": "Import job created", "job_id": str(job_id)}
+
+
+@router.get("/jobs/{job_id}")
+async def get_import_job(
+    job_id: str, context: RequestContext = Depends(get_request_context)
+):
+    """
+    Get the status and progress of an import job.
+
+    Args:
+        job_id (str): ID of the job.
+        context (RequestContext): The authenticated user.
+
+    Returns:
+        dict: Status and row counts of the job.
+    """
+    user_id = context.user_id
+    job = await import_jobs.get_job(user_id, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return import_jobs.job_summary(job)
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_import_job(
+    job_id: str, context: RequestContext = Depends(get_request_context)
+):
+    """
+    Cancel a queued or running import job.
+
+    Args:
+        job_id (str): ID of the job.
+        context (RequestContext): The authenticated user.
+
+    Returns:
+        dict: Status and row counts of the cancelled job.
+    """
+    user_id = context.user_id
+    job = await import_jobs.cancel_job(user_id, job_id)
+    if not job:
+        job = await import_jobs.get_job(user_id, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Import job not found")
+        raise HTTPException(
+            status_code=409, detail=f"Import job is already {job['status']}"
+        )
+    return import_jobs.job_summary(job)
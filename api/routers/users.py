@@ -6,14 +6,34 @@ import datetime
 from typing import Optional
 
 from bson import ObjectId
-from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt
-from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import BaseModel
-
-from api.utils.auth import verify_token
-from config import MONGO_URI, TOKEN_ALGORITHM, TOKEN_SECRET_KEY
+from pymongo.errors import DuplicateKeyError
+
+from api.utils.auth import (
+    evict_token,
+    evict_token_id,
+    evict_user_tokens,
+    publish_revocation,
+    verify_token,
+)
+from api.utils.context import RequestContext, get_request_context
+from api.utils.db import (
+    accounts_collection,
+    expenses_collection,
+    tokens_collection,
+    users_collection,
+)
+from api.utils.profiles import (
+    CURRENCIES_PROJECTION,
+    PUBLIC_USER_PROJECTION,
+    find_user,
+    invalidate_user_profile,
+)
+from api.utils.rollups import delete_rollups
+from config import TOKEN_ALGORITHM, TOKEN_SECRET_KEY
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60
 
@@ -21,14 +41,6 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
-# MongoDB setup
-client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI)
-db = client.mmdb
-users_collection = db.users
-tokens_collection = db.tokens
-accounts_collection = db.accounts
-expenses_collection = db.expenses
-
 
 class UserCreate(BaseModel):
     """Schema for creating a user."""
@@ -64,7 +76,9 @@ def create_access_token(data: dict, expires_delta: datetime.timedelta):
 @router.post("/")
 async def create_user(user: UserCreate):
     """Create a new user along with default accounts."""
-    existing_user = await users_collection.find_one({"username": user.username})
+    existing_user = await users_collection.find_one(
+        {"username": user.username}, {"_id": 1}
+    )
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     if not user.username or not user.password:
@@ -87,8 +101,14 @@ async def create_user(user: UserCreate):
         "password": user.password,  # In a real application, you should hash the password
         "categories": default_categories,
         "currencies": default_currencies,
+        # No expenses yet, so the (empty) rollups are complete
+        "rollups_ready": True,
     }
-    result = await users_collection.insert_one(user_data)
+    try:
+        result = await users_collection.insert_one(user_data)
+    except DuplicateKeyError as e:
+        # Lost a race against a concurrent signup for the same username
+        raise HTTPException(status_code=400, detail="Username already exists") from e
     user_id = result.inserted_id
     if not user_id:
         raise HTTPException(status_code=500, detail="Failed to create user")
@@ -117,7 +137,9 @@ async def create_user(user: UserCreate):
 @router.post("/login/")
 async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
     """Login a user by generating an access token and saving it in a cookie."""
-    user = await users_collection.find_one({"username": form_data.username})
+    user = await users_collection.find_one(
+        {"username": form_data.username}, {"username": 1, "password": 1}
+    )
     if not user or user["password"] != form_data.password:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
 
@@ -171,6 +193,8 @@ async def logout(response: Response, request: Request):
 
     # Delete the token from the database
     result = await tokens_collection.delete_one({"user_id": user_id, "token": token})
+    evict_token(token)
+    await publish_revocation()
 
     if result.deleted_count == 1:
         # ensure parameters match between login and logout for setting the cookie
@@ -188,31 +212,24 @@ async def logout(response: Response, request: Request):
     raise HTTPException(status_code=400, detail="Failed to logout")
 
 
-async def get_username(token: str):
-    """Get user's username."""
-    user_id = await verify_token(token)
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user.get("username")
-
-
 @router.get("/")
-async def get_user(token: str = Header(None)):
-    """Get user details."""
-    user_id = await verify_token(token)
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
+async def get_user(context: RequestContext = Depends(get_request_context)):
+    """Get user details, without the password."""
+    user_id = context.user_id
+    user = await find_user(user_id, PUBLIC_USER_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return format_id(user)
 
 
 @router.put("/")
-async def update_user(user_update: UserUpdate, token: str = Header(None)):
+async def update_user(
+    user_update: UserUpdate, context: RequestContext = Depends(get_request_context)
+):
     """Update user information such as password, currencies."""
-    user_id = await verify_token(token)
+    user_id = context.user_id
     update_fields = user_update.dict(exclude_unset=True)
-    user: Optional[dict] = await users_collection.find_one({"_id": ObjectId(user_id)})
+    user = await find_user(user_id, CURRENCIES_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -229,8 +246,9 @@ async def update_user(user_update: UserUpdate, token: str = Header(None)):
         result = await users_collection.update_one(
             {"_id": ObjectId(user_id)}, {"$set": update_fields}
         )
+        await invalidate_user_profile(user_id)
         if result.modified_count == 1:
-            updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
+            updated_user = await find_user(user_id, PUBLIC_USER_PROJECTION)
             return {
                 "message": "User updated successfully",
                 "updated_user": format_id(updated_user),
@@ -241,13 +259,17 @@ async def update_user(user_update: UserUpdate, token: str = Header(None)):
 
 
 @router.delete("/")
-async def delete_user(token: str = Header(None)):
+async def delete_user(context: RequestContext = Depends(get_request_context)):
     """Delete a user and all associated accounts, tokens, and expenses."""
-    user_id = await verify_token(token)
+    user_id = context.user_id
     await tokens_collection.delete_many({"user_id": user_id})
+    evict_user_tokens(user_id)
+    await publish_revocation()
     await accounts_collection.delete_many({"user_id": user_id})
     await expenses_collection.delete_many({"user_id": user_id})
+    await delete_rollups(user_id)
     result = await users_collection.delete_one({"_id": ObjectId(user_id)})
+    await invalidate_user_profile(user_id)
     if result.deleted_count == 1:
         return {"message": "User deleted successfully"}
     raise HTTPException(status_code=500, detail="Failed to delete user")
@@ -287,17 +309,17 @@ async def create_token(
 
 
 @router.get("/token/")
-async def get_tokens(token: str = Header(None)):
+async def get_tokens(context: RequestContext = Depends(get_request_context)):
     """
     Get all tokens for the authenticated user.
 
     Args:
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: List of all tokens for the user.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     tokens = await tokens_collection.find({"user_id": user_id}).to_list(1000)
     formatted_tokens = [format_id(token) for token in tokens]
     # Convert datetime to ISO format in each token document
@@ -309,18 +331,20 @@ async def get_tokens(token: str = Header(None)):
 
 
 @router.get("/token/{token_id}")
-async def get_token(token_id: str, token: str = Header(None)) -> dict:
+async def get_token(
+    token_id: str, context: RequestContext = Depends(get_request_context)
+) -> dict:
     """
     Get a specific token's details.
 
     Args:
         token_id (str): The ID of the token.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Details of the specified token.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     token_data = await tokens_collection.find_one(
         {"user_id": user_id, "_id": ObjectId(token_id)}
     )
@@ -338,19 +362,23 @@ async def get_token(token_id: str, token: str = Header(None)) -> dict:
 
 
 @router.put("/token/{token_id}")
-async def update_token(token_id: str, new_expiry: float, token: str = Header(None)):
+async def update_token(
+    token_id: str,
+    new_expiry: float,
+    context: RequestContext = Depends(get_request_context),
+):
     """
     Update the expiration time for the current token.
 
     Args:
         token_id (str): The ID of the token.
         new_expiry (float): New expiry time in minutes.
-        token (str): Authentication token.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Success message or error.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     updated_expiry = datetime.timedelta(minutes=new_expiry)
     new_expiry_time = datetime.datetime.now(datetime.UTC) + updated_expiry
 
@@ -359,6 +387,9 @@ async def update_token(token_id: str, new_expiry: float, token: str = Header(Non
         {"user_id": user_id, "_id": ObjectId(token_id)},
         {"$set": {"expires_at": new_expiry_time}},
     )
+    # Cached entries are bounded by the old expiry
+    evict_token_id(token_id)
+    await publish_revocation()
 
     if result.modified_count == 1:
         return {"message": "Token expiration updated successfully"}
@@ -367,29 +398,27 @@ async def update_token(token_id: str, new_expiry: float, token: str = Header(Non
 
 
 @router.delete("/token/{token_id}")
-async def delete_token(token_id: str, token: str = Header(None)):
+async def delete_token(
+    token_id: str, context: RequestContext = Depends(get_request_context)
+):
     """
     Delete a specific token by its ID.
 
     Args:
         token_id (str): The ID of the token to be deleted.
-        token (str): Authentication token for verifying the user.
+        context (RequestContext): The authenticated user.
 
     Returns:
         dict: Message indicating whether the token was successfully deleted.
     """
-    user_id = await verify_token(token)
+    user_id = context.user_id
     result = await tokens_collection.delete_one(
         {"user_id": user_id, "_id": ObjectId(token_id)}
     )
+    evict_token_id(token_id)
+    await publish_revocation()
 
     if result.deleted_count == 1:
         return {"message": "Token deleted successfully"}
 
     raise HTTPException(status_code=404, detail="Token not found")
-
-
-@router.on_event("shutdown")
-async def shutdown_db_client():
-    """Shutdown event for MongoDB client."""
-    client.close()
@@ -1,34 +1,138 @@
-"""Utilities to manage authentication"""
+"""
+Utilities to manage authentication
+
+Verified tokens are cached per process. A worker that revokes a token evicts
+it from its own cache at once and bumps a shared counter in the
+``revocations`` collection; every other worker polls that counter at most
+once every TOKEN_REVOCATION_POLL_SECONDS and drops its cached tokens when it
+changes, so a revoked token stops working everywhere within that interval.
+"""
+
+import datetime
+import time
+from typing import Optional
 
 from fastapi import HTTPException
 from jose import JWTError, jwt
-from motor.motor_asyncio import AsyncIOMotorClient
 
-from config import MONGO_URI, TOKEN_ALGORITHM, TOKEN_SECRET_KEY
+from api.utils.cache import TTLCache
+from api.utils.db import revocations_collection, tokens_collection
+from config import (
+    TOKEN_ALGORITHM,
+    TOKEN_CACHE_MAXSIZE,
+    TOKEN_CACHE_TTL_SECONDS,
+    TOKEN_REVOCATION_POLL_SECONDS,
+    TOKEN_SECRET_KEY,
+)
+
+# Recently verified tokens, mapped to (user_id, token_id)
+token_cache = TTLCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# Document of the revocations collection holding the shared token counter
+REVOCATIONS_ID = "tokens"
+
+
+class RevocationWatch:
+    """
+    The last seen value of a shared revocation counter.
+
+    Args:
+        poll_seconds (float): Minimum time between two reads of the counter.
+        counter_id (str): Document of the revocations collection holding it.
+        cache (TTLCache): Cache emptied when the counter changes.
+    """
+
+    def __init__(self, poll_seconds: float, counter_id: str, cache: TTLCache):
+        self.poll_seconds = poll_seconds
+        self.counter_id = counter_id
+        self.cache = cache
+        self.version: Optional[int] = None
+        self.checked_at = float("-inf")
+
+    def expire(self):
+        """Poll the counter on the next verification."""
+        self.checked_at = float("-inf")
+
+    async def sync(self):
+        """Empty the cache if another worker bumped the counter since the last poll."""
+        now = time.monotonic()
+        if now - self.checked_at < self.poll_seconds:
+            return
+        self.checked_at = now
+        state = await revocations_collection.find_one({"_id": self.counter_id})
+        version = state["version"] if state else 0
+        if self.version is not None and version != self.version:
+            self.cache.evict_where(lambda *_: True)
+        self.version = version
+
 
-client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI)
-db = client.mmdb
-users_collection = db.users
-tokens_collection = db.tokens
+revocation_watch = RevocationWatch(
+    TOKEN_REVOCATION_POLL_SECONDS, REVOCATIONS_ID, token_cache
+)
 
 
-async def verify_token(token: str):
+async def publish_revocation(counter_id: str = REVOCATIONS_ID):
+    """Make every worker drop its cached tokens within one poll interval."""
+    await revocations_collection.update_one(
+        {"_id": counter_id}, {"$inc": {"version": 1}}, upsert=True
+    )
+
+
+def evict_token(token: str):
+    """Drop a single token from the verified-token cache."""
+    token_cache.pop(token)
+
+
+def evict_token_id(token_id: str):
+    """Drop the cached token whose database ID is token_id."""
+    token_cache.evict_where(lambda _, entry: entry[1] == token_id)
+
+
+def evict_user_tokens(user_id: str):
+    """Drop every cached token belonging to user_id."""
+    token_cache.evict_where(lambda _, entry: entry[0] == user_id)
+
+
+def _seconds_left(payload: dict, expires_at: Optional[datetime.datetime]):
+    """Seconds until the earlier of the JWT exp claim and the stored expiry."""
+    deadlines = []
+    if "exp" in payload:
+        deadlines.append(payload["exp"])
+    if expires_at is not None:
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+        deadlines.append(expires_at.timestamp())
+    return min(deadlines) - time.time() if deadlines else None
+
+
+async def verify_token(token: Optional[str]):
     """Verify the validity of an access token."""
     if token is None:
         raise HTTPException(status_code=401, detail="Token is missing")
+    await revocation_watch.sync()
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached[0]
     try:
         payload = jwt.decode(
             token, str(TOKEN_SECRET_KEY), algorithms=[TOKEN_ALGORITHM or "HS256"]
         )
         user_id = payload.get("sub")
         token_exists = await tokens_collection.find_one(
-            {"user_id": user_id, "token": token}
+            {"user_id": user_id, "token": token}, {"_id": 1, "expires_at": 1}
         )
         if not token_exists:
             raise HTTPException(status_code=401, detail="Token does not exist")
+        # Never cache a token for longer than it remains valid
+        token_cache.set(
+            token,
+            (user_id, str(token_exists["_id"])),
+            ttl=_seconds_left(payload, token_exists.get("expires_at")),
+        )
         return user_id
     except JWTError as e:
         if "Signature has expired" in str(e):
+            evict_token(token)
             await tokens_collection.delete_one({"token": token})
             raise HTTPException(status_code=401, detail="Token has expired") from e
         raise HTTPException(
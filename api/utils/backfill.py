@@ -0,0 +1,186 @@
+"""
+Backfill of the account-currency amount stored on each expense.
+
+Expenses written before amount_in_account_currency was introduced only carry
+their own amount and currency. This migration converts them, at the rate of
+their date, into the currency of the account they were paid from, in batches
+ordered by _id. The last processed _id is checkpointed in the migrations
+collection after every batch, so an interrupted run resumes where it stopped::
+
+    python -m api.utils.backfill            # start or resume the backfill
+    python -m api.utils.backfill --restart  # start again from the first expense
+
+Expenses that cannot be converted (their account no longer exists, or their
+amount or currency is invalid) are left untouched and counted as skipped.
+"""
+
+import argparse
+import asyncio
+import datetime
+import math
+import sys
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+
+from api.utils.currency import rate_service
+
+MIGRATION_ID = "expense_account_amounts"
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _as_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+async def _batch_updates(
+    accounts: AsyncIOMotorCollection, batch: list[dict]
+) -> tuple[list[UpdateOne], int]:
+    """
+    Convert a batch of expenses into the currency of their accounts.
+
+    Returns:
+        tuple: The updates storing the converted amounts and the number of
+        expenses that could not be converted.
+    """
+    # One lookup for the accounts of every user in the batch
+    account_currencies = {
+        (account["user_id"], account["name"]): account["currency"]
+        async for account in accounts.find(
+            {"user_id": {"$in": list({expense["user_id"] for expense in batch})}},
+            {"user_id": 1, "name": 1, "currency": 1},
+        )
+    }
+    rates = rate_service.convert_batch(
+        [1.0] * len(batch),
+        [expense.get("currency") for expense in batch],
+        [
+            account_currencies.get((expense["user_id"], expense.get("account_name")))
+            for expense in batch
+        ],
+        [expense.get("date") for expense in batch],
+        errors="coerce",
+    )
+    updates = []
+    for expense, rate in zip(batch, rates):
+        converted = _as_float(expense.get("amount")) * rate
+        if math.isnan(converted):
+            continue
+        updates.append(
+            UpdateOne(
+                {
+                    "_id": expense["_id"],
+                    "amount_in_account_currency": {"$exists": False},
+                },
+                {
+                    "$set": {
+                        "amount_in_account_currency": converted,
+                        "exchange_rate": float(rate),
+                    }
+                },
+            )
+        )
+    return updates, len(batch) - len(updates)
+
+
+async def backfill_account_amounts(
+    database: AsyncIOMotorDatabase,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    restart: bool = False,
+) -> dict[str, int]:
+    """
+    Store amount_in_account_currency and exchange_rate on every expense missing them.
+
+    Args:
+        database (AsyncIOMotorDatabase): The application database.
+        batch_size (int): Number of expenses converted per round trip.
+        restart (bool): Ignore the checkpoint of a previous run.
+
+    Returns:
+        dict[str, int]: Number of expenses updated and skipped by this run.
+    """
+    expenses = database["expenses"]
+    accounts = database["accounts"]
+    migrations = database["migrations"]
+
+    state = None if restart else await migrations.find_one({"_id": MIGRATION_ID})
+    last_id = state["last_id"] if state else None
+    report = {"updated": 0, "skipped": 0}
+    while True:
+        query: dict[str, Any] = {"amount_in_account_currency": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = (
+            await expenses.find(
+                query,
+                {
+                    "user_id": 1,
+                    "account_name": 1,
+                    "amount": 1,
+                    "currency": 1,
+                    "date": 1,
+                },
+            )
+            .sort("_id", ASCENDING)
+            .limit(batch_size)
+            .to_list(None)
+        )
+        if not batch:
+            break
+
+        updates, skipped = await _batch_updates(accounts, batch)
+        report["skipped"] += skipped
+        if updates:
+            result = await expenses.bulk_write(updates, ordered=False)
+            report["updated"] += result.modified_count
+
+        last_id = batch[-1]["_id"]
+        await migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {
+                "$set": {
+                    "last_id": last_id,
+                    "updated_at": datetime.datetime.now(datetime.timezone.utc),
+                }
+            },
+            upsert=True,
+        )
+    return report
+
+
+async def _main(batch_size: int, restart: bool) -> int:
+    # Imported here so the module can be imported without a configured client
+    from api.utils import db  # pylint: disable=import-outside-toplevel
+
+    database = db.get_database()
+    try:
+        report = await backfill_account_amounts(
+            database, batch_size=batch_size, restart=restart
+        )
+        print(f"updated: {report['updated']}, skipped: {report['skipped']}")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Store the account-currency amount on existing expenses"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="number of expenses converted per round trip",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore the checkpoint of a previous run",
+    )
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_main(args.batch_size, args.restart)))
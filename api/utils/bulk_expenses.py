@@ -0,0 +1,130 @@
+"""
+Writes of bulk expense batches.
+
+A batch validated by the expenses router is written by debiting each account
+once with a guarded $inc, inserting the items with one unordered insert_many
+and refunding the items that failed to insert.
+"""
+
+from collections import defaultdict
+
+from bson.errors import BSONError
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from api.utils.db import accounts_collection, expenses_collection
+from api.utils.rollups import update_rollups
+
+
+async def debit_bulk_accounts(
+    accounts: dict[str, dict],
+    pending: dict[str, list[tuple[int, dict, float]]],
+    results: list[dict],
+) -> dict[str, float]:
+    """
+    Debit each account for its accepted items with one guarded $inc.
+
+    The items of an account whose balance no longer covers them are removed
+    from pending and rejected.
+
+    Returns:
+        dict[str, float]: The balance of each debited account afterwards.
+    """
+    balances = {}
+    for name in list(pending):
+        total = sum(converted_amount for _, _, converted_amount in pending[name])
+        account = await accounts_collection.find_one_and_update(
+            {
+                "_id": accounts[name]["_id"],
+                "currency": accounts[name]["currency"],
+                "balance": {"$gte": total},
+            },
+            {"$inc": {"balance": -total}},
+            projection={"balance": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if account:
+            balances[name] = account["balance"]
+            continue
+        # The balance changed since the snapshot; reject this account's items
+        for index, _, _ in pending.pop(name):
+            results[index]["detail"] = f"Insufficient balance in {name} account"
+    return balances
+
+
+async def insert_bulk_expenses(
+    user_id: str,
+    accounts: dict[str, dict],
+    pending: dict[str, list[tuple[int, dict, float]]],
+    results: list[dict],
+    balances: dict[str, float],
+) -> int:
+    """
+    Write the debited items of a batch with one unordered insert_many.
+
+    Items that fail to insert are refunded to their account and rejected.
+    results and balances are updated in place. If the insert itself fails,
+    every debit is refunded before the error is raised again.
+
+    Returns:
+        int: The number of expenses inserted.
+    """
+    batch = [item for items in pending.values() for item in items]
+    failed: set[int] = set()
+    if batch:
+        try:
+            await expenses_collection.insert_many(
+                [expense_data for _, expense_data, _ in batch], ordered=False
+            )
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details["writeErrors"]}
+        except (PyMongoError, BSONError):
+            # No transaction to roll back, so undo every debit by hand
+            await refund_bulk_accounts(
+                accounts,
+                {
+                    name: sum(converted_amount for _, _, converted_amount in items)
+                    for name, items in pending.items()
+                },
+                balances,
+            )
+            raise
+
+    await update_rollups(
+        user_id,
+        [
+            expense_data
+            for position, (_, expense_data, _) in enumerate(batch)
+            if position not in failed
+        ],
+        {name: account["currency"] for name, account in accounts.items()},
+    )
+    refunds: dict[str, float] = defaultdict(float)
+    for position, (index, expense_data, _) in enumerate(batch):
+        if position in failed:
+            refunds[expense_data["account_name"]] += expense_data[
+                "amount_in_account_currency"
+            ]
+            results[index]["detail"] = "Failed to add expense"
+            continue
+        results[index] = {
+            "index": index,
+            "status": "inserted",
+            "_id": str(expense_data["_id"]),
+        }
+    await refund_bulk_accounts(accounts, refunds, balances)
+    return len(batch) - len(failed)
+
+
+async def refund_bulk_accounts(
+    accounts: dict[str, dict], refunds: dict[str, float], balances: dict[str, float]
+):
+    """Give back the given amounts to their accounts and record the new balances."""
+    for name, amount in refunds.items():
+        refunded = await accounts_collection.find_one_and_update(
+            {"_id": accounts[name]["_id"]},
+            {"$inc": {"balance": amount}},
+            projection={"balance": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        balances[name] = refunded["balance"]
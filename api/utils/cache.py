@@ -0,0 +1,135 @@
+"""In-process caches shared by the API routers."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    A bounded, least-recently-used mapping whose entries expire after a TTL.
+
+    Each entry carries its own deadline so callers can shorten the default TTL
+    (for example to respect a JWT ``exp`` claim). Lookups update the ``hits``
+    and ``misses`` counters.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        deadline, value = entry
+        if deadline <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store value under key for at most ttl seconds (capped at self.ttl)."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove key from the cache if present."""
+        self._entries.pop(key, None)
+
+    def evict_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Remove every entry for which predicate(key, value) is true."""
+        stale = [
+            key for key, (_, value) in self._entries.items() if predicate(key, value)
+        ]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """Return the current entry count and hit/miss counters."""
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class ByteLRUCache:
+    """
+    A least-recently-used mapping of bytes values bounded by their total size.
+
+    Entries larger than max_bytes are never stored.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """Return the cached bytes for key, or None."""
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: bytes) -> None:
+        """Store value under key, evicting the least recently used entries."""
+        self.pop(key)
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove key from the cache if present."""
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        self._entries.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """Return the current entry count, byte size and hit/miss counters."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,147 @@
+"""
+Chart rendering off the event loop.
+
+Charts are drawn by a bounded pool of worker processes with matplotlib's
+non-interactive Agg backend. The workers receive series that were already
+aggregated by MongoDB and return PNG bytes, so a slow render never blocks the
+uvicorn event loop and pyplot's global state is never touched.
+"""
+
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+import matplotlib
+from fastapi import HTTPException
+from matplotlib.figure import Figure
+
+from config import (
+    CHART_RENDER_MAX_PENDING,
+    CHART_RENDER_TIMEOUT_SECONDS,
+    CHART_RENDER_WORKERS,
+)
+
+matplotlib.use("Agg")
+
+
+def _to_png(fig: Figure) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def render_bar_chart(days: list[str], totals: list[float], x_days: int) -> bytes:
+    """Render the daily expenses bar chart as PNG bytes."""
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    ax.bar(range(len(days)), totals, color="skyblue")
+    ax.set_xticks(range(len(days)), days)
+    ax.set_title(f"Total Expenses per Day (Last {x_days} Days)")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Total Expense Amount")
+    ax.tick_params(axis="x", labelrotation=45)
+    fig.tight_layout()
+
+    # Adding labels on top of each bar
+    for i, value in enumerate(totals):
+        ax.text(
+            i,
+            value + 0.5,
+            f"{value:.2f}",
+            ha="center",
+            va="bottom",
+            fontsize=10,
+            color="black",
+        )
+    return _to_png(fig)
+
+
+def render_pie_chart(categories: list[str], totals: list[float], x_days: int) -> bytes:
+    """Render the expenses-by-category pie chart as PNG bytes."""
+    fig = Figure(figsize=(8, 8))
+    ax = fig.add_subplot()
+    ax.pie(
+        totals,
+        labels=categories,
+        autopct="%1.1f%%",
+        startangle=140,
+        colors=["#FF9999", "#FF4D4D", "#FF0000"],
+    )
+    ax.set_title(f"Expense Distribution by Category (Last {x_days} Days)")
+    ax.axis("equal")  # Equal aspect ratio ensures that pie chart is circular.
+    return _to_png(fig)
+
+
+class ChartRenderer:
+    """
+    Runs chart render functions in a process pool with backpressure.
+
+    At most max_pending renders may be queued or running at once; further
+    requests are rejected with a 503 instead of piling up behind the pool.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn" keeps the Motor client and its threads out of the workers
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def render(self, render_fn: Callable[..., bytes], *args) -> bytes:
+        """Run render_fn(*args) in the pool and return the PNG bytes."""
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=503, detail="Chart renderer is busy, try again later"
+            )
+        future = self._get_executor().submit(render_fn, *args)
+        # A render that timed out keeps its worker busy, so it stays counted
+        # until the worker has actually finished it
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: self._release(loop))
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout=self.timeout
+            )
+        except asyncio.TimeoutError as e:
+            raise HTTPException(
+                status_code=504, detail="Chart rendering timed out"
+            ) from e
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        # Called from the executor's thread once a render is done
+        def release():
+            self.pending -= 1
+
+        try:
+            loop.call_soon_threadsafe(release)
+        except RuntimeError:  # The loop is already closed
+            pass
+
+    def stats(self) -> dict:
+        """Return the pool size and the current queue depth."""
+        return {"workers": self.workers, "pending": self.pending}
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+renderer = ChartRenderer(
+    workers=CHART_RENDER_WORKERS,
+    max_pending=CHART_RENDER_MAX_PENDING,
+    timeout=CHART_RENDER_TIMEOUT_SECONDS,
+)
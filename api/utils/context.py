@@ -0,0 +1,93 @@
+"""
+Per-request user context.
+
+A route that needs the caller's identity depends on get_request_context
+instead of verifying the token itself. The token is verified once per
+request, and the user's profile (username, categories, currencies and the
+currency of each account) is loaded on first use and then reused by every
+helper that handles the same request, so no request looks the user up twice.
+Pages that only show the username read just that field when the profile is
+not cached.
+"""
+
+from typing import Optional
+
+from fastapi import Header, HTTPException, Request
+
+from api.utils.auth import verify_token
+from api.utils.profiles import get_user_profile, load_username
+
+
+class RequestContext:
+    """The authenticated user of one request and their memoised profile."""
+
+    def __init__(self, user_id: str, token: str):
+        self.user_id = user_id
+        self.token = token
+        self._profile: Optional[dict] = None
+        self._username: Optional[str] = None
+
+    async def profile(self, refresh: bool = False) -> dict:
+        """
+        Return the user's profile, loading it at most once per request.
+
+        Args:
+            refresh (bool): Reload the profile, e.g. after a cached one failed
+                a validation.
+
+        Returns:
+            dict: username, categories, currencies and accounts ({name: currency}).
+        """
+        if refresh or self._profile is None:
+            self._profile = await get_user_profile(self.user_id, refresh=refresh)
+        return self._profile
+
+    async def username(self) -> str:
+        """Return the user's username, reading only that field on a cache miss."""
+        if self._profile is not None:
+            return self._profile["username"]
+        if self._username is None:
+            self._username = await load_username(self.user_id)
+        return self._username
+
+    async def categories(self) -> dict:
+        """Return the user's categories, keyed by name."""
+        return (await self.profile())["categories"]
+
+    async def currencies(self) -> list[str]:
+        """Return the currencies the user has added."""
+        return (await self.profile())["currencies"]
+
+    async def accounts(self) -> dict[str, str]:
+        """Return the currency of each of the user's accounts, keyed by name."""
+        return (await self.profile())["accounts"]
+
+
+async def resolve_context(request: Request, token: Optional[str]) -> RequestContext:
+    """
+    Return the context of a request, verifying its token on first use.
+
+    Args:
+        request (Request): The request being handled.
+        token (Optional[str]): Access token from the header or the cookie.
+
+    Returns:
+        RequestContext: The context, memoised on the request state.
+
+    Raises:
+        HTTPException: If the token is missing or invalid.
+    """
+    if token is None:
+        raise HTTPException(status_code=401, detail="Token is missing")
+    context = getattr(request.state, "context", None)
+    if context is None or context.token != token:
+        context = RequestContext(await verify_token(token), token)
+        request.state.context = context
+    return context
+
+
+async def get_request_context(
+    request: Request, token: str = Header(None)
+) -> RequestContext:
+    """Dependency resolving the context of a request authenticated by header."""
+    return await resolve_context(request, token)
@@ -0,0 +1,513 @@
+"""
+Streaming import of expenses from CSV files.
+
+A file is parsed in chunks of CSV_IMPORT_CHUNK_ROWS rows, each checked with
+vectorized column operations against the balances of the user's accounts and
+written by debiting each account with one guarded $inc before one unordered
+insert_many, refunding the rows that were not stored. Large
+files are imported by background jobs (see api.utils.import_jobs) that
+checkpoint after every chunk and resume after a restart.
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional
+
+import chardet
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+
+from api.utils import export, import_jobs
+from api.utils.currency import rate_service
+from api.utils.db import accounts_collection, expenses_collection
+from api.utils.rollups import update_rollups
+from api.utils.versions import bump_data_version
+from config import CSV_IMPORT_CHUNK_ROWS
+
+# An import needs every column that an export writes
+CSV_REQUIRED_COLUMNS = export.EXPORT_COLUMNS
+CSV_ENCODING_SAMPLE_BYTES = 64 * 1024
+CSV_MAX_REPORTED_ERRORS = 100
+# Account field recording the debits of import jobs whose rows may not all
+# be stored yet
+PENDING_DEBITS = "pending_import_debits"
+
+
+def sniff_csv_encoding(file) -> str:
+    """
+    Guess the encoding of an uploaded CSV from its first bytes.
+
+    Args:
+        file: A seekable binary file object, rewound afterwards.
+
+    Returns:
+        str: The codec name to decode the whole file with.
+    """
+    sample = file.read(CSV_ENCODING_SAMPLE_BYTES)
+    file.seek(0)
+    encoding = chardet.detect(sample)["encoding"]
+    # A plain ASCII prefix says nothing about the rest of the file
+    if encoding is None or encoding.lower() == "ascii":
+        return "utf-8"
+    return encoding
+
+
+def check_csv_chunk(
+    chunk: pd.DataFrame, accounts: dict[str, dict]
+) -> tuple[pd.Series, pd.DataFrame]:
+    """
+    Parse and validate the fields of one chunk of an expense CSV.
+
+    Every check, including currency conversion into each row's account
+    currency, is a vectorized column operation.
+
+    Args:
+        chunk (pd.DataFrame): Rows read from the CSV, indexed by row number.
+        accounts (dict[str, dict]): The user's accounts (currency and balance)
+            by name.
+
+    Returns:
+        tuple: The reason each row is rejected (NaN for valid rows) and the
+        parsed amount, date, currency, exchange_rate and converted amount of
+        every row.
+    """
+    reasons = pd.Series(None, index=chunk.index, dtype=object)
+
+    def reject(mask: pd.Series, reason: str) -> None:
+        reasons[mask & reasons.isna()] = reason
+
+    reject(chunk.isna().all(axis=1), "Empty row")
+    reject(chunk[CSV_REQUIRED_COLUMNS].isna().any(axis=1), "Missing required fields")
+    parsed = pd.DataFrame(
+        {
+            "amount": pd.to_numeric(chunk["amount"], errors="coerce").astype(float),
+            "date": pd.to_datetime(chunk["date"], errors="coerce"),
+            "currency": chunk["currency"].astype(str).str.strip().str.upper(),
+        }
+    )
+    reject(parsed["amount"].isna(), "Invalid amount")
+    reject(parsed["date"].isna(), "Invalid date")
+    account_currencies = chunk["account_name"].map(
+        {name: account["currency"] for name, account in accounts.items()}
+    )
+    reject(account_currencies.isna(), "Invalid account name")
+
+    parsed["exchange_rate"] = rate_service.convert_batch(
+        np.ones(len(chunk)),
+        parsed["currency"],
+        account_currencies,
+        parsed["date"],
+        errors="coerce",
+    )
+    parsed["converted"] = parsed["amount"] * parsed["exchange_rate"]
+    reject(parsed["converted"].isna(), "Currency conversion failed")
+    return reasons, parsed
+
+
+def reject_overdrafts(
+    names: pd.Series,
+    amounts: pd.Series,
+    reasons: pd.Series,
+    balances: dict,
+    stored: frozenset = frozenset(),
+) -> None:
+    """
+    Reject the rows that the balance of their account no longer covers.
+
+    Rows are debited in file order, as if they were added one by one, so a
+    row that would overdraw its account is rejected and later rows that still
+    fit are kept. Rows in stored were already debited and are skipped.
+    """
+    remaining = dict(balances)
+    valid = reasons.isna() & ~reasons.index.isin(list(stored))
+    for row, name, amount in zip(reasons.index[valid], names[valid], amounts[valid]):
+        if amount > remaining[name]:
+            reasons[row] = f"Insufficient balance in {name} account"
+        else:
+            remaining[name] -= amount
+
+
+def prepare_csv_chunk(
+    chunk: pd.DataFrame,
+    user_id: str,
+    accounts: dict[str, dict],
+    job_id: Optional[ObjectId] = None,
+    stored: frozenset = frozenset(),
+) -> tuple[list[dict], list[int], list[dict]]:
+    """
+    Validate one chunk of an expense CSV and build its documents.
+
+    Args:
+        chunk (pd.DataFrame): Rows read from the CSV, indexed by row number.
+        user_id (str): Owner of the imported expenses.
+        accounts (dict[str, dict]): The user's accounts (currency and balance)
+            by name.
+        job_id (Optional[ObjectId]): Import job of the rows, which gives each
+            document a deterministic _id.
+        stored (frozenset): Rows of the chunk that a previous run of the job
+            already wrote, which do not spend the balance again.
+
+    Returns:
+        tuple: The expense documents to insert, their row numbers and the
+        rejected rows.
+    """
+    reasons, parsed = check_csv_chunk(chunk, accounts)
+    reject_overdrafts(
+        chunk["account_name"],
+        parsed["converted"],
+        reasons,
+        {name: account["balance"] for name, account in accounts.items()},
+        stored,
+    )
+
+    valid = reasons.isna()
+    errors = [
+        {"row": int(row) + 1, "detail": reason}
+        for row, reason in zip(chunk.index[~valid], reasons[~valid])
+    ]
+    documents = pd.DataFrame(
+        {
+            "description": chunk["description"][valid],
+            "amount": parsed["amount"][valid],
+            "currency": parsed["currency"][valid],
+            "category": chunk["category"][valid],
+            "account_name": chunk["account_name"][valid],
+            "date": parsed["date"][valid],
+            "user_id": user_id,
+            "amount_in_account_currency": parsed["converted"][valid],
+            "exchange_rate": parsed["exchange_rate"][valid],
+        }
+    ).to_dict("records")
+    rows = [int(row) + 1 for row in chunk.index[valid]]
+    for document, row in zip(documents, rows):
+        document["_id"] = (
+            ObjectId() if job_id is None else import_jobs.row_id(job_id, row)
+        )
+    return [dict(document) for document in documents], rows, errors
+
+
+def read_csv_chunk(reader) -> Optional[pd.DataFrame]:
+    """Return the next chunk from a pandas CSV reader, or None when exhausted."""
+    return next(reader, None)
+
+
+async def load_import_accounts(user_id: str) -> dict[str, dict]:
+    """Return the currency and current balance of each of a user's accounts."""
+    return {
+        account["name"]: account
+        async for account in accounts_collection.find(
+            {"user_id": user_id}, {"name": 1, "currency": 1, "balance": 1}
+        )
+    }
+
+
+async def stored_import_rows(
+    job_id: Optional[ObjectId], chunk: pd.DataFrame
+) -> frozenset:
+    """Return the rows of a chunk that a previous run of its import job wrote."""
+    if job_id is None:
+        return frozenset()
+    ids = {import_jobs.row_id(job_id, int(row) + 1): row for row in chunk.index}
+    stored = {
+        ids[expense["_id"]]
+        async for expense in expenses_collection.find(
+            {"_id": {"$in": list(ids)}}, {"_id": 1}
+        )
+    }
+    return frozenset(stored)
+
+
+async def stored_amounts(ids: list[ObjectId]) -> dict[ObjectId, float]:
+    """Return the account-currency amount of each of the given expenses that is stored."""
+    return {
+        expense["_id"]: expense["amount_in_account_currency"]
+        async for expense in expenses_collection.find(
+            {"_id": {"$in": ids}}, {"amount_in_account_currency": 1}
+        )
+    }
+
+
+async def debit_csv_rows(
+    user_id: str,
+    documents: list[dict],
+    accounts: dict[str, dict],
+    job_id: Optional[ObjectId],
+) -> tuple[list[dict], dict[str, list[int]]]:
+    """
+    Debit each account once for its rows of a chunk, before they are inserted.
+
+    Every debit is guarded by the account balance. The debit of an import
+    job is also recorded on the account, in the same update, as a pending
+    debit listing its rows, so that a run that stops before settling it is
+    reconciled when the job resumes.
+
+    Returns:
+        tuple: The debits taken and, by account name, the positions of the
+        rows whose account no longer covers them.
+    """
+    by_account: dict[str, list[int]] = defaultdict(list)
+    for position, document in enumerate(documents):
+        by_account[document["account_name"]].append(position)
+    debits, rejected = [], {}
+    for name, positions in by_account.items():
+        debit = {
+            "_id": ObjectId(),
+            "job_id": job_id,
+            "account_id": accounts[name]["_id"],
+            "total": sum(documents[p]["amount_in_account_currency"] for p in positions),
+            "expense_ids": [documents[p]["_id"] for p in positions],
+        }
+        update: dict = {"$inc": {"balance": -debit["total"]}}
+        if job_id is not None:
+            update["$push"] = {PENDING_DEBITS: debit}
+        result = await accounts_collection.update_one(
+            {
+                "_id": debit["account_id"],
+                "user_id": user_id,
+                "currency": accounts[name]["currency"],
+                "balance": {"$gte": debit["total"]},
+            },
+            update,
+        )
+        if result.matched_count:
+            debits.append(debit)
+        else:
+            rejected[name] = positions
+    return debits, rejected
+
+
+async def settle_import_debit(debit: dict) -> set[ObjectId]:
+    """
+    Refund the part of a debit whose rows are not stored.
+
+    A pending debit is cleared in the same update, which only applies while
+    it is still recorded, so settling it twice refunds it once.
+
+    Returns:
+        set: The _ids of the debit's rows that are stored.
+    """
+    stored = await stored_amounts(debit["expense_ids"])
+    query: dict = {"_id": debit["account_id"]}
+    update: dict = {"$inc": {"balance": debit["total"] - sum(stored.values())}}
+    if debit["job_id"] is not None:
+        query[f"{PENDING_DEBITS}._id"] = debit["_id"]
+        update["$pull"] = {PENDING_DEBITS: {"_id": debit["_id"]}}
+    await accounts_collection.update_one(query, update)
+    return set(stored)
+
+
+async def reconcile_import_debits(job_id: ObjectId) -> None:
+    """Settle the debits that a stopped run of an import job left pending."""
+    async for account in accounts_collection.find(
+        {f"{PENDING_DEBITS}.job_id": job_id}, {PENDING_DEBITS: 1}
+    ):
+        for debit in account[PENDING_DEBITS]:
+            if debit["job_id"] == job_id:
+                await settle_import_debit(debit)
+
+
+async def insert_csv_rows(documents: list[dict]) -> None:
+    """
+    Insert expense documents with one unordered insert_many.
+
+    Rows that fail to insert are not reported here: the caller settles its
+    debits against the rows that are stored afterwards.
+    """
+    if documents:
+        try:
+            await expenses_collection.insert_many(documents, ordered=False)
+        except BulkWriteError:
+            pass
+
+
+async def write_csv_chunk(
+    user_id: str,
+    documents: list[dict],
+    rows: list[int],
+    accounts: dict[str, dict],
+    job_id: Optional[ObjectId] = None,
+) -> tuple[int, list[dict]]:
+    """
+    Debit the accounts for the valid rows of a chunk, then insert the rows.
+
+    Rows of a resumed job that are already stored are skipped. Each account
+    is debited with one guarded $inc; if its balance changed since the chunk
+    was checked, its rows are rejected. The rows are then written with one
+    unordered insert_many and the debits settled against what was stored,
+    refunding rows that failed, also when the insert raises.
+
+    Returns:
+        tuple: The number of rows stored and the rows that failed.
+    """
+    row_of = {document["_id"]: row for row, document in zip(rows, documents)}
+    existing = set(await stored_amounts(list(row_of))) if job_id else set()
+    pending = [d for d in documents if d["_id"] not in existing]
+    debits, rejected = await debit_csv_rows(user_id, pending, accounts, job_id)
+    errors: list[dict] = [
+        {
+            "row": row_of[pending[p]["_id"]],
+            "detail": f"Insufficient balance in {name} account",
+        }
+        for name, positions in rejected.items()
+        for p in positions
+    ]
+    debited = {expense_id for debit in debits for expense_id in debit["expense_ids"]}
+    stored: set[ObjectId] = set()
+    try:
+        await insert_csv_rows([d for d in pending if d["_id"] in debited])
+    finally:
+        for debit in debits:
+            stored |= await settle_import_debit(debit)
+    errors.extend(
+        {"row": row_of[expense_id], "detail": "Failed to add expense"}
+        for expense_id in debited - stored
+    )
+    errors.sort(key=lambda error: error["row"])
+
+    await update_rollups(
+        user_id,
+        [d for d in pending if d["_id"] in stored],
+        {name: account["currency"] for name, account in accounts.items()},
+    )
+    return len(existing) + len(stored), errors
+
+
+async def import_csv_expenses(
+    user_id: str,
+    file,
+    skip_rows: int = 0,
+    on_chunk: Optional[Callable[[dict], Awaitable[bool]]] = None,
+    job_id: Optional[ObjectId] = None,
+) -> dict:
+    """
+    Stream expenses from a CSV file into the database in chunks.
+
+    The file is parsed CSV_IMPORT_CHUNK_ROWS rows at a time in a worker thread.
+    Rows are checked against the account balances read before each chunk and
+    rejected, like a single expense, when they would overdraw their account.
+    Each chunk debits every account once with a guarded $inc, is written
+    with one unordered insert_many, and refunds the rows that were not stored,
+    so memory stays bounded and a failed write never leaves rows uncharged.
+
+    Args:
+        user_id (str): Owner of the imported expenses.
+        file: A seekable binary file object holding the CSV.
+        skip_rows (int): Number of data rows already imported, to resume from.
+        on_chunk (Callable): Awaited with the running report after each chunk
+            is written; returning False stops the import.
+        job_id (Optional[ObjectId]): Import job the rows belong to. Each row
+            then gets a deterministic _id, so a resumed job skips the rows
+            it already wrote, and debits a stopped run left pending are
+            settled before it resumes (see reconcile_import_debits).
+
+    Returns:
+        dict: Counts of parsed, inserted and rejected rows and the first
+        rejected rows with their reasons.
+    """
+    reader = pd.read_csv(
+        file,
+        encoding=sniff_csv_encoding(file),
+        chunksize=CSV_IMPORT_CHUNK_ROWS,
+        skiprows=range(1, skip_rows + 1),
+    )
+    report: dict = {"parsed": 0, "inserted": 0, "rejected": 0, "errors": []}
+    try:
+        while (chunk := await asyncio.to_thread(read_csv_chunk, reader)) is not None:
+            if any(column not in chunk for column in CSV_REQUIRED_COLUMNS):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Missing required columns. "
+                    f"Expected: {', '.join(CSV_REQUIRED_COLUMNS)}",
+                )
+            chunk.index += skip_rows
+            report["parsed"] += len(chunk)
+            accounts = await load_import_accounts(user_id)
+            documents, rows, errors = await asyncio.to_thread(
+                prepare_csv_chunk,
+                chunk,
+                user_id,
+                accounts,
+                job_id,
+                await stored_import_rows(job_id, chunk),
+            )
+            if documents:
+                inserted, failed = await write_csv_chunk(
+                    user_id, documents, rows, accounts, job_id
+                )
+                report["inserted"] += inserted
+                errors.extend(failed)
+
+            report["rejected"] += len(errors)
+            room = CSV_MAX_REPORTED_ERRORS - len(report["errors"])
+            report["errors"].extend(errors[:room])
+            if on_chunk is not None and not await on_chunk(report):
+                break
+    finally:
+        reader.close()
+        if report["inserted"]:
+            await bump_data_version(user_id)
+    return report
+
+
+# Background import tasks of this worker, referenced until they finish
+import_tasks: set[asyncio.Task] = set()
+
+
+async def run_import_job(job_id: ObjectId) -> None:
+    """
+    Claim an import job and run it to completion, failure or cancellation.
+
+    Progress is checkpointed after every chunk, so a job interrupted by a
+    restart resumes after the last chunk it recorded.
+
+    Args:
+        job_id (ObjectId): ID of the job to run.
+    """
+    job = await import_jobs.claim_job(job_id)
+    if job is None:
+        return
+
+    async def checkpoint(report: dict) -> bool:
+        return await import_jobs.checkpoint_job(
+            job_id,
+            {
+                "checkpoint": job["checkpoint"] + report["parsed"],
+                "parsed": job["parsed"] + report["parsed"],
+                "inserted": job["inserted"] + report["inserted"],
+                "rejected": job["rejected"] + report["rejected"],
+                "errors": (job["errors"] + report["errors"])[:CSV_MAX_REPORTED_ERRORS],
+            },
+        )
+
+    try:
+        await reconcile_import_debits(job_id)
+        with await import_jobs.open_upload(job) as upload:
+            await import_csv_expenses(
+                job["user_id"],
+                upload,
+                skip_rows=job["checkpoint"],
+                on_chunk=checkpoint,
+                job_id=job_id,
+            )
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        await import_jobs.finish_job(job, "failed", f"Failed to process CSV: {e}")
+        return
+    await import_jobs.finish_job(job, "completed")
+
+
+def start_import_job(job_id: ObjectId) -> None:
+    """Run an import job in the background of this worker."""
+    task = asyncio.create_task(run_import_job(job_id))
+    import_tasks.add(task)
+    task.add_done_callback(import_tasks.discard)
+
+
+async def resume_import_jobs() -> int:
+    """Restart every active import job whose worker has gone away."""
+    job_ids = await import_jobs.claimable_job_ids()
+    for job_id in job_ids:
+        start_import_job(job_id)
+    return len(job_ids)
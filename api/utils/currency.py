@@ -0,0 +1,246 @@
+"""
+Currency conversion rates for the Money Manager API.
+
+Rates come from the ECB history bundled with currency_converter. The history
+is expanded once into a dense table with one row per day since 1999 and one
+column per currency, with weekends and holidays carrying the previous quote
+forward and days before a currency's first quote using that first quote.
+
+The table is cached on disk as a .npy file and memory-mapped, so every uvicorn
+worker on a host shares one copy through the page cache. The cache directory
+must be private to the app's user, since the rates are read back from it
+unverified. The table is opened on first use (or up front from the FastAPI
+lifespan) rather than when a module is imported.
+"""
+
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+from currency_converter import CURRENCY_FILE  # type: ignore
+
+from config import RATE_TABLE_DIR
+
+REFERENCE_CURRENCY = "EUR"
+
+
+def build_rate_table(source: str) -> tuple[np.ndarray, list[str], datetime.date]:
+    """
+    Expand the ECB rate history into a forward-filled per-day table.
+
+    Args:
+        source (str): Path of the ECB eurofxref-hist CSV (optionally zipped).
+
+    Returns:
+        tuple: The table of units of each currency per EUR (days x currencies),
+        the currency codes of its columns and the date of its first row.
+    """
+    frame = pd.read_csv(source, index_col="Date", parse_dates=True, na_values=["N/A"])
+    frame = frame.loc[:, ~frame.columns.str.startswith("Unnamed")]
+    frame.columns = frame.columns.str.strip()
+    frame[REFERENCE_CURRENCY] = 1.0
+    frame = frame.sort_index()
+    days = pd.date_range(frame.index[0], frame.index[-1], freq="D")
+    frame = frame.reindex(days).ffill().bfill()
+    currencies = sorted(frame.columns)
+    return frame[currencies].to_numpy(dtype=np.float64), currencies, days[0].date()
+
+
+def ensure_private_dir(path: Path) -> None:
+    """
+    Create a directory only the current user can access, or check an existing one.
+
+    Raises:
+        PermissionError: If the directory belongs to another user or other
+            users can write to it.
+    """
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    status = path.stat()
+    if hasattr(os, "getuid") and status.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not owned by the current user")
+    if status.st_mode & 0o022:
+        raise PermissionError(f"{path} is writable by other users")
+
+
+class RateService:
+    """
+    Exchange rates by day, backed by a memory-mapped rate table.
+
+    Latest rates are also kept in a dense currency x currency matrix, so a
+    conversion without a date is two dictionary lookups and a multiplication.
+    Dates past the end of the history use its last day and dates before its
+    start use its first day.
+    """
+
+    def __init__(self, table_dir: Optional[str] = None):
+        self.table_dir = Path(table_dir or RATE_TABLE_DIR)
+        self._lock = threading.Lock()
+        # Filled in last by load(), so it doubles as the loaded flag
+        self.index: dict[str, int] = {}
+        self.codes = pd.Index([], dtype=object)
+        self.first_day = datetime.date.min
+        # table[d, c] is the value of one EUR in currency c on first_day + d
+        self.table = np.ones((0, 0))
+        # matrix[i, j] is the latest value of one unit of currency i in currency j
+        self.matrix = np.ones((0, 0))
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the rate table has been opened yet."""
+        return bool(self.index)
+
+    def _table_paths(self) -> tuple[Path, Path]:
+        stat = os.stat(CURRENCY_FILE)
+        stem = f"ecb-rates-{stat.st_size}-{int(stat.st_mtime)}"
+        return self.table_dir / f"{stem}.npy", self.table_dir / f"{stem}.json"
+
+    def _write_table(self, table_path: Path, meta_path: Path) -> None:
+        table, currencies, first_day = build_rate_table(CURRENCY_FILE)
+        # Written under unique names and renamed into place, so concurrent
+        # workers never read a partial file; the metadata goes last
+        suffix = f".{os.getpid()}.tmp"
+        with open(f"{table_path}{suffix}", "wb") as file:
+            np.save(file, table)
+        os.replace(f"{table_path}{suffix}", table_path)
+        with open(f"{meta_path}{suffix}", "w", encoding="utf-8") as file:
+            json.dump(
+                {"currencies": currencies, "first_day": first_day.isoformat()}, file
+            )
+        os.replace(f"{meta_path}{suffix}", meta_path)
+
+    def load(self) -> None:
+        """Open the rate table, building it on disk first if needed."""
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            ensure_private_dir(self.table_dir)
+            table_path, meta_path = self._table_paths()
+            if not meta_path.exists():
+                self._write_table(table_path, meta_path)
+            with open(meta_path, encoding="utf-8") as file:
+                meta = json.load(file)
+            self.table = np.load(table_path, mmap_mode="r")
+            self.first_day = datetime.date.fromisoformat(meta["first_day"])
+            self.codes = pd.Index(meta["currencies"], dtype=object)
+            latest = np.asarray(self.table[-1])
+            self.matrix = latest[np.newaxis, :] / latest[:, np.newaxis]
+            self.index = {code: position for position, code in enumerate(self.codes)}
+
+    @property
+    def currencies(self) -> list[str]:
+        """Every supported currency code."""
+        self.load()
+        return list(self.index)
+
+    def day_positions(self, dates: Any) -> np.ndarray:
+        """Map dates (None for the latest) onto rows of the rate table."""
+        self.load()
+        days = pd.to_datetime(
+            pd.Series(dates, dtype=object), errors="coerce", utc=True
+        ).dt.tz_localize(None)
+        offsets = (days - pd.Timestamp(self.first_day)).dt.days
+        last = len(self.table) - 1
+        return offsets.fillna(last).clip(0, last).to_numpy(dtype=np.int64)
+
+    def rate(
+        self, from_cur: str, to_cur: str, date: Optional[datetime.date] = None
+    ) -> float:
+        """
+        Return the value of one unit of from_cur in to_cur.
+
+        Args:
+            from_cur (str): Currency to convert from.
+            to_cur (str): Currency to convert to.
+            date (Optional[date]): Use the rate of this day instead of the latest.
+
+        Raises:
+            ValueError: If either currency is not supported.
+        """
+        if from_cur == to_cur:
+            return 1.0
+        self.load()
+        try:
+            from_position, to_position = self.index[from_cur], self.index[to_cur]
+        except KeyError as e:
+            raise ValueError(f"{e.args[0]} is not a supported currency") from e
+        if date is None:
+            return float(self.matrix[from_position, to_position])
+        row = self.table[self.day_positions([date])[0]]
+        return float(row[to_position] / row[from_position])
+
+    def convert(
+        self,
+        amount: float,
+        from_cur: str,
+        to_cur: str,
+        date: Optional[datetime.date] = None,
+    ) -> float:
+        """Convert amount from from_cur to to_cur, at the latest or a given rate."""
+        return amount * self.rate(from_cur, to_cur, date)
+
+    def convert_batch(
+        self,
+        amounts: Any,
+        from_currencies: Any,
+        to_currencies: Any,
+        dates: Any = None,
+        errors: str = "raise",
+    ) -> np.ndarray:
+        """
+        Convert many amounts at once.
+
+        Currency codes and dates are mapped onto the rate table with vectorized
+        index lookups, so the cost does not depend on how many distinct
+        currencies or days are involved.
+
+        Args:
+            amounts (array-like): Amounts to convert.
+            from_currencies (array-like): Currency of each amount.
+            to_currencies (str or array-like): Target currency, for all amounts
+                or for each one.
+            dates (array-like): Optional day of each conversion; None entries
+                use the latest rate.
+            errors (str): "raise" to fail on unsupported currencies, "coerce"
+                to return NaN for their amounts.
+
+        Returns:
+            np.ndarray: The converted amounts.
+
+        Raises:
+            ValueError: If errors is "raise" and a currency is not supported.
+        """
+        self.load()
+        amounts = np.asarray(amounts, dtype=float)
+        from_codes = np.asarray(from_currencies, dtype=object).reshape(amounts.shape)
+        to_codes = np.broadcast_to(
+            np.asarray(to_currencies, dtype=object), amounts.shape
+        )
+        from_positions = self.codes.get_indexer(pd.Index(from_codes, dtype=object))
+        to_positions = self.codes.get_indexer(pd.Index(to_codes, dtype=object))
+        same = from_codes == to_codes
+        unknown = ~same & ((from_positions < 0) | (to_positions < 0))
+        if errors == "raise" and unknown.any():
+            codes = set(from_codes[unknown & (from_positions < 0)]) | set(
+                to_codes[unknown & (to_positions < 0)]
+            )
+            raise ValueError(
+                f"{', '.join(sorted(map(str, codes)))} is not a supported currency"
+            )
+
+        if dates is None:
+            rates = self.matrix[from_positions, to_positions]
+        else:
+            rows = self.day_positions(dates)
+            rates = self.table[rows, to_positions] / self.table[rows, from_positions]
+        rates = np.where(same, 1.0, np.where(unknown, np.nan, rates))
+        return amounts * rates
+
+
+rate_service = RateService()
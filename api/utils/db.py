@@ -0,0 +1,118 @@
+"""
+Shared MongoDB client for the Money Manager API.
+
+A single pooled AsyncIOMotorClient is created per process (normally from the
+FastAPI lifespan) and every router reaches its collections through it.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorClientSession,
+    AsyncIOMotorCollection,
+    AsyncIOMotorDatabase,
+    AsyncIOMotorGridFSBucket,
+)
+
+from config import (
+    MONGO_COMPRESSORS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_URI,
+    MONGO_USE_TRANSACTIONS,
+)
+
+# Rebound by connect() and close(), so not a constant
+_client: Optional[AsyncIOMotorClient] = None  # pylint: disable=invalid-name
+
+
+def client_options() -> dict[str, Any]:
+    """Build the pool, timeout and compression options for the client."""
+    options: dict[str, Any] = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+    }
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+def connect() -> AsyncIOMotorClient:
+    """Return the shared client, creating it on first use."""
+    global _client  # pylint: disable=global-statement
+    if _client is None:
+        _client = AsyncIOMotorClient(MONGO_URI, **client_options())
+    return _client
+
+
+def close():
+    """Close the shared client and release its connection pool."""
+    global _client  # pylint: disable=global-statement
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def get_database() -> AsyncIOMotorDatabase:
+    """Return the application database on the shared client."""
+    return connect()[MONGO_DB_NAME]
+
+
+def get_collection(name: str) -> AsyncIOMotorCollection:
+    """Return a collection of the application database."""
+    return get_database()[name]
+
+
+def get_gridfs_bucket(name: str) -> AsyncIOMotorGridFSBucket:
+    """Return a GridFS bucket of the application database."""
+    return AsyncIOMotorGridFSBucket(get_database(), bucket_name=name)
+
+
+@asynccontextmanager
+async def transaction() -> AsyncIterator[Optional[AsyncIOMotorClientSession]]:
+    """
+    Run a block in a multi-document transaction.
+
+    Yields the session to pass to every operation of the block, or None when
+    MONGO_USE_TRANSACTIONS is disabled (standalone servers cannot run
+    transactions); callers must then compensate for partial failures.
+    """
+    if not MONGO_USE_TRANSACTIONS:
+        yield None
+        return
+    async with await connect().start_session() as session:
+        async with session.start_transaction():
+            yield session
+
+
+# A proxy: every collection method is reached through __getattr__
+class LazyCollection:  # pylint: disable=too-few-public-methods
+    """
+    Module-level handle to a collection that is resolved on every access, so
+    routers can import it before the shared client exists.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(get_collection(self.name), attr)
+
+
+users_collection = LazyCollection("users")
+tokens_collection = LazyCollection("tokens")
+accounts_collection = LazyCollection("accounts")
+expenses_collection = LazyCollection("expenses")
+import_jobs_collection = LazyCollection("import_jobs")
+rollups_collection = LazyCollection("rollups")
+revocations_collection = LazyCollection("revocations")
@@ -0,0 +1,393 @@
+"""
+Streaming exporters for expense data.
+
+Expenses are read from a Motor cursor in batches and encoded batch by batch, so
+memory use does not grow with the length of a user's history. CSV, NDJSON and
+Parquet bytes are yielded as soon as each batch is encoded; an xlsx workbook
+can only be read once it is complete, so it is spooled to a temporary file and
+then sent in fixed-size chunks.
+"""
+
+import asyncio
+import csv
+import datetime
+import io
+import json
+import tempfile
+import zlib
+from typing import IO, Any, AsyncIterator, Iterator, Optional
+
+import pyarrow as pa  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+import zstandard  # type: ignore
+from fastapi.responses import StreamingResponse
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+from api.utils.db import expenses_collection
+
+EXPORT_COLUMNS = [
+    "description",
+    "amount",
+    "currency",
+    "category",
+    "account_name",
+    "date",
+]
+# Exported only when asked for by name
+OPTIONAL_EXPORT_COLUMNS = ["amount_in_account_currency", "exchange_rate"]
+EXPORT_BATCH_SIZE = 1000
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+STREAM_CHUNK_BYTES = 64 * 1024
+# Exports larger than this are spooled to disk before being sent
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+PARQUET_ROW_GROUP_ROWS = 50_000
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+PARQUET_SCHEMA = pa.schema(
+    [
+        ("description", pa.string()),
+        ("amount", pa.float64()),
+        ("currency", pa.string()),
+        ("category", pa.string()),
+        ("account_name", pa.string()),
+        ("date", pa.timestamp("ms")),
+        ("amount_in_account_currency", pa.float64()),
+        ("exchange_rate", pa.float64()),
+    ]
+)
+
+
+async def expense_batches(
+    query: dict, columns: list[str], batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[list[list[Any]]]:
+    """
+    Yield matching expenses as rows of column values, batch_size at a time.
+
+    Args:
+        query (dict): Filter on the expenses collection.
+        columns (list[str]): Fields to export, in output order.
+        batch_size (int): Number of rows per batch.
+    """
+    cursor = expenses_collection.find(
+        query,
+        {column: 1 for column in columns} | {"_id": 0},
+        batch_size=batch_size,
+    ).sort([("date", 1), ("_id", 1)])
+    batch: list[list[Any]] = []
+    async for expense in cursor:
+        batch.append([expense.get(column) for column in columns])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def column_widths(columns: list[str], rows: list[list[Any]]) -> list[int]:
+    """Size each column to its longest rendered value plus some padding."""
+    widths = [len(column) for column in columns]
+    for row in rows:
+        for index, value in enumerate(row):
+            if value is not None:
+                widths[index] = max(widths[index], len(str(value)))
+    return [width + 2 for width in widths]
+
+
+def _append_rows(sheet, rows: list[list[Any]]) -> None:
+    for row in rows:
+        sheet.append(row)
+
+
+async def write_xlsx(
+    batches: AsyncIterator[list[list[Any]]], columns: list[str], first: list[list[Any]]
+) -> IO[bytes]:
+    """
+    Write batches of rows to an xlsx workbook in openpyxl's write-only mode.
+
+    A write-only sheet emits its column definitions before its first row, so
+    the widths are sized from the header and the first batch rather than the
+    whole export.
+
+    Args:
+        batches (AsyncIterator): The remaining batches of rows.
+        columns (list[str]): Column headers.
+        first (list[list[Any]]): The first batch of rows.
+
+    Returns:
+        IO[bytes]: The workbook, rewound to the start. The caller closes it.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Expenses")
+    for index, width in enumerate(column_widths(columns, first), start=1):
+        sheet.column_dimensions[get_column_letter(index)].width = width
+    sheet.append(columns)
+    await asyncio.to_thread(_append_rows, sheet, first)
+    async for batch in batches:
+        await asyncio.to_thread(_append_rows, sheet, batch)
+
+    # Left open for the caller to stream; closed here only if saving fails
+    output = tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+        max_size=SPOOL_MAX_BYTES
+    )
+    try:
+        await asyncio.to_thread(workbook.save, output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def iter_file(file: IO[bytes], chunk_size: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Yield a file's contents in chunks and close it once exhausted."""
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the response content encoding from an Accept-Encoding header.
+
+    zstd is preferred over gzip; quality values other than q=0 are otherwise
+    ignored.
+
+    Returns:
+        Optional[str]: "zstd", "gzip" or None for the identity encoding.
+    """
+    accepted = set()
+    for item in (accept_encoding or "").lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip())
+    for coding in ("zstd", "gzip"):
+        if coding in accepted:
+            return coding
+    return None
+
+
+def _compressor(encoding: Optional[str]):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compressobj()
+    if encoding == "gzip":
+        return zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    return None
+
+
+def _csv_chunk(rows: list[list[Any]]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _ndjson_chunk(columns: list[str], rows: list[list[Any]]) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=_json_default) + "\n"
+        for row in rows
+    ).encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file that hands back whatever was written since last drained."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore[override]
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        """Return and forget the bytes written so far."""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _float_or_none(value: Any) -> Optional[float]:
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parquet_table(columns: list[str], rows: list[list[Any]]) -> pa.Table:
+    schema = pa.schema([PARQUET_SCHEMA.field(column) for column in columns])
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if pa.types.is_floating(field.type):
+            values = [_float_or_none(value) for value in values]
+        elif pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        elif pa.types.is_timestamp(field.type):
+            values = [
+                value if isinstance(value, datetime.datetime) else None
+                for value in values
+            ]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+async def _parquet_stream(
+    batches: AsyncIterator[list[list[Any]]], columns: list[str]
+) -> AsyncIterator[bytes]:
+    sink = _ChunkSink()
+    schema = pa.schema([PARQUET_SCHEMA.field(column) for column in columns])
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for batch in batches:
+            table = await asyncio.to_thread(_parquet_table, columns, batch)
+            await asyncio.to_thread(writer.write_table, table)
+            if chunk := sink.drain():
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+async def stream_export(
+    query: dict,
+    columns: list[str],
+    export_format: str,
+    encoding: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Encode matching expenses as CSV, NDJSON or Parquet, one batch at a time.
+
+    Each Parquet row group holds PARQUET_ROW_GROUP_ROWS rows and is compressed
+    with zstd inside the file, so encoding applies to CSV and NDJSON only.
+
+    Args:
+        query (dict): Filter on the expenses collection.
+        columns (list[str]): Fields to export, in output order.
+        export_format (str): One of EXPORT_FORMATS.
+        encoding (Optional[str]): "zstd", "gzip" or None.
+
+    Yields:
+        bytes: Successive pieces of the (compressed) export.
+    """
+    if export_format == "parquet":
+        batches = expense_batches(query, columns, PARQUET_ROW_GROUP_ROWS)
+        async for chunk in _parquet_stream(batches, columns):
+            yield chunk
+        return
+
+    async def encoded() -> AsyncIterator[bytes]:
+        if export_format == "csv":
+            yield _csv_chunk([columns])
+        async for batch in expense_batches(query, columns):
+            if export_format == "csv":
+                yield _csv_chunk(batch)
+            else:
+                yield _ndjson_chunk(columns, batch)
+
+    compressor = _compressor(encoding)
+    async for data in encoded():
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def select_columns(columns: Optional[str]) -> list[str]:
+    """
+    Parse the comma-separated fields asked for by an export request.
+
+    Raises:
+        ValueError: If no field or an unknown one is asked for.
+    """
+    if not columns:
+        return EXPORT_COLUMNS
+    selected = [column.strip() for column in columns.split(",")]
+    allowed = EXPORT_COLUMNS + OPTIONAL_EXPORT_COLUMNS
+    if any(column not in allowed for column in selected):
+        raise ValueError(
+            f"Invalid export columns. Expected any of: {', '.join(allowed)}"
+        )
+    return selected
+
+
+def export_response(
+    query: dict,
+    export_format: str,
+    columns: Optional[str],
+    accept_encoding: Optional[str],
+) -> StreamingResponse:
+    """
+    Stream the expenses matching a query as an attachment.
+
+    Args:
+        query (dict): Filter on the expenses collection.
+        export_format (str): One of EXPORT_FORMATS.
+        columns (Optional[str]): Comma-separated fields to export, all but
+            OPTIONAL_EXPORT_COLUMNS by default.
+        accept_encoding (Optional[str]): Accept-Encoding header of the request.
+
+    Returns:
+        StreamingResponse: The export, compressed when the format allows it.
+
+    Raises:
+        ValueError: If the format or a field is not supported.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Invalid export format. Expected one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    selected = select_columns(columns)
+    media_type, extension = EXPORT_FORMATS[export_format]
+    headers = {
+        "Content-Disposition": f"attachment; filename=expenses.{extension}",
+        "Vary": "Accept-Encoding",
+    }
+    encoding = None
+    if export_format != "parquet":
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+    return StreamingResponse(
+        stream_export(query, selected, export_format, encoding),
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+async def xlsx_response(query: dict) -> Optional[StreamingResponse]:
+    """
+    Send the expenses matching a query as an xlsx workbook attachment.
+
+    Returns:
+        Optional[StreamingResponse]: The workbook, or None if no expense matches.
+    """
+    batches = expense_batches(query, EXPORT_COLUMNS)
+    first = await anext(batches, None)
+    if first is None:
+        return None
+    output = await write_xlsx(batches, EXPORT_COLUMNS, first)
+    return StreamingResponse(
+        iter_file(output),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": "attachment; filename=expenses.xlsx"},
+    )
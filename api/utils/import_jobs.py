@@ -0,0 +1,220 @@
+"""
+Persistence for background CSV import jobs.
+
+The uploaded file is kept in GridFS and each job document records its status,
+progress counters and the number of data rows already imported. A worker owns
+a job while it holds the job's lease, renewing it at every checkpoint; a job
+whose lease has expired (its worker died or was restarted) is claimed again and
+resumes after its last checkpointed row.
+
+Every imported row gets an _id derived from its job and row number, so rows
+that were written but not yet checkpointed when a worker stopped are
+recognised, rather than duplicated, when the job resumes.
+"""
+
+import datetime
+import hashlib
+import tempfile
+from typing import IO, Any, BinaryIO, Optional
+
+from bson import ObjectId
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument
+
+from api.utils.db import get_gridfs_bucket, import_jobs_collection
+from config import IMPORT_JOB_LEASE_SECONDS
+
+ACTIVE_STATES = ["queued", "running"]
+UPLOAD_BUCKET = "import_uploads"
+# Uploads larger than this are spooled to disk while a job reads them
+UPLOAD_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _lease_deadline() -> datetime.datetime:
+    return _now() + datetime.timedelta(seconds=IMPORT_JOB_LEASE_SECONDS)
+
+
+def row_id(job_id: ObjectId, row: int) -> ObjectId:
+    """
+    Return the deterministic _id of the expense imported from a job's row.
+
+    The job's timestamp is kept, so the IDs still sort by creation time.
+    """
+    digest = hashlib.sha256(job_id.binary + row.to_bytes(8, "big")).digest()
+    return ObjectId(job_id.binary[:4] + digest[:8])
+
+
+def job_summary(job: dict) -> dict[str, Any]:
+    """Return the client-facing fields of a job document."""
+    return {
+        "job_id": str(job["_id"]),
+        "filename": job["filename"],
+        "status": job["status"],
+        "parsed": job["parsed"],
+        "inserted": job["inserted"],
+        "rejected": job["rejected"],
+        "errors": job["errors"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+async def create_job(user_id: str, filename: str, source: BinaryIO) -> ObjectId:
+    """
+    Store an uploaded CSV in GridFS and queue an import job for it.
+
+    Args:
+        user_id (str): Owner of the import.
+        filename (str): Name of the uploaded file.
+        source (BinaryIO): The uploaded file.
+
+    Returns:
+        ObjectId: ID of the new job.
+    """
+    file_id = await get_gridfs_bucket(UPLOAD_BUCKET).upload_from_stream(
+        filename, source, metadata={"user_id": user_id}
+    )
+    now = _now()
+    result = await import_jobs_collection.insert_one(
+        {
+            "user_id": user_id,
+            "filename": filename,
+            "file_id": file_id,
+            "status": "queued",
+            "checkpoint": 0,
+            "parsed": 0,
+            "inserted": 0,
+            "rejected": 0,
+            "errors": [],
+            "error": None,
+            "lease_expires_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+    )
+    return result.inserted_id
+
+
+async def get_job(user_id: str, job_id: str) -> Optional[dict]:
+    """Return the user's job with the given ID, or None."""
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await import_jobs_collection.find_one(
+        {"_id": ObjectId(job_id), "user_id": user_id}
+    )
+
+
+async def claim_job(job_id: ObjectId) -> Optional[dict]:
+    """
+    Take the lease on an active job.
+
+    Returns:
+        Optional[dict]: The job, or None if it is finished or leased elsewhere.
+    """
+    return await import_jobs_collection.find_one_and_update(
+        {
+            "_id": job_id,
+            "status": {"$in": ACTIVE_STATES},
+            "lease_expires_at": {"$lte": _now()},
+        },
+        {
+            "$set": {
+                "status": "running",
+                "lease_expires_at": _lease_deadline(),
+                "updated_at": _now(),
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def claimable_job_ids() -> list[ObjectId]:
+    """Return the IDs of active jobs whose lease has expired."""
+    cursor = import_jobs_collection.find(
+        {"status": {"$in": ACTIVE_STATES}, "lease_expires_at": {"$lte": _now()}},
+        {"_id": 1},
+    )
+    return [job["_id"] async for job in cursor]
+
+
+async def checkpoint_job(job_id: ObjectId, progress: dict[str, Any]) -> bool:
+    """
+    Record a job's progress and renew its lease.
+
+    Returns:
+        bool: False if the job is no longer running (e.g. it was cancelled).
+    """
+    result = await import_jobs_collection.update_one(
+        {"_id": job_id, "status": "running"},
+        {
+            "$set": {
+                **progress,
+                "lease_expires_at": _lease_deadline(),
+                "updated_at": _now(),
+            }
+        },
+    )
+    return result.matched_count == 1
+
+
+async def _delete_upload(job: dict) -> None:
+    try:
+        await get_gridfs_bucket(UPLOAD_BUCKET).delete(job["file_id"])
+    except NoFile:
+        pass
+
+
+async def finish_job(job: dict, status: str, error: Optional[str] = None) -> None:
+    """Mark a running job as completed or failed and delete its upload."""
+    await import_jobs_collection.update_one(
+        {"_id": job["_id"], "status": "running"},
+        {"$set": {"status": status, "error": error, "updated_at": _now()}},
+    )
+    await _delete_upload(job)
+
+
+async def cancel_job(user_id: str, job_id: str) -> Optional[dict]:
+    """
+    Cancel one of the user's active jobs.
+
+    A running job stops at its next checkpoint; rows imported before then are
+    kept.
+
+    Returns:
+        Optional[dict]: The cancelled job, or None if no active job matched.
+    """
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = await import_jobs_collection.find_one_and_update(
+        {
+            "_id": ObjectId(job_id),
+            "user_id": user_id,
+            "status": {"$in": ACTIVE_STATES},
+        },
+        {"$set": {"status": "cancelled", "updated_at": _now()}},
+    )
+    if job is None:
+        return None
+    # A running worker has already copied the upload out of GridFS
+    await _delete_upload(job)
+    job["status"] = "cancelled"
+    return job
+
+
+async def open_upload(job: dict) -> IO[bytes]:
+    """Copy a job's upload from GridFS into a seekable temporary file."""
+    upload = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    try:
+        await get_gridfs_bucket(UPLOAD_BUCKET).download_to_stream(
+            job["file_id"], upload
+        )
+    except BaseException:
+        upload.close()
+        raise
+    upload.seek(0)
+    return upload
@@ -0,0 +1,202 @@
+"""
+Index manifest for the Money Manager collections.
+
+The manifest is applied idempotently at startup from the FastAPI lifespan and
+can also be applied by hand::
+
+    python -m api.utils.indexes          # create missing indexes
+    python -m api.utils.indexes --check  # also explain the hot router queries
+
+``--check`` exits with a non-zero status if any hot query is answered by a
+collection scan.
+"""
+
+import argparse
+import asyncio
+import datetime
+import sys
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "tokens": [
+        IndexModel([("user_id", ASCENDING), ("token", ASCENDING)], name="user_token"),
+        IndexModel([("token", ASCENDING)], name="token"),
+        # Expired tokens are removed by the server once expires_at has passed
+        IndexModel(
+            [("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0
+        ),
+    ],
+    "accounts": [
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING)], name="user_name"),
+    ],
+    "expenses": [
+        # Also serves the plain {"user_id": ...} filter through its prefix and
+        # the (date, _id) keyset pagination of GET /expenses/
+        IndexModel(
+            [("user_id", ASCENDING), ("date", ASCENDING), ("_id", ASCENDING)],
+            name="user_date_id",
+        ),
+        IndexModel(
+            [
+                ("user_id", ASCENDING),
+                ("category", ASCENDING),
+                ("date", ASCENDING),
+                ("_id", ASCENDING),
+            ],
+            name="user_category_date_id",
+        ),
+        IndexModel(
+            [
+                ("user_id", ASCENDING),
+                ("account_name", ASCENDING),
+                ("date", ASCENDING),
+                ("_id", ASCENDING),
+            ],
+            name="user_account_date_id",
+        ),
+    ],
+    "import_jobs": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Jobs to resume: active and with an expired lease
+        IndexModel(
+            [("status", ASCENDING), ("lease_expires_at", ASCENDING)],
+            name="status_lease",
+        ),
+    ],
+    "rollups": [
+        # Unique so concurrent upserts of a new rollup cannot create two
+        IndexModel(
+            [
+                ("user_id", ASCENDING),
+                ("kind", ASCENDING),
+                ("period", ASCENDING),
+                ("category", ASCENDING),
+                ("account_name", ASCENDING),
+                ("currency", ASCENDING),
+            ],
+            name="user_kind_period_unique",
+            unique=True,
+        ),
+    ],
+    "Telegram": [
+        IndexModel([("telegram_id", ASCENDING)], name="telegram_id"),
+    ],
+}
+
+# Indexes superseded by the manifest, dropped by ensure_indexes
+OBSOLETE_INDEXES: dict[str, list[str]] = {
+    "expenses": ["user_date"],
+}
+
+_SAMPLE_ID = "000000000000000000000000"
+_SAMPLE_DATE = datetime.datetime(2000, 1, 1)
+
+# (description, collection, filter) for every query shape issued by the routers
+HOT_QUERIES: list[tuple[str, str, dict[str, Any]]] = [
+    ("verify_token", "tokens", {"user_id": _SAMPLE_ID, "token": "t"}),
+    ("expired token cleanup", "tokens", {"token": "t"}),
+    ("tokens by user", "tokens", {"user_id": _SAMPLE_ID}),
+    ("login / create_user", "users", {"username": "u"}),
+    ("account by name", "accounts", {"user_id": _SAMPLE_ID, "name": "Checking"}),
+    ("accounts by user", "accounts", {"user_id": _SAMPLE_ID}),
+    ("expenses by user", "expenses", {"user_id": _SAMPLE_ID}),
+    (
+        "analytics window",
+        "expenses",
+        {"user_id": _SAMPLE_ID, "date": {"$gte": _SAMPLE_DATE}},
+    ),
+    (
+        "expenses by category",
+        "expenses",
+        {"user_id": _SAMPLE_ID, "category": "Food"},
+    ),
+    (
+        "expenses by account",
+        "expenses",
+        {"user_id": _SAMPLE_ID, "account_name": "Checking"},
+    ),
+    ("import jobs by user", "import_jobs", {"user_id": _SAMPLE_ID}),
+    (
+        "import jobs to resume",
+        "import_jobs",
+        {
+            "status": {"$in": ["queued", "running"]},
+            "lease_expires_at": {"$lte": _SAMPLE_DATE},
+        },
+    ),
+    (
+        "rollups window",
+        "rollups",
+        {"user_id": _SAMPLE_ID, "kind": "day", "period": {"$gte": "2000-01-01"}},
+    ),
+    ("telegram session", "Telegram", {"telegram_id": 0}),
+]
+
+
+async def ensure_indexes(database: AsyncIOMotorDatabase) -> dict[str, list[str]]:
+    """Drop superseded indexes and create every index missing from the manifest."""
+    for collection, names in OBSOLETE_INDEXES.items():
+        existing = await database[collection].index_information()
+        for name in names:
+            if name in existing:
+                await database[collection].drop_index(name)
+    created = {}
+    for collection, models in INDEXES.items():
+        created[collection] = await database[collection].create_indexes(models)
+    return created
+
+
+def _plan_stages(plan: dict) -> list[str]:
+    """Flatten the stage names of a (possibly nested) query plan."""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+async def find_collection_scans(database: AsyncIOMotorDatabase) -> list[str]:
+    """Explain every hot query and return the ones planned as a COLLSCAN."""
+    offenders = []
+    for description, collection, query in HOT_QUERIES:
+        explanation = await database[collection].find(query).explain()
+        winning_plan = explanation["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            offenders.append(f"{description}: {collection} {query}")
+    return offenders
+
+
+async def _main(check: bool) -> int:
+    # Imported here so the manifest can be read without a configured client
+    from api.utils import db  # pylint: disable=import-outside-toplevel
+
+    database = db.get_database()
+    try:
+        for collection, names in (await ensure_indexes(database)).items():
+            print(f"{collection}: {', '.join(names)}")
+        if not check:
+            return 0
+        offenders = await find_collection_scans(database)
+        for offender in offenders:
+            print(f"COLLSCAN {offender}", file=sys.stderr)
+        return 1 if offenders else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the MongoDB index manifest")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="fail if any hot router query is planned as a collection scan",
+    )
+    sys.exit(asyncio.run(_main(parser.parse_args().check)))
@@ -0,0 +1,152 @@
+"""
+Cached user profiles.
+
+A profile is the small part of a user that the expense routes validate
+against on every request: the username, categories, currencies and the
+currency of each account. Profiles are cached per process for a short TTL.
+Every route that changes one of those fields drops the entry and bumps the
+shared ``profiles`` revocation counter, so other workers empty their caches
+within USER_PROFILE_POLL_SECONDS (see api.utils.auth.RevocationWatch), and
+callers can force a refresh when cached data fails a validation.
+
+Category names are keys of the user's ``categories`` map and are written with
+dotted update paths, so they are stored escaped (see escape_category).
+"""
+
+import re
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from api.utils.auth import RevocationWatch, publish_revocation
+from api.utils.cache import TTLCache
+from api.utils.db import accounts_collection, users_collection
+from config import (
+    USER_PROFILE_CACHE_MAXSIZE,
+    USER_PROFILE_CACHE_TTL_SECONDS,
+    USER_PROFILE_POLL_SECONDS,
+)
+
+PROFILE_PROJECTION = {"username": 1, "categories": 1, "currencies": 1}
+# Projections for routes that read a single part of the user document
+USERNAME_PROJECTION = {"username": 1}
+CATEGORIES_PROJECTION = {"categories": 1}
+CURRENCIES_PROJECTION = {"currencies": 1}
+# Everything a user may see about themselves
+PUBLIC_USER_PROJECTION = {"password": 0}
+
+_CATEGORY_ESCAPES = {"%": "%25", ".": "%2E", "$": "%24"}
+_CATEGORY_UNESCAPES = {escaped: char for char, escaped in _CATEGORY_ESCAPES.items()}
+# str.translate table of _CATEGORY_ESCAPES, keyed by code point
+_CATEGORY_TABLE = {ord(char): escaped for char, escaped in _CATEGORY_ESCAPES.items()}
+# An empty name cannot be a field name; "%" never appears unescaped otherwise
+_EMPTY_CATEGORY = "%"
+
+profile_cache = TTLCache(
+    maxsize=USER_PROFILE_CACHE_MAXSIZE, ttl=USER_PROFILE_CACHE_TTL_SECONDS
+)
+# Document of the revocations collection counting profile changes
+PROFILES_REVOCATION_ID = "profiles"
+profile_watch = RevocationWatch(
+    USER_PROFILE_POLL_SECONDS, PROFILES_REVOCATION_ID, profile_cache
+)
+
+
+async def get_user_profile(user_id: str, refresh: bool = False) -> dict:
+    """
+    Return the cached profile of a user, loading it on a miss.
+
+    Args:
+        user_id (str): ID of the user.
+        refresh (bool): Skip the cache and reload the profile.
+
+    Returns:
+        dict: username, categories, currencies and accounts ({name: currency}).
+    """
+    await profile_watch.sync()
+    profile = None if refresh else profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    user = await users_collection.find_one(
+        {"_id": ObjectId(user_id)}, PROFILE_PROJECTION
+    )
+    if not user:
+        profile_cache.pop(user_id)
+        raise HTTPException(status_code=404, detail="User not found")
+    accounts = await accounts_collection.find(
+        {"user_id": user_id}, {"name": 1, "currency": 1}
+    ).to_list(None)
+    profile = {
+        "username": user.get("username"),
+        "categories": decode_categories(user.get("categories", {})),
+        "currencies": user.get("currencies", []),
+        "accounts": {account["name"]: account["currency"] for account in accounts},
+    }
+    profile_cache.set(user_id, profile)
+    return profile
+
+
+async def load_username(user_id: str) -> str:
+    """
+    Return a user's username, from the cached profile if there is one.
+
+    Unlike get_user_profile, a miss reads only the username and caches nothing,
+    for pages that show no other part of the profile.
+    """
+    await profile_watch.sync()
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return profile["username"]
+    user = await find_user(user_id, USERNAME_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user["username"]
+
+
+async def find_user(user_id: str, projection: dict) -> Optional[dict]:
+    """
+    Read only the given fields of a user document.
+
+    Args:
+        user_id (str): ID of the user.
+        projection (dict): Fields to read, e.g. CATEGORIES_PROJECTION.
+
+    Returns:
+        Optional[dict]: The projected user document, or None if not found.
+    """
+    return await users_collection.find_one({"_id": ObjectId(user_id)}, projection)
+
+
+async def invalidate_user_profile(user_id: str):
+    """Drop a user's cached profile after it has been changed, on every worker."""
+    profile_cache.pop(user_id)
+    await publish_revocation(PROFILES_REVOCATION_ID)
+
+
+def escape_category(name: str) -> str:
+    """
+    Encode a category name as a field name of the categories map.
+
+    "%", "." and "$" are percent-encoded, so a name can never add a level to
+    a dotted path or start an operator, and the empty name gets a key of its own.
+    """
+    return name.translate(_CATEGORY_TABLE) or _EMPTY_CATEGORY
+
+
+def unescape_category(key: str) -> str:
+    """Decode a field name of the categories map back into a category name."""
+    if key == _EMPTY_CATEGORY:
+        return ""
+    return re.sub("%(25|2E|24)", lambda m: _CATEGORY_UNESCAPES[m.group()], key)
+
+
+def category_path(name: str) -> str:
+    """Return the dotted update path of a category's entry."""
+    return f"categories.{escape_category(name)}"
+
+
+def decode_categories(categories: dict) -> dict:
+    """Return a stored categories map keyed by the plain category names."""
+    return {unescape_category(key): value for key, value in categories.items()}
@@ -0,0 +1,396 @@
+"""
+Precomputed daily and monthly spending rollups.
+
+The rollups collection holds one small document per user, period, category,
+account and account currency, with the total of the matching expenses in that
+account's currency and their count. Each expense counts towards a "day"
+rollup (period YYYY-MM-DD, in UTC) and a "month" rollup (period YYYY-MM), so a
+year of analytics reads a few hundred documents however many expenses a user
+has.
+
+Every expense write applies its change with $inc upserts in one bulk_write.
+Rollups can be recomputed from the expenses and checked against them with::
+
+    python -m api.utils.rollups           # backfill amounts, rebuild and verify
+    python -m api.utils.rollups --verify  # only compare rollups with expenses
+
+Analytics only read a user's rollups once ``rollups_ready`` is set on the user
+document. New users start with it; the rebuild sets it for everyone else.
+Writes that land while a user's rollups are being rebuilt can be lost, so run
+the rebuild while the API is quiet and check the result with ``--verify``.
+"""
+
+import argparse
+import asyncio
+import datetime
+import sys
+from typing import Any, Iterable, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from api.utils.db import rollups_collection, users_collection
+
+DAY = "day"
+MONTH = "month"
+
+# (kind, period, category, account_name, currency) -> (total, count)
+RollupKey = tuple[str, str, Optional[str], Optional[str], Optional[str]]
+Deltas = dict[RollupKey, tuple[float, int]]
+
+
+def _utc_day(date: datetime.datetime) -> str:
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc)
+    return date.strftime("%Y-%m-%d")
+
+
+def _add(deltas: Deltas, key: RollupKey, total: float, count: int) -> None:
+    previous_total, previous_count = deltas.get(key, (0.0, 0))
+    deltas[key] = (previous_total + total, previous_count + count)
+
+
+def expense_deltas(
+    expenses: Iterable[dict], account_currencies: dict[str, str], sign: int = 1
+) -> Deltas:
+    """
+    Compute how a set of expenses changes their day and month rollups.
+
+    Args:
+        expenses (Iterable[dict]): Expense documents.
+        account_currencies (dict[str, str]): Currency of each account by name.
+        sign (int): 1 when the expenses are added, -1 when they are removed.
+
+    Returns:
+        Deltas: The change of each rollup the expenses count towards.
+    """
+    deltas: Deltas = {}
+    for expense in expenses:
+        amount = expense.get("amount_in_account_currency")
+        if amount is None:
+            amount = expense["amount"]
+        day = _utc_day(expense["date"])
+        account_name = expense["account_name"]
+        currency = account_currencies.get(account_name)
+        for kind, period in ((DAY, day), (MONTH, day[:7])):
+            key = (kind, period, expense["category"], account_name, currency)
+            _add(deltas, key, sign * float(amount), sign)
+    return deltas
+
+
+def _rollup_filter(user_id: str, key: RollupKey) -> dict:
+    kind, period, category, account_name, currency = key
+    return {
+        "user_id": user_id,
+        "kind": kind,
+        "period": period,
+        "category": category,
+        "account_name": account_name,
+        "currency": currency,
+    }
+
+
+async def apply_deltas(
+    user_id: str,
+    deltas: Deltas,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> None:
+    """Apply rollup changes with one upserting $inc per rollup."""
+    if not deltas:
+        return
+    await rollups_collection.bulk_write(
+        [
+            UpdateOne(
+                _rollup_filter(user_id, key),
+                {"$inc": {"total": total, "count": count}},
+                upsert=True,
+            )
+            for key, (total, count) in deltas.items()
+        ],
+        ordered=False,
+        session=session,
+    )
+
+
+async def update_rollups(
+    user_id: str,
+    expenses: Iterable[dict],
+    account_currencies: dict[str, str],
+    sign: int = 1,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> None:
+    """
+    Count expenses into (or, with sign=-1, out of) a user's rollups.
+
+    Args:
+        user_id (str): Owner of the expenses.
+        expenses (Iterable[dict]): Expense documents.
+        account_currencies (dict[str, str]): Currency of each account by name.
+        sign (int): 1 when the expenses are added, -1 when they are removed.
+        session: Optional session of the surrounding transaction.
+    """
+    await apply_deltas(
+        user_id, expense_deltas(expenses, account_currencies, sign), session
+    )
+
+
+async def move_rollups(
+    user_id: str, before: dict, after: dict, account_currencies: dict[str, str]
+) -> None:
+    """Move an updated expense from its old rollups to its new ones."""
+    deltas = expense_deltas([before], account_currencies, sign=-1)
+    for key, (total, count) in expense_deltas([after], account_currencies).items():
+        _add(deltas, key, total, count)
+    await apply_deltas(user_id, deltas)
+
+
+async def rename_category_rollups(user_id: str, old_name: str, new_name: str) -> None:
+    """Move a category's rollups to a new name, adding to any already there."""
+    deltas: Deltas = {}
+    async for rollup in rollups_collection.find(
+        {"user_id": user_id, "category": old_name}
+    ):
+        key = (
+            rollup["kind"],
+            rollup["period"],
+            new_name,
+            rollup["account_name"],
+            rollup["currency"],
+        )
+        _add(deltas, key, rollup["total"], rollup["count"])
+    await apply_deltas(user_id, deltas)
+    await rollups_collection.delete_many({"user_id": user_id, "category": old_name})
+
+
+async def delete_rollups(
+    user_id: str, session: Optional[AsyncIOMotorClientSession] = None
+) -> None:
+    """Remove every rollup of a user, e.g. after all their expenses are deleted."""
+    await rollups_collection.delete_many({"user_id": user_id}, session=session)
+
+
+async def rollups_ready(user_id: str) -> bool:
+    """Whether a user's rollups cover all of their expenses."""
+    if not ObjectId.is_valid(user_id):
+        return False
+    user = await users_collection.find_one(
+        {"_id": ObjectId(user_id)}, {"rollups_ready": 1}
+    )
+    return bool(user and user.get("rollups_ready"))
+
+
+def _period_range(start: str, end: Optional[str]) -> dict:
+    return {"$gte": start} if end is None else {"$gte": start, "$lt": end}
+
+
+def _month_start(day: datetime.date, months_ahead: int = 0) -> datetime.date:
+    month = day.month - 1 + months_ahead
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def rollup_match(
+    user_id: str,
+    first_day: datetime.date,
+    months: bool,
+    end_day: Optional[datetime.date] = None,
+) -> dict:
+    """
+    Filter the rollups of a user that cover a window of days.
+
+    Args:
+        user_id (str): Owner of the rollups.
+        first_day (date): First day of the window.
+        months (bool): Read whole months from month rollups and only the
+            partial months at either end from day rollups.
+        end_day (Optional[date]): Day after the window; open-ended if None.
+    """
+    match: dict[str, Any] = {"user_id": user_id, "count": {"$gt": 0}}
+    if not months:
+        end = None if end_day is None else end_day.isoformat()
+        return match | {
+            "kind": DAY,
+            "period": _period_range(first_day.isoformat(), end),
+        }
+
+    first_month = first_day if first_day.day == 1 else _month_start(first_day, 1)
+    end_month = None if end_day is None else _month_start(end_day)
+    parts = []
+    if first_day < first_month:
+        head_end = first_month if end_day is None else min(first_month, end_day)
+        parts.append(
+            {
+                "kind": DAY,
+                "period": _period_range(first_day.isoformat(), head_end.isoformat()),
+            }
+        )
+    if end_month is None or first_month < end_month:
+        end = None if end_month is None else end_month.isoformat()[:7]
+        parts.append(
+            {
+                "kind": MONTH,
+                "period": _period_range(first_month.isoformat()[:7], end),
+            }
+        )
+    if (
+        end_day is not None
+        and end_month is not None
+        and first_month <= end_month < end_day
+    ):
+        parts.append(
+            {
+                "kind": DAY,
+                "period": _period_range(end_month.isoformat(), end_day.isoformat()),
+            }
+        )
+    return match | (parts[0] if len(parts) == 1 else {"$or": parts})
+
+
+async def compute_rollups(database: AsyncIOMotorDatabase, user_id: str) -> Deltas:
+    """
+    Recompute a user's rollups from their expenses.
+
+    Expenses of accounts that no longer exist are totalled in their own
+    currency.
+    """
+    accounts = {
+        account["name"]: account["currency"]
+        async for account in database["accounts"].find(
+            {"user_id": user_id}, {"name": 1, "currency": 1}
+        )
+    }
+    groups = database["expenses"].aggregate(
+        [
+            {"$match": {"user_id": user_id}},
+            {
+                "$group": {
+                    "_id": {
+                        "day": {
+                            "$dateToString": {"format": "%Y-%m-%d", "date": "$date"}
+                        },
+                        "category": "$category",
+                        "account_name": "$account_name",
+                        "currency": "$currency",
+                    },
+                    "total": {
+                        "$sum": {"$ifNull": ["$amount_in_account_currency", "$amount"]}
+                    },
+                    "amount": {"$sum": "$amount"},
+                    "count": {"$sum": 1},
+                }
+            },
+        ]
+    )
+    deltas: Deltas = {}
+    async for group in groups:
+        key = group["_id"]
+        if key["account_name"] in accounts:
+            currency, total = accounts[key["account_name"]], group["total"]
+        else:
+            currency, total = key["currency"], group["amount"]
+        for kind, period in ((DAY, key["day"]), (MONTH, key["day"][:7])):
+            _add(
+                deltas,
+                (kind, period, key["category"], key["account_name"], currency),
+                total,
+                group["count"],
+            )
+    return deltas
+
+
+async def stored_rollups(database: AsyncIOMotorDatabase, user_id: str) -> Deltas:
+    """Read a user's non-empty rollups in the shape of compute_rollups."""
+    deltas: Deltas = {}
+    async for rollup in database["rollups"].find(
+        {"user_id": user_id, "count": {"$ne": 0}}
+    ):
+        key = (
+            rollup["kind"],
+            rollup["period"],
+            rollup["category"],
+            rollup["account_name"],
+            rollup["currency"],
+        )
+        deltas[key] = (rollup["total"], rollup["count"])
+    return deltas
+
+
+def rollups_match(expected: Deltas, actual: Deltas, tolerance: float = 1e-6) -> bool:
+    """Compare two sets of rollups, allowing for floating-point drift in totals."""
+    if expected.keys() != actual.keys():
+        return False
+    for key, (total, count) in expected.items():
+        actual_total, actual_count = actual[key]
+        if count != actual_count:
+            return False
+        if abs(total - actual_total) > tolerance * max(1.0, abs(total)):
+            return False
+    return True
+
+
+async def rebuild_user_rollups(database: AsyncIOMotorDatabase, user_id: str) -> int:
+    """
+    Replace a user's rollups with ones recomputed from their expenses.
+
+    Returns:
+        int: Number of rollup documents written.
+    """
+    users = database["users"]
+    rollups = database["rollups"]
+    # Analytics read the expenses directly while the rollups are replaced
+    await users.update_one(
+        {"_id": ObjectId(user_id)}, {"$set": {"rollups_ready": False}}
+    )
+    deltas = await compute_rollups(database, user_id)
+    await rollups.delete_many({"user_id": user_id})
+    if deltas:
+        await rollups.insert_many(
+            [
+                _rollup_filter(user_id, key) | {"total": total, "count": count}
+                for key, (total, count) in deltas.items()
+            ]
+        )
+    await users.update_one(
+        {"_id": ObjectId(user_id)}, {"$set": {"rollups_ready": True}}
+    )
+    return len(deltas)
+
+
+async def _main(verify_only: bool) -> int:
+    # Imported here so the module can be imported without a configured client
+    from api.utils import db  # pylint: disable=import-outside-toplevel
+    from api.utils.backfill import (  # pylint: disable=import-outside-toplevel
+        backfill_account_amounts,
+    )
+
+    database = db.get_database()
+    try:
+        user_ids = [str(user["_id"]) async for user in database["users"].find({}, {})]
+        if not verify_only:
+            await backfill_account_amounts(database)
+            written = 0
+            for user_id in user_ids:
+                written += await rebuild_user_rollups(database, user_id)
+            print(f"rebuilt {written} rollups for {len(user_ids)} users")
+
+        mismatched = 0
+        for user_id in user_ids:
+            expected = await compute_rollups(database, user_id)
+            if not rollups_match(expected, await stored_rollups(database, user_id)):
+                mismatched += 1
+                print(f"MISMATCH {user_id}", file=sys.stderr)
+        return 1 if mismatched else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild and verify the spending rollups"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="only compare the rollups with the expenses, without rebuilding",
+    )
+    sys.exit(asyncio.run(_main(parser.parse_args().verify)))
@@ -0,0 +1,27 @@
+"""
+Per-user data versions.
+
+Every write to a user's expenses increments ``data_version`` on the user
+document. Caches of data derived from expenses (rendered charts, summaries)
+include the version in their keys, so a write invalidates them on every
+worker without any cross-process messaging.
+"""
+
+from bson import ObjectId
+
+from api.utils.db import users_collection
+
+
+async def get_data_version(user_id: str) -> int:
+    """Return the current expense data version of a user."""
+    user = await users_collection.find_one(
+        {"_id": ObjectId(user_id)}, {"data_version": 1}
+    )
+    return user.get("data_version", 0) if user else 0
+
+
+async def bump_data_version(user_id: str):
+    """Mark every cached view of a user's expenses as stale."""
+    await users_collection.update_one(
+        {"_id": ObjectId(user_id)}, {"$inc": {"data_version": 1}}
+    )
@@ -9,10 +9,57 @@ from dotenv import load_dotenv
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI", None)
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "mmdb")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000")
+)
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+# Comma separated list, e.g. "zstd,snappy,zlib"
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+# Multi-document transactions need a replica set or sharded cluster
+MONGO_USE_TRANSACTIONS = os.getenv("MONGO_USE_TRANSACTIONS", "false").lower() == "true"
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
 DISCORD_CLIENT_ID = os.getenv("DISCORD_CLIENT_ID")
 
 TOKEN_SECRET_KEY = os.getenv("TOKEN_SECRET_KEY")
 TOKEN_ALGORITHM = os.getenv("TOKEN_ALGORITHM")
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "60"))
+# How often each worker checks for tokens revoked on another worker
+TOKEN_REVOCATION_POLL_SECONDS = float(os.getenv("TOKEN_REVOCATION_POLL_SECONDS", "1"))
+USER_PROFILE_CACHE_MAXSIZE = int(os.getenv("USER_PROFILE_CACHE_MAXSIZE", "10000"))
+USER_PROFILE_CACHE_TTL_SECONDS = float(
+    os.getenv("USER_PROFILE_CACHE_TTL_SECONDS", "30")
+)
+# How often each worker checks for profiles changed on another worker
+USER_PROFILE_POLL_SECONDS = float(os.getenv("USER_PROFILE_POLL_SECONDS", "1"))
+
+BULK_EXPENSES_MAX_ITEMS = int(os.getenv("BULK_EXPENSES_MAX_ITEMS", "5000"))
+CSV_IMPORT_CHUNK_ROWS = int(os.getenv("CSV_IMPORT_CHUNK_ROWS", "5000"))
+IMPORT_JOB_LEASE_SECONDS = float(os.getenv("IMPORT_JOB_LEASE_SECONDS", "120"))
+CURRENCY_BATCH_MAX_ITEMS = int(os.getenv("CURRENCY_BATCH_MAX_ITEMS", "10000"))
+# Where the per-day exchange rate table is cached. It must be private to the
+# app's user; defaults to a money-manager dir under the user's cache dir
+RATE_TABLE_DIR = os.getenv("RATE_TABLE_DIR") or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "money-manager",
+)
+
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2"))
+CHART_RENDER_MAX_PENDING = int(os.getenv("CHART_RENDER_MAX_PENDING", "16"))
+CHART_RENDER_TIMEOUT_SECONDS = float(os.getenv("CHART_RENDER_TIMEOUT_SECONDS", "10"))
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Chart.js for the chart pages, e.g. a copy under /static/js, and the
+# Subresource Integrity hash ("sha384-...") the browser checks it against
+CHART_JS_URL = os.getenv(
+    "CHART_JS_URL", "https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js"
+)
+CHART_JS_INTEGRITY = os.getenv("CHART_JS_INTEGRITY")
+BUDGET_CACHE_MAXSIZE = int(os.getenv("BUDGET_CACHE_MAXSIZE", "10000"))
+BUDGET_CACHE_TTL_SECONDS = float(os.getenv("BUDGET_CACHE_TTL_SECONDS", "300"))
 
 API_BIND_HOST = os.getenv("API_BIND_HOST", "0.0.0.0")
 API_BIND_PORT = int(os.getenv("API_BIND_PORT", "9999"))
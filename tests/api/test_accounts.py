@@ -129,6 +129,39 @@ class TestAccountUpdate:
         assert response.status_code == 200
         assert "Account updated successfully" in response.json()["message"]
 
+    async def test_currency_locked_by_expenses(self, async_client_auth: AsyncClient):
+        create_response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Locked 3f9", "balance": 100.0, "currency": "USD"},
+        )
+        account_id = create_response.json()["account_id"]
+        response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 10.0,
+                "currency": "USD",
+                "category": "Food",
+                "account_name": "Locked 3f9",
+            },
+        )
+        assert response.status_code == 200, response.json()
+
+        response = await async_client_auth.put(
+            f"/accounts/{account_id}",
+            json={"balance": 90.0, "currency": "EUR", "name": "Locked 3f9"},
+        )
+        assert response.status_code == 409
+        assert (
+            response.json()["detail"]
+            == "Cannot change the currency of an account with expenses"
+        )
+
+        response = await async_client_auth.put(
+            f"/accounts/{account_id}",
+            json={"balance": 90.0, "currency": "usd", "name": "Locked 3f9"},
+        )
+        assert response.status_code == 200, response.json()
+
     async def test_update_nonexistent_account(self, async_client_auth: AsyncClient):
         """
         Test updating a non-existent account.
@@ -1,9 +1,16 @@
+import asyncio
+import time
 from datetime import datetime, timedelta
 
 import pytest
+from fastapi import HTTPException
 from httpx import AsyncClient
 
 from api.app import app
+from api.routers.analytics import CATEGORY_KEY, DAY_KEY, aggregate_expenses
+from api.utils.cache import ByteLRUCache
+from api.utils.charts import ChartRenderer, render_bar_chart, render_pie_chart
+from api.utils.db import expenses_collection
 
 
 @pytest.mark.anyio
@@ -144,3 +151,232 @@ class TestAnalyticsEdgeCases:
         )
         assert response.status_code == 404, response.json()
         assert response.json()["detail"] == "No expenses found for the specified period"
+
+
+@pytest.mark.anyio
+class TestServerSideAggregation:
+    async def test_totals_past_thousand_documents(self):
+        user_id = "aggregation-test-user"
+        now = datetime.now()
+        await expenses_collection.insert_many(
+            [
+                {
+                    "user_id": user_id,
+                    "amount": 1.0,
+                    "category": "Food" if i % 2 else "Transport",
+                    "date": now - timedelta(days=i % 3),
+                }
+                for i in range(1500)
+            ]
+        )
+        try:
+            days, daily_totals = await aggregate_expenses(user_id, 7, DAY_KEY)
+            assert len(days) == 3
+            assert sum(daily_totals) == 1500
+
+            categories, category_totals = await aggregate_expenses(
+                user_id, 7, CATEGORY_KEY
+            )
+            assert categories == ["Food", "Transport"]
+            assert category_totals == [750, 750]
+        finally:
+            await expenses_collection.delete_many({"user_id": user_id})
+
+
+class TestChartRendering:
+    def test_bar_chart_png(self):
+        png = render_bar_chart(["2024-11-01", "2024-11-02"], [10.0, 20.0], 7)
+        assert png.startswith(b"\x89PNG")
+
+    def test_pie_chart_png(self):
+        png = render_pie_chart(["Food", "Transport"], [10.0, 20.0], 7)
+        assert png.startswith(b"\x89PNG")
+
+
+@pytest.mark.anyio
+async def test_chart_renderer_backpressure():
+    busy_renderer = ChartRenderer(workers=1, max_pending=0, timeout=1)
+    with pytest.raises(HTTPException) as exc_info:
+        await busy_renderer.render(render_bar_chart, ["2024-11-01"], [1.0], 1)
+    assert exc_info.value.status_code == 503
+    assert busy_renderer.stats()["pending"] == 0
+
+
+@pytest.mark.anyio
+async def test_chart_renderer_counts_timed_out_renders():
+    slow_renderer = ChartRenderer(workers=1, max_pending=1, timeout=0.01)
+    try:
+        with pytest.raises(HTTPException) as exc_info:
+            await slow_renderer.render(time.sleep, 1)
+        assert exc_info.value.status_code == 504
+        # The worker is still busy, so there is no room for another render
+        assert slow_renderer.stats()["pending"] == 1
+        with pytest.raises(HTTPException) as exc_info:
+            await slow_renderer.render(time.sleep, 0)
+        assert exc_info.value.status_code == 503
+
+        for _ in range(200):
+            if slow_renderer.stats()["pending"] == 0:
+                break
+            await asyncio.sleep(0.05)
+        assert slow_renderer.stats()["pending"] == 0
+    finally:
+        slow_renderer.shutdown()
+
+
+@pytest.mark.anyio
+class TestChartCache:
+    async def test_if_none_match_returns_304(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/expense/bar", params={"x_days": 7}
+        )
+        assert response.status_code == 200, response.json()
+        etag = response.headers["ETag"]
+
+        response = await async_client_auth.get(
+            "/analytics/expense/bar",
+            params={"x_days": 7},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+    async def test_expense_write_changes_etag(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/expense/pie", params={"x_days": 7}
+        )
+        assert response.status_code == 200, response.json()
+        etag = response.headers["ETag"]
+
+        response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 5.0,
+                "currency": "USD",
+                "category": "Food",
+                "account_name": "Checking",
+            },
+        )
+        assert response.status_code == 200, response.json()
+
+        response = await async_client_auth.get(
+            "/analytics/expense/pie",
+            params={"x_days": 7},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_byte_lru_eviction(self):
+        cache = ByteLRUCache(max_bytes=10)
+        cache.set("a", b"12345")
+        cache.set("b", b"12345")
+        assert cache.get("a") == b"12345"
+        cache.set("c", b"123")
+        assert cache.get("b") is None
+        assert cache.size == 8
+        cache.set("huge", b"x" * 11)
+        assert cache.get("huge") is None
+
+
+@pytest.mark.anyio
+class TestExpenseSeries:
+    @pytest.mark.parametrize(
+        "group_by", ["day", "week", "month", "category", "account"]
+    )
+    async def test_groupings(self, async_client_auth: AsyncClient, group_by: str):
+        response = await async_client_auth.get(
+            f"/analytics/series/{group_by}", params={"x_days": 7}
+        )
+        assert response.status_code == 200, response.json()
+        series = response.json()
+        assert series["group_by"] == group_by
+        assert len(series["labels"]) == len(series["totals"]) > 0
+
+    async def test_category_totals(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/series/category", params={"x_days": 7}
+        )
+        assert response.status_code == 200, response.json()
+        totals = dict(zip(response.json()["labels"], response.json()["totals"]))
+        assert totals["Transport"] == 50.0
+        assert totals["Utilities"] == 200.0
+
+    async def test_currency_normalisation(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/series/account", params={"x_days": 7, "currency": "usd"}
+        )
+        assert response.status_code == 200, response.json()
+        assert response.json()["currency"] == "USD"
+        assert response.json()["labels"] == ["Checking"]
+
+    async def test_not_modified(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/series/day", params={"x_days": 7}
+        )
+        assert response.status_code == 200, response.json()
+        response = await async_client_auth.get(
+            "/analytics/series/day",
+            params={"x_days": 7},
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert response.status_code == 304
+
+    async def test_invalid_grouping(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/series/year", params={"x_days": 7}
+        )
+        assert response.status_code == 422
+
+    async def test_no_expenses(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/series/day", params={"x_days": 0}
+        )
+        assert response.status_code == 404, response.json()
+        assert response.json()["detail"] == "No expenses found for the specified period"
+
+
+@pytest.mark.anyio
+class TestBudget:
+    async def test_budget_vs_actual(self, async_client_auth: AsyncClient):
+        expense = {
+            "amount": 40.0,
+            "currency": "USD",
+            "category": "Food",
+            "account_name": "Checking",
+            "date": "2023-05-10T12:00:00",
+        }
+        response = await async_client_auth.post("/expenses/", json=expense)
+        assert response.status_code == 200, response.json()
+
+        response = await async_client_auth.get(
+            "/analytics/budget", params={"month": "2023-05"}
+        )
+        assert response.status_code == 200, response.json()
+        lines = {line["category"]: line for line in response.json()["categories"]}
+        assert lines["Food"] == {
+            "category": "Food",
+            "budget": 500.0,
+            "spent": 40.0,
+            "remaining": 460.0,
+            "percent": 8.0,
+        }
+        assert lines["Transport"]["spent"] == 0.0
+
+        # An expense write invalidates the cached spending
+        response = await async_client_auth.post(
+            "/expenses/", json=expense | {"amount": 10.0}
+        )
+        assert response.status_code == 200, response.json()
+        response = await async_client_auth.get(
+            "/analytics/budget", params={"month": "2023-05"}
+        )
+        lines = {line["category"]: line for line in response.json()["categories"]}
+        assert lines["Food"]["spent"] == 50.0
+
+    async def test_invalid_month(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/analytics/budget", params={"month": "2023-13"}
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid month. Expected YYYY-MM"
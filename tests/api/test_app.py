@@ -1,7 +1,12 @@
+from unittest.mock import patch
+
 import pytest
+from fastapi import Request
 from httpx import AsyncClient
 
-from api.app import app
+from api.app import app, templates
+from api.routers import accounts, analytics, expenses, users
+from api.utils import db
 
 
 @pytest.mark.anyio
@@ -11,6 +16,14 @@ class TestRoutes:
         assert response.status_code == 302
         assert response.headers["location"] == "/login"
 
+    async def test_metrics(self, async_client: AsyncClient):
+        response = await async_client.get("/metrics")
+        assert response.status_code == 200
+        body = response.json()
+        assert body["chart_renderer"]["pending"] == 0
+        assert set(body["chart_cache"]) == {"entries", "bytes", "hits", "misses"}
+        assert set(body["token_cache"]) == {"entries", "hits", "misses"}
+
     async def test_signup_page(self, async_client: AsyncClient):
         response = await async_client.get("/signup")
         assert response.status_code == 200
@@ -77,3 +90,38 @@ class TestProtectedRoutes:
             "/piechart", cookies={"access_token": "invalidtoken"}
         )
         assert response.status_code == 302
+
+
+@pytest.mark.parametrize("page", ["barchart.html", "piechart.html"])
+def test_chart_pages_pin_chart_js(page: str):
+    chart_js = {"src": "/static/js/chart.umd.min.js", "integrity": "sha384-abc"}
+    with patch.dict(templates.env.globals, {"chart_js": chart_js}):
+        html = templates.get_template(page).render(
+            request=Request(
+                {
+                    "type": "http",
+                    "app": app,
+                    "router": app.router,
+                    "scheme": "http",
+                    "server": ("test", 80),
+                    "path": "/",
+                    "headers": [],
+                }
+            ),
+            username="testuser",
+        )
+    assert (
+        '<script src="/static/js/chart.umd.min.js" integrity="sha384-abc" '
+        'crossorigin="anonymous"' in html
+    )
+
+
+def test_routers_share_one_client():
+    client = db.connect()
+    for collection in (
+        users.tokens_collection,
+        accounts.accounts_collection,
+        expenses.expenses_collection,
+        analytics.expenses_collection,
+    ):
+        assert collection.database.client is client
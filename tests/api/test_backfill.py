@@ -0,0 +1,48 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+from httpx import AsyncClient
+
+from api.utils import db
+from api.utils.backfill import MIGRATION_ID, backfill_account_amounts
+from api.utils.currency import rate_service
+
+
+@pytest.mark.anyio
+class TestBackfillAccountAmounts:
+    async def test_backfills_and_checkpoints(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 10.0,
+                "currency": "EUR",
+                "category": "Food",
+                "account_name": "Checking",
+                "date": "2016-03-01T00:00:00",
+            },
+        )
+        assert response.status_code == 200, response.json()
+        expense_id = ObjectId(response.json()["expense"]["_id"])
+
+        database = db.get_database()
+        # Make it look like an expense written before the amounts were stored
+        await database.expenses.update_one(
+            {"_id": expense_id},
+            {"$unset": {"amount_in_account_currency": "", "exchange_rate": ""}},
+        )
+
+        report = await backfill_account_amounts(database, batch_size=2, restart=True)
+        assert report["updated"] >= 1
+
+        expense = await database.expenses.find_one({"_id": expense_id})
+        rate = rate_service.rate("EUR", "USD", datetime.date(2016, 3, 1))
+        assert expense["exchange_rate"] == pytest.approx(rate)
+        assert expense["amount_in_account_currency"] == pytest.approx(10.0 * rate)
+
+        state = await database.migrations.find_one({"_id": MIGRATION_ID})
+        assert state["last_id"] >= expense_id
+
+        # Resuming finds nothing left to do
+        report = await backfill_account_amounts(database)
+        assert report["updated"] == 0
@@ -1,3 +1,6 @@
+import asyncio
+import json
+
 import pytest
 from httpx import AsyncClient
 
@@ -220,3 +223,95 @@ class TestAdditionalCategoryCases:
         # Try fetching a non-existent category
         response = await async_client_auth.get("/categories/!(*@ (@!()))")
         assert response.status_code == 404, response.json()
+
+
+@pytest.mark.anyio
+class TestCategoryPaths:
+    @pytest.mark.parametrize("name", ["Bills.Home", "$pecial", "100%"])
+    async def test_reserved_characters(self, async_client_auth: AsyncClient, name):
+        response = await async_client_auth.post(
+            "/categories/", json={"name": name, "monthly_budget": 10.0}
+        )
+        assert response.status_code == 200, response.json()
+        response = await async_client_auth.put(
+            f"/categories/{name}", json={"monthly_budget": 20.0}
+        )
+        assert response.status_code == 200, response.json()
+
+        response = await async_client_auth.get("/categories/")
+        assert response.json()["categories"][name] == {"monthly_budget": 20.0}
+        response = await async_client_auth.get(f"/categories/{name}")
+        assert response.json()["category"] == {"monthly_budget": 20.0}
+
+        response = await async_client_auth.delete(f"/categories/{name}")
+        assert response.status_code == 200, response.json()
+        response = await async_client_auth.get(f"/categories/{name}")
+        assert response.status_code == 404
+
+    async def test_concurrent_creates_are_all_kept(
+        self, async_client_auth: AsyncClient
+    ):
+        names = [f"Concurrent {i}" for i in range(10)]
+        responses = await asyncio.gather(
+            *(
+                async_client_auth.post(
+                    "/categories/", json={"name": name, "monthly_budget": 1.0}
+                )
+                for name in names
+            )
+        )
+        assert all(response.status_code == 200 for response in responses)
+        categories = (await async_client_auth.get("/categories/")).json()["categories"]
+        assert set(names) <= set(categories)
+
+
+@pytest.mark.anyio
+class TestCategoryRename:
+    async def test_rename_cascades(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/categories/", json={"name": "Hobbies", "monthly_budget": 80.0}
+        )
+        assert response.status_code == 200, response.json()
+        response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 5.0,
+                "currency": "USD",
+                "category": "Hobbies",
+                "account_name": "Checking",
+            },
+        )
+        assert response.status_code == 200, response.json()
+        expense_id = response.json()["expense"]["_id"]
+
+        response = await async_client_auth.patch(
+            "/categories/Hobbies/rename", json={"new_name": "Leisure"}
+        )
+        assert response.status_code == 200, response.text
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert events[-1] == {"status": "completed", "renamed": 1, "total": 1}
+
+        categories = (await async_client_auth.get("/categories/")).json()["categories"]
+        assert categories["Leisure"] == {"monthly_budget": 80.0}
+        assert "Hobbies" not in categories
+        expense = (await async_client_auth.get(f"/expenses/{expense_id}")).json()
+        assert expense["category"] == "Leisure"
+
+        series = await async_client_auth.get(
+            "/analytics/series/category", params={"x_days": 1}
+        )
+        assert "Hobbies" not in series.json()["labels"]
+        assert "Leisure" in series.json()["labels"]
+
+    async def test_rename_conflicts(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.patch(
+            "/categories/Missing/rename", json={"new_name": "Other"}
+        )
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Category not found"
+
+        response = await async_client_auth.patch(
+            "/categories/Food/rename", json={"new_name": "Transport"}
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Category already exists"
@@ -0,0 +1,79 @@
+import pytest
+from fastapi import HTTPException, Request
+from httpx import AsyncClient
+
+from api.utils.auth import evict_token, publish_revocation, token_cache
+from api.utils.context import RequestContext, resolve_context
+from api.utils.profiles import (
+    PROFILES_REVOCATION_ID,
+    invalidate_user_profile,
+    profile_cache,
+    profile_watch,
+)
+
+USER_ID = "0123456789abcdef01234567"
+
+
+def make_request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+
+@pytest.mark.anyio
+class TestRequestContext:
+    async def test_memoised_per_request(self):
+        token_cache.set("context-token", (USER_ID, "token-id"))
+        profile_cache.set(USER_ID, {"username": "cached", "categories": {}})
+        try:
+            request = make_request()
+            context = await resolve_context(request, "context-token")
+            assert context.user_id == USER_ID
+            assert await resolve_context(request, "context-token") is context
+
+            assert await context.username() == "cached"
+            # Later reads in the same request reuse the loaded profile
+            profile_cache.set(USER_ID, {"username": "changed"})
+            assert await context.username() == "cached"
+
+            # A new request loads the profile again
+            other = await resolve_context(make_request(), "context-token")
+            assert other is not context
+            assert await other.username() == "changed"
+        finally:
+            evict_token("context-token")
+            await invalidate_user_profile(USER_ID)
+
+    async def test_profile_changed_elsewhere(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get("/users/")
+        user_id = response.json()["_id"]
+        profile_cache.set(user_id, {"username": "stale"})
+        # Another worker changed the profile; this one only sees the counter
+        await publish_revocation(PROFILES_REVOCATION_ID)
+        profile_watch.expire()
+        token = async_client_auth.headers["token"]
+        response = await async_client_auth.get(
+            "/landing", cookies={"access_token": token}
+        )
+        assert "stale" not in response.text
+        assert "testuser" in response.text
+
+    async def test_username_without_profile(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get("/users/")
+        user_id = response.json()["_id"]
+        await invalidate_user_profile(user_id)
+        context = RequestContext(user_id, async_client_auth.headers["token"])
+        assert await context.username() == "testuser"
+        # Only the username was read; the profile is still loaded on demand
+        assert profile_cache.get(user_id) is None
+
+    async def test_missing_token(self):
+        with pytest.raises(HTTPException) as error:
+            await resolve_context(make_request(), None)
+        assert error.value.status_code == 401
+
+    async def test_landing_page(self, async_client_auth: AsyncClient):
+        token = async_client_auth.headers["token"]
+        response = await async_client_auth.get(
+            "/landing", cookies={"access_token": token}
+        )
+        assert response.status_code == 200
+        assert "testuser" in response.text
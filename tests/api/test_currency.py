@@ -0,0 +1,105 @@
+import datetime
+import math
+
+import numpy as np
+import pytest
+from currency_converter import CurrencyConverter  # type: ignore
+from httpx import AsyncClient
+
+from api.routers.expenses import convert_currency
+from api.utils.currency import RateService, rate_service
+
+
+class TestRateService:
+    def test_batch_matches_single_conversions(self):
+        amounts = [100.0, 250.0, 10.0, 42.0]
+        currencies = ["USD", "EUR", "INR", "GBP"]
+        converted = rate_service.convert_batch(amounts, currencies, "GBP")
+        for amount, currency, result in zip(amounts, currencies, converted):
+            assert result == pytest.approx(convert_currency(amount, currency, "GBP"))
+
+    def test_historical_rates_match_converter(self):
+        converter = CurrencyConverter(
+            fallback_on_missing_rate=True,
+            fallback_on_missing_rate_method="last_known",
+            fallback_on_wrong_date=True,
+        )
+        # A weekday, a weekend and a day past the end of the history
+        days = [datetime.date(2015, 11, 2), datetime.date(2024, 11, 2)]
+        days.append(datetime.date.today() + datetime.timedelta(days=30))
+        for day in days:
+            assert rate_service.convert(100, "USD", "INR", day) == pytest.approx(
+                converter.convert(100, "USD", "INR", day)
+            )
+        converted = rate_service.convert_batch([100] * 3, ["USD"] * 3, "INR", days)
+        assert converted == pytest.approx(
+            [rate_service.convert(100, "USD", "INR", day) for day in days]
+        )
+
+    def test_rate_table_is_cached_on_disk(self, tmp_path):
+        RateService(str(tmp_path)).load()
+        assert len(list(tmp_path.glob("*.npy"))) == 1
+        service = RateService(str(tmp_path))
+        service.load()
+        assert isinstance(service.table, np.memmap)
+        assert service.rate("EUR", "EUR", datetime.date(2015, 11, 2)) == 1.0
+
+    def test_rate_table_dir_is_private(self, tmp_path):
+        RateService(str(tmp_path / "rates")).load()
+        assert (tmp_path / "rates").stat().st_mode & 0o777 == 0o700
+
+        tmp_path.chmod(0o777)
+        with pytest.raises(PermissionError, match="writable by other users"):
+            RateService(str(tmp_path)).load()
+
+    def test_batch_coerces_unsupported_currencies(self):
+        converted = rate_service.convert_batch(
+            [1.0, 2.0, 3.0],
+            ["USD", "XYZ", "XYZ"],
+            ["EUR", "EUR", "XYZ"],
+            errors="coerce",
+        )
+        assert not math.isnan(converted[0])
+        assert math.isnan(converted[1])
+        assert converted[2] == 3.0
+
+    def test_batch_raises_for_unsupported_currencies(self):
+        with pytest.raises(ValueError, match="XYZ is not a supported currency"):
+            rate_service.convert_batch([1.0], ["XYZ"], "USD")
+
+
+@pytest.mark.anyio
+class TestConvertBatchEndpoint:
+    async def test_convert_batch(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/currency/convert/batch",
+            json={
+                "amounts": [100, 1000, 5],
+                "currencies": ["usd", "INR", "EUR"],
+                "to_currency": "eur",
+                "dates": ["2024-11-01", None, None],
+            },
+        )
+        assert response.status_code == 200, response.json()
+        body = response.json()
+        assert body["to_currency"] == "EUR"
+        assert body["amounts"][0] == pytest.approx(
+            rate_service.convert(100, "USD", "EUR", datetime.date(2024, 11, 1))
+        )
+        assert body["amounts"][1] == pytest.approx(convert_currency(1000, "INR", "EUR"))
+        assert body["amounts"][2] == 5
+
+    async def test_length_mismatch(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/currency/convert/batch",
+            json={"amounts": [1, 2], "currencies": ["USD"], "to_currency": "EUR"},
+        )
+        assert response.status_code == 400
+
+    async def test_unsupported_currency(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/currency/convert/batch",
+            json={"amounts": [1], "currencies": ["XYZ"], "to_currency": "EUR"},
+        )
+        assert response.status_code == 400
+        assert "Currency conversion failed" in response.json()["detail"]
@@ -1,17 +1,22 @@
 # test_expenses.py
+import asyncio
 import datetime
 import io
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
 import openpyxl
 import pandas as pd
 import pytest
 from bson import ObjectId
+from currency_converter import CurrencyConverter  # type: ignore
 from fastapi import HTTPException
 from httpx import AsyncClient
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import AutoReconnect
 
 import api.routers.expenses
+import api.utils.csv_import
+from api.utils.currency import rate_service
 from config import MONGO_URI
 
 # MongoDB setup
@@ -63,6 +68,14 @@ class TestConvertCurrency:
             exc_info.value.detail
         ), "Exception message should indicate conversion failure"
 
+    # Test case for the precomputed latest-rate matrix
+    def test_rate_matrix_matches_converter(self):
+        converter = CurrencyConverter()
+        for from_cur, to_cur in [("USD", "INR"), ("EUR", "GBP"), ("JPY", "USD")]:
+            assert api.routers.expenses.convert_currency(
+                100, from_cur, to_cur
+            ) == pytest.approx(converter.convert(100, from_cur, to_cur))
+
 
 @pytest.mark.anyio
 class TestExpenseAdd:
@@ -202,6 +215,165 @@ class TestExpenseAdd:
         )
         assert response.status_code == 422, response.json()
 
+    async def test_converted_at_expense_date(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 100.0,
+                "currency": "EUR",
+                "category": "Food",
+                "account_name": "Savings",
+                "date": "2015-11-02T12:00:00",
+            },
+        )
+        assert response.status_code == 200, response.json()
+        expense = response.json()["expense"]
+        historical = rate_service.convert(
+            100.0, "EUR", "USD", datetime.date(2015, 11, 2)
+        )
+        assert expense["amount_in_account_currency"] == pytest.approx(historical)
+        assert expense["exchange_rate"] == pytest.approx(historical / 100.0)
+        assert historical != pytest.approx(rate_service.convert(100.0, "EUR", "USD"))
+
+        balance = response.json()["balance"]
+
+        # The refund uses the same historical rate as the debit
+        response = await async_client_auth.delete(f"/expenses/{expense['_id']}")
+        assert response.status_code == 200, response.json()
+        assert response.json()["balance"] == pytest.approx(balance + historical)
+
+
+@pytest.mark.anyio
+class TestExpenseAddConcurrency:
+    async def test_concurrent_posts_never_overdraw(
+        self, async_client_auth: AsyncClient
+    ):
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Concurrent 8f2", "balance": 100.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+
+        expense = {
+            "amount": 30.0,
+            "currency": "USD",
+            "category": "Food",
+            "account_name": "Concurrent 8f2",
+        }
+        responses = await asyncio.gather(
+            *(async_client_auth.post("/expenses/", json=expense) for _ in range(5))
+        )
+        statuses = sorted(response.status_code for response in responses)
+        assert statuses == [200, 200, 200, 400, 400]
+
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 10.0
+
+    async def test_concurrent_deletes_and_updates_keep_every_change(
+        self, async_client_auth: AsyncClient
+    ):
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Concurrent 5c1", "balance": 100.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+
+        expense_ids = []
+        for _ in range(6):
+            response = await async_client_auth.post(
+                "/expenses/",
+                json={
+                    "amount": 10.0,
+                    "currency": "USD",
+                    "category": "Food",
+                    "account_name": "Concurrent 5c1",
+                },
+            )
+            assert response.status_code == 200, response.json()
+            expense_ids.append(response.json()["expense"]["_id"])
+
+        # Three refunds of 10 and three extra debits of 5
+        responses = await asyncio.gather(
+            *(async_client_auth.delete(f"/expenses/{i}") for i in expense_ids[:3]),
+            *(
+                async_client_auth.put(f"/expenses/{i}", json={"amount": 15.0})
+                for i in expense_ids[3:]
+            ),
+        )
+        assert all(response.status_code == 200 for response in responses)
+
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 55.0
+
+
+@pytest.mark.anyio
+class TestExpenseBulkAdd:
+    async def test_mixed_batch(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Bulk 51c", "balance": 100.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+
+        item = {"currency": "usd", "category": "Food", "account_name": "Bulk 51c"}
+        response = await async_client_auth.post(
+            "/expenses/bulk",
+            json=[
+                {**item, "amount": 40.0},
+                {**item, "amount": 10.0, "category": "InvalidCategory"},
+                {**item, "amount": 10.0, "account_name": "InvalidAccount"},
+                {**item, "amount": 70.0},
+                {**item, "amount": 50.0},
+            ],
+        )
+        assert response.status_code == 200, response.json()
+        body = response.json()
+        assert body["inserted"] == 2
+        assert body["rejected"] == 3
+        assert [result["status"] for result in body["results"]] == [
+            "inserted",
+            "rejected",
+            "rejected",
+            "rejected",
+            "inserted",
+        ]
+        assert body["results"][2]["detail"] == "Invalid account type"
+        assert body["results"][3]["detail"].startswith("Insufficient balance")
+        assert body["balances"] == {"Bulk 51c": 10.0}
+
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 10.0
+
+        expense_id = body["results"][0]["_id"]
+        response = await async_client_auth.get(f"/expenses/{expense_id}")
+        assert response.status_code == 200, response.json()
+        assert response.json()["currency"] == "USD"
+
+    async def test_failed_insert_refunds_debits(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Bulk 8e3", "balance": 100.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+
+        item = {"currency": "usd", "category": "Food", "account_name": "Bulk 8e3"}
+        with patch(
+            "api.utils.bulk_expenses.expenses_collection",
+            insert_many=AsyncMock(side_effect=AutoReconnect("lost")),
+        ):
+            with pytest.raises(AutoReconnect):
+                await async_client_auth.post(
+                    "/expenses/bulk",
+                    json=[{**item, "amount": 30.0}, {**item, "amount": 20.0}],
+                )
+
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 100.0
+
 
 @pytest.mark.anyio
 class TestExpenseGet:
@@ -256,6 +428,61 @@ class TestExpenseGet:
         assert "_id" in response.json()
         assert response.json()["_id"] == expense_id
 
+    async def test_pagination_and_filters(self, async_client_auth: AsyncClient):
+        """
+        Test paging through a filtered expense list with the returned cursor.
+        """
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Paged 3e1", "balance": 1000.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        response = await async_client_auth.post(
+            "/expenses/bulk",
+            json=[
+                {
+                    "amount": 10.0 * (day + 1),
+                    "currency": "USD",
+                    "category": "Food",
+                    "account_name": "Paged 3e1",
+                    "date": f"2024-10-{day + 1:02d}T12:00:00",
+                }
+                for day in range(5)
+            ],
+        )
+        assert response.json()["inserted"] == 5, response.json()
+
+        amounts = []
+        cursor = None
+        for _ in range(3):
+            params = {"account_name": "Paged 3e1", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = await async_client_auth.get("/expenses/", params=params)
+            assert response.status_code == 200, response.json()
+            amounts += [expense["amount"] for expense in response.json()["expenses"]]
+            cursor = response.json()["next_cursor"]
+        assert amounts == [50.0, 40.0, 30.0, 20.0, 10.0]
+        assert cursor is None
+
+        response = await async_client_auth.get(
+            "/expenses/",
+            params={
+                "account_name": "Paged 3e1",
+                "start_date": "2024-10-02T00:00:00",
+                "end_date": "2024-10-05T00:00:00",
+                "min_amount": 25,
+            },
+        )
+        assert [e["amount"] for e in response.json()["expenses"]] == [40.0, 30.0]
+
+    async def test_invalid_cursor(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/expenses/", params={"cursor": "not-a-cursor"}
+        )
+        assert response.status_code == 400, response.json()
+        assert response.json()["detail"] == "Invalid cursor"
+
     async def test_not_found(self, async_client_auth: AsyncClient):
         """
         Test to retrieve an expense by a non-existent ID.
@@ -488,6 +715,29 @@ class TestExpenseDelete:
         assert response.status_code == 200
         assert response.json()["message"] == "Expense deleted successfully"
 
+    async def test_refunds_stored_amount(self, async_client_auth: AsyncClient):
+        add_response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 20.0,
+                "currency": "EUR",
+                "category": "Shopping",
+                "account_name": "Checking",
+            },
+        )
+        assert add_response.status_code == 200, add_response.json()
+        expense_id = add_response.json()["expense"]["_id"]
+        balance = add_response.json()["balance"]
+
+        # The refund is the stored amount, not a fresh conversion
+        await expenses_collection.update_one(
+            {"_id": ObjectId(expense_id)},
+            {"$set": {"amount_in_account_currency": 7.5}},
+        )
+        response = await async_client_auth.delete(f"/expenses/{expense_id}")
+        assert response.status_code == 200, response.json()
+        assert response.json()["balance"] == pytest.approx(balance + 7.5)
+
     async def test_specific_404(self, async_client_auth: AsyncClient):
         response = await async_client_auth.delete("/expenses/507f1f77bcf86cd799439011")
         assert response.status_code == 404
@@ -665,6 +915,36 @@ class TestExpenseDeleteAllWithMultipleScenarios:
             updated_balance = response.json()["account"]["balance"]
             assert updated_balance == initial_balance
 
+    async def test_mixed_currencies(self, async_client_auth: AsyncClient):
+        initial_balance = 5000.0
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Mixed 5e0", "balance": initial_balance, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+
+        for amount, currency in [(100.0, "EUR"), (250.0, "GBP"), (40.0, "EUR")]:
+            response = await async_client_auth.post(
+                "/expenses/",
+                json={
+                    "amount": amount,
+                    "currency": currency,
+                    "category": "Food",
+                    "account_name": "Mixed 5e0",
+                },
+            )
+            assert response.status_code == 200, response.json()
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] < initial_balance - 390.0
+
+        response = await async_client_auth.delete("/expenses/all")
+        assert response.status_code == 200, response.json()
+
+        # Refunds are converted back into the account's currency
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == pytest.approx(initial_balance)
+
     async def test_no_expenses(self, async_client_auth: AsyncClient):
         # Ensure no expenses exist
         response = await async_client_auth.get("/expenses/")
@@ -798,8 +1078,14 @@ class TestCSVImportExport:
 
     async def test_csv_import_large_file(self, async_client_auth: AsyncClient):
         """Test importing a large CSV file."""
+        # Its own account, so the shared Checking balance is left for later tests
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Import large", "balance": 500000.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
         large_data = "\n".join(
-            [f"Grocery,{i},USD,Food,Checking,2024-11-01" for i in range(1000)]
+            [f"Grocery,{i},USD,Food,Import large,2024-11-01" for i in range(1000)]
         )
         csv_data = io.BytesIO(
             f"description,amount,currency,category,account_name,date\n{large_data}".encode()
@@ -810,6 +1096,83 @@ class TestCSVImportExport:
         )
         assert response.status_code == 200
         assert "Expenses imported successfully" in response.json()["message"]
+        assert response.json()["inserted"] == 1000
+
+    async def test_csv_import_rejects_overdrafts(self, async_client_auth: AsyncClient):
+        """Test that rows the account balance does not cover are rejected."""
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Import 2b9", "balance": 100.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+
+        rows = "\n".join(
+            [
+                "First,60,USD,Food,Import 2b9,2024-11-01",
+                "Too much,50,USD,Food,Import 2b9,2024-11-01",
+                ",,,,,",
+                "Still fits,40,USD,Food,Import 2b9,2024-11-01",
+            ]
+        )
+        csv_data = io.BytesIO(
+            f"description,amount,currency,category,account_name,date\n{rows}".encode()
+        )
+        response = await async_client_auth.post(
+            "/expenses/import/csv",
+            files={"file": ("overdraft.csv", csv_data, "text/csv")},
+        )
+        assert response.status_code == 200, response.json()
+        body = response.json()
+        assert body["parsed"] == 4
+        assert body["inserted"] == 2
+        assert body["rejected"] == 2
+        assert body["errors"] == [
+            {"row": 2, "detail": "Insufficient balance in Import 2b9 account"},
+            {"row": 3, "detail": "Empty row"},
+        ]
+
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 0.0
+
+    async def test_csv_import_report_and_balance(self, async_client_auth: AsyncClient):
+        """Test that an import reports rejected rows and debits the account once."""
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Import 7c1", "balance": 500.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+
+        rows = "\n".join(
+            [f"Row {i},{i},usd,Food,Import 7c1,2024-11-01" for i in range(1, 21)]
+            + [
+                "Bad amount,abc,USD,Food,Import 7c1,2024-11-01",
+                "Bad account,5,USD,Food,Missing 7c1,2024-11-01",
+                "Bad date,5,USD,Food,Import 7c1,not-a-date",
+            ]
+        )
+        csv_data = io.BytesIO(
+            f"description,amount,currency,category,account_name,date\n{rows}".encode()
+        )
+        with patch("api.utils.csv_import.CSV_IMPORT_CHUNK_ROWS", 7):
+            response = await async_client_auth.post(
+                "/expenses/import/csv",
+                files={"file": ("report.csv", csv_data, "text/csv")},
+            )
+        assert response.status_code == 200, response.json()
+        body = response.json()
+        assert body["parsed"] == 23
+        assert body["inserted"] == 20
+        assert body["rejected"] == 3
+        assert body["errors"] == [
+            {"row": 21, "detail": "Invalid amount"},
+            {"row": 22, "detail": "Invalid account name"},
+            {"row": 23, "detail": "Invalid date"},
+        ]
+
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 500.0 - 210.0
 
     async def test_csv_import_wrong_file_type(self, async_client_auth: AsyncClient):
         """Test importing a non-CSV file."""
@@ -823,6 +1186,227 @@ class TestCSVImportExport:
         assert "Invalid file format" in response.json()["detail"]
 
 
+@pytest.mark.anyio
+class TestImportJobs:
+    async def wait_for_job(self, client: AsyncClient, job_id: str) -> dict:
+        for _ in range(100):
+            response = await client.get(f"/expenses/import/jobs/{job_id}")
+            assert response.status_code == 200, response.json()
+            if response.json()["status"] not in ("queued", "running"):
+                return response.json()
+            await asyncio.sleep(0.1)
+        raise AssertionError("Import job did not finish")
+
+    async def test_job_progress(self, async_client_auth: AsyncClient):
+        rows = "\n".join(
+            [f"Job row {i},1,USD,Food,Checking,2024-11-01" for i in range(25)]
+            + ["Bad row,abc,USD,Food,Checking,2024-11-01"]
+        )
+        csv_data = io.BytesIO(
+            f"description,amount,currency,category,account_name,date\n{rows}".encode()
+        )
+        with patch("api.utils.csv_import.CSV_IMPORT_CHUNK_ROWS", 10):
+            response = await async_client_auth.post(
+                "/expenses/import/jobs",
+                files={"file": ("job.csv", csv_data, "text/csv")},
+            )
+            assert response.status_code == 202, response.json()
+            job = await self.wait_for_job(async_client_auth, response.json()["job_id"])
+        assert job["status"] == "completed", job
+        assert job["parsed"] == 26
+        assert job["inserted"] == 25
+        assert job["rejected"] == 1
+        assert job["errors"] == [{"row": 26, "detail": "Invalid amount"}]
+
+        response = await async_client_auth.delete(
+            f"/expenses/import/jobs/{job['job_id']}"
+        )
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Import job is already completed"
+
+    async def test_resumed_job_skips_stored_rows(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Resume 4d2", "balance": 30.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+        user = await users_collection.find_one({"username": "testuser"})
+        rows = "\n".join(
+            [f"Resume {i},10,USD,Food,Resume 4d2,2024-11-01" for i in range(3)]
+        )
+        csv = f"description,amount,currency,category,account_name,date\n{rows}"
+        job_id = ObjectId()
+
+        # The second run is a job resumed after its rows were written but
+        # before its checkpoint was recorded; its stored rows are not checked
+        # against the balance they already spent
+        for _ in range(2):
+            report = await api.utils.csv_import.import_csv_expenses(
+                str(user["_id"]), io.BytesIO(csv.encode()), job_id=job_id
+            )
+            assert report["inserted"] == 3, report
+            assert report["rejected"] == 0, report
+
+        assert (
+            await expenses_collection.count_documents({"account_name": "Resume 4d2"})
+            == 3
+        )
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 0.0
+
+    async def test_failed_insert_refunds_debit(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Refund 7c1", "balance": 30.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+        user = await users_collection.find_one({"username": "testuser"})
+        csv = (
+            "description,amount,currency,category,account_name,date\n"
+            "Refund,10,USD,Food,Refund 7c1,2024-11-01"
+        )
+
+        with patch(
+            "api.utils.csv_import.insert_csv_rows", side_effect=Exception("lost")
+        ):
+            with pytest.raises(Exception, match="lost"):
+                await api.utils.csv_import.import_csv_expenses(
+                    str(user["_id"]), io.BytesIO(csv.encode()), job_id=ObjectId()
+                )
+
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"] == {
+            "_id": account_id,
+            "user_id": str(user["_id"]),
+            "name": "Refund 7c1",
+            "balance": 30.0,
+            "currency": "USD",
+        }
+
+    async def test_stopped_run_debits_are_reconciled(
+        self, async_client_auth: AsyncClient
+    ):
+        response = await async_client_auth.post(
+            "/accounts/",
+            json={"name": "Stopped 7c1", "balance": 30.0, "currency": "USD"},
+        )
+        assert response.status_code == 200, response.json()
+        account_id = response.json()["account_id"]
+        user = await users_collection.find_one({"username": "testuser"})
+        rows = "\n".join(
+            [f"Stopped {i},10,USD,Food,Stopped 7c1,2024-11-01" for i in range(2)]
+        )
+        csv = f"description,amount,currency,category,account_name,date\n{rows}"
+        job_id = ObjectId()
+
+        # The first run stops between debiting the account and settling the
+        # debit, as when its worker dies
+        with patch(
+            "api.utils.csv_import.insert_csv_rows", side_effect=Exception("stopped")
+        ), patch(
+            "api.utils.csv_import.settle_import_debit",
+            side_effect=Exception("stopped"),
+        ):
+            with pytest.raises(Exception, match="stopped"):
+                await api.utils.csv_import.import_csv_expenses(
+                    str(user["_id"]), io.BytesIO(csv.encode()), job_id=job_id
+                )
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 10.0
+
+        await api.utils.csv_import.reconcile_import_debits(job_id)
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 30.0
+
+        report = await api.utils.csv_import.import_csv_expenses(
+            str(user["_id"]), io.BytesIO(csv.encode()), job_id=job_id
+        )
+        assert report["inserted"] == 2, report
+        response = await async_client_auth.get(f"/accounts/{account_id}")
+        assert response.json()["account"]["balance"] == 10.0
+
+    async def test_job_not_found(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(f"/expenses/import/jobs/{ObjectId()}")
+        assert response.status_code == 404
+        response = await async_client_auth.delete("/expenses/import/jobs/invalid")
+        assert response.status_code == 404
+
+    async def test_job_wrong_file_type(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/expenses/import/jobs",
+            files={"file": ("test.txt", io.BytesIO(b"Not a CSV"), "text/plain")},
+        )
+        assert response.status_code == 400
+        assert "Invalid file format" in response.json()["detail"]
+
+
+@pytest.mark.anyio
+class TestExpenseExport:
+    async def test_formats(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 1.0,
+                "currency": "USD",
+                "category": "Food",
+                "description": "Export 3d2",
+                "account_name": "Savings",
+                "date": "2011-02-03T00:00:00",
+            },
+        )
+        assert response.status_code == 200, response.json()
+        params = {"start_date": "2011-02-01", "end_date": "2011-03-01"}
+
+        response = await async_client_auth.get(
+            "/expenses/export",
+            params={**params, "format": "ndjson", "columns": "description,amount"},
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert response.text.splitlines() == [
+            '{"description": "Export 3d2", "amount": 1.0}'
+        ]
+
+        response = await async_client_auth.get(
+            "/expenses/export", params={**params, "format": "csv"}
+        )
+        assert response.status_code == 200
+        content = pd.read_csv(io.StringIO(response.text))
+        assert list(content.columns) == [
+            "description",
+            "amount",
+            "currency",
+            "category",
+            "account_name",
+            "date",
+        ]
+        assert content["description"].tolist() == ["Export 3d2"]
+
+        response = await async_client_auth.get(
+            "/expenses/export", params={**params, "format": "parquet"}
+        )
+        assert response.status_code == 200
+        content = pd.read_parquet(io.BytesIO(response.content))
+        assert content["description"].tolist() == ["Export 3d2"]
+        assert content["date"].tolist() == [pd.Timestamp("2011-02-03")]
+
+    async def test_invalid_parameters(self, async_client_auth: AsyncClient):
+        response = await async_client_auth.get(
+            "/expenses/export", params={"format": "xml"}
+        )
+        assert response.status_code == 400
+        assert "Invalid export format" in response.json()["detail"]
+        response = await async_client_auth.get(
+            "/expenses/export", params={"columns": "amount,user_id"}
+        )
+        assert response.status_code == 400
+        assert "Invalid export columns" in response.json()["detail"]
+
+
 @pytest.mark.anyio
 class TestCSVExportSimplified:
     async def test_csv_export_basic(self, async_client_auth: AsyncClient):
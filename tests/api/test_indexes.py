@@ -0,0 +1,21 @@
+import pytest
+
+from api.utils import db
+from api.utils.indexes import INDEXES, ensure_indexes, find_collection_scans
+
+
+@pytest.mark.anyio
+class TestIndexManifest:
+    async def test_ensure_indexes_is_idempotent(self):
+        database = db.get_database()
+        first = await ensure_indexes(database)
+        second = await ensure_indexes(database)
+        assert first == second
+        for collection, models in INDEXES.items():
+            existing = await database[collection].index_information()
+            for model in models:
+                assert model.document["name"] in existing
+
+    async def test_hot_queries_use_indexes(self):
+        await ensure_indexes(db.get_database())
+        assert await find_collection_scans(db.get_database()) == []
@@ -0,0 +1,126 @@
+import datetime
+
+import pytest
+from httpx import AsyncClient
+
+from api.routers.analytics import CATEGORY_KEY, aggregate_expenses
+from api.utils import db
+from api.utils.rollups import (
+    DAY,
+    MONTH,
+    compute_rollups,
+    expense_deltas,
+    rebuild_user_rollups,
+    rollup_match,
+    rollups_match,
+    stored_rollups,
+)
+
+
+async def current_user_id() -> str:
+    user = await db.get_database().users.find_one({"username": "testuser"})
+    return str(user["_id"])
+
+
+class TestExpenseDeltas:
+    def test_day_and_month(self):
+        expense = {
+            "amount": 10.0,
+            "amount_in_account_currency": 12.0,
+            "category": "Food",
+            "account_name": "Checking",
+            # 23:30 at UTC-5 is the next day in UTC
+            "date": datetime.datetime(
+                2024,
+                1,
+                31,
+                23,
+                30,
+                tzinfo=datetime.timezone(-datetime.timedelta(hours=5)),
+            ),
+        }
+        deltas = expense_deltas([expense, expense], {"Checking": "USD"}, sign=-1)
+        assert deltas == {
+            (DAY, "2024-02-01", "Food", "Checking", "USD"): (-24.0, -2),
+            (MONTH, "2024-02", "Food", "Checking", "USD"): (-24.0, -2),
+        }
+
+    def test_window_match(self):
+        first_day = datetime.date(2024, 3, 15)
+        assert rollup_match("u", first_day, months=False)["kind"] == DAY
+        kinds = [part["kind"] for part in rollup_match("u", first_day, True)["$or"]]
+        assert kinds == [DAY, MONTH]
+        assert rollup_match("u", datetime.date(2024, 3, 1), True)["kind"] == MONTH
+
+
+@pytest.mark.anyio
+class TestRollupMaintenance:
+    async def test_writes_keep_rollups_in_sync(self, async_client_auth: AsyncClient):
+        user_id = await current_user_id()
+        database = db.get_database()
+        # Start from rollups that match, whatever earlier tests did to the data
+        await rebuild_user_rollups(database, user_id)
+
+        response = await async_client_auth.post(
+            "/expenses/",
+            json={
+                "amount": 12.0,
+                "currency": "EUR",
+                "category": "Food",
+                "account_name": "Checking",
+            },
+        )
+        assert response.status_code == 200, response.json()
+        expense_id = response.json()["expense"]["_id"]
+        response = await async_client_auth.post(
+            "/expenses/bulk",
+            json=[
+                {
+                    "amount": 3.0,
+                    "currency": "USD",
+                    "category": "Transport",
+                    "account_name": "Checking",
+                    "date": "2024-02-10T08:00:00",
+                }
+            ],
+        )
+        assert response.status_code == 200, response.json()
+        response = await async_client_auth.put(
+            f"/expenses/{expense_id}",
+            json={"category": "Groceries", "date": "2024-01-20T10:00:00"},
+        )
+        assert response.status_code == 200, response.json()
+
+        expected = await compute_rollups(database, user_id)
+        assert rollups_match(expected, await stored_rollups(database, user_id))
+
+        response = await async_client_auth.delete(f"/expenses/{expense_id}")
+        assert response.status_code == 200, response.json()
+        expected = await compute_rollups(database, user_id)
+        assert rollups_match(expected, await stored_rollups(database, user_id))
+
+    async def test_analytics_match_expenses(self, async_client_auth: AsyncClient):
+        user_id = await current_user_id()
+        from_rollups = await aggregate_expenses(user_id, 400, CATEGORY_KEY)
+        await db.get_database().users.update_one(
+            {"username": "testuser"}, {"$set": {"rollups_ready": False}}
+        )
+        try:
+            from_expenses = await aggregate_expenses(user_id, 400, CATEGORY_KEY)
+        finally:
+            await db.get_database().users.update_one(
+                {"username": "testuser"}, {"$set": {"rollups_ready": True}}
+            )
+        assert from_rollups[0] == from_expenses[0]
+        assert from_rollups[1] == pytest.approx(from_expenses[1])
+
+    async def test_rebuild(self, async_client_auth: AsyncClient):
+        user_id = await current_user_id()
+        database = db.get_database()
+        await database.rollups.delete_many({"user_id": user_id})
+
+        assert await rebuild_user_rollups(database, user_id) > 0
+        user = await database.users.find_one({"username": "testuser"})
+        assert user["rollups_ready"]
+        expected = await compute_rollups(database, user_id)
+        assert rollups_match(expected, await stored_rollups(database, user_id))
@@ -6,6 +6,8 @@ import pytest
 from httpx import ASGITransport, AsyncClient
 
 from api.app import app
+from api.utils import db
+from api.utils.auth import publish_revocation, revocation_watch, token_cache
 from config import TOKEN_ALGORITHM, TOKEN_SECRET_KEY
 
 
@@ -144,6 +146,71 @@ class TestTokenDelete:
         assert response.json()["detail"] == "Token not found"
 
 
+@pytest.mark.anyio
+class TestTokenCache:
+    async def test_repeat_requests_hit_cache(self, async_client: AsyncClient):
+        token_cache.clear()
+        response = await async_client.get("/users/")
+        assert response.status_code == 200, response.json()
+        response = await async_client.get("/users/")
+        assert response.status_code == 200, response.json()
+        assert token_cache.misses == 1
+        assert token_cache.hits == 1
+
+    async def test_expired_jwt_is_not_cached(self, async_client: AsyncClient):
+        payload = {
+            "sub": "507f1f77bcf86cd799439011",
+            "exp": datetime.datetime.now(datetime.timezone.utc)
+            - datetime.timedelta(minutes=1),
+        }
+        token_cache.set("stale", ("507f1f77bcf86cd799439011", "x"), ttl=-1)
+        assert token_cache.get("stale") is None
+        expired_token = jwt.encode(
+            payload, str(TOKEN_SECRET_KEY), algorithm=TOKEN_ALGORITHM or "HS256"
+        )
+        response = await async_client.get("/users/", headers={"token": expired_token})
+        assert response.status_code == 401
+        assert token_cache.get(expired_token) is None
+
+    async def new_cached_token(self, async_client: AsyncClient) -> dict:
+        response = await async_client.post(
+            "/users/token/",
+            data={"username": "usertestuser", "password": "usertestpassword"},
+        )
+        assert response.status_code == 200, response.json()
+        result = response.json()["result"]
+        response = await async_client.get("/users/", headers={"token": result["token"]})
+        assert response.status_code == 200, response.json()
+        assert token_cache.get(result["token"]) is not None
+        return result
+
+    async def test_rejected_after_delete_token(self, async_client: AsyncClient):
+        result = await self.new_cached_token(async_client)
+        response = await async_client.delete(f"/users/token/{result['_id']}")
+        assert response.status_code == 200, response.json()
+        response = await async_client.get("/users/", headers={"token": result["token"]})
+        assert response.status_code == 401
+
+    async def test_rejected_after_logout(self, async_client: AsyncClient):
+        result = await self.new_cached_token(async_client)
+        response = await async_client.post(
+            "/users/logout/", headers={"cookie": f"access_token={result['token']}"}
+        )
+        assert response.status_code == 200, response.json()
+        response = await async_client.get("/users/", headers={"token": result["token"]})
+        assert response.status_code == 401
+
+    async def test_rejected_after_revocation_elsewhere(self, async_client: AsyncClient):
+        result = await self.new_cached_token(async_client)
+        # Another worker deletes the token; this one only sees the counter
+        await db.get_database().tokens.delete_one({"token": result["token"]})
+        await publish_revocation()
+        revocation_watch.expire()
+        response = await async_client.get("/users/", headers={"token": result["token"]})
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Token does not exist"
+
+
 @pytest.mark.anyio
 class TestUserGetter:
     async def test_get_user(self, async_client: AsyncClient):
@@ -151,6 +218,7 @@ class TestUserGetter:
         assert response.status_code == 200
         assert "username" in response.json()
         assert response.json()["username"] == "usertestuser"
+        assert "password" not in response.json()
 
 
 @pytest.mark.anyio